@@ -0,0 +1,81 @@
+import json
+import time
+import template_expansion
+import template_snapshot
+from schema_domain import build_domains
+
+'''
+Compares the solver engines of template_expansion.constraint_solver per template.
+Every engine has to produce the same solution set as python-constraint, the
+reference engine.
+
+    python benchmark_solver.py [engine ...]
+'''
+
+REFERENCE_ENGINE = "python-constraint"
+
+
+def solve_all(compiled, domains, engine):
+    """
+    Solves a template against every schema, returns the wall time and solution keys.
+    """
+    solutions = []
+    start = time.perf_counter()
+    for domain in domains:
+        solutions.append(template_expansion.constraint_solver(
+            compiled["samples"],
+            compiled["fields"],
+            compiled["locations"],
+            compiled["expanded_constraints"],
+            domain.sample_options,
+            domain.field_options,
+            domain.location_options,
+            engine=engine,
+            domain=domain,
+        ))
+    elapsed = time.perf_counter() - start
+    keys = sorted(
+        (domain_index, solution_key(solution))
+        for domain_index, domain_solutions in enumerate(solutions)
+        for solution in domain_solutions
+    )
+    return elapsed, keys
+
+
+def solution_key(solution):
+    return tuple(sorted((k, v.get("entity"), v.get("name")) for k, v in solution.items()))
+
+
+def main(engines):
+    df = template_snapshot.load_templates()
+    with open('./datasets/output_catalogue.json') as f:
+        domains = build_domains(json.load(f))
+
+    header = f"{'#':>3} {'solutions':>9} {REFERENCE_ENGINE:>17}" + "".join(f" {e:>14} {'speedup':>8}" for e in engines)
+    print(header + "  template")
+    totals = {engine: 0.0 for engine in [REFERENCE_ENGINE] + engines}
+    for index, row in df.iterrows():
+        compiled = template_expansion.get_compiled_template(row)
+        reference_time, reference = solve_all(compiled, domains, REFERENCE_ENGINE)
+        totals[REFERENCE_ENGINE] += reference_time
+        line = f"{index:>3} {len(reference):>9} {reference_time:>16.3f}s"
+        for engine in engines:
+            elapsed, keys = solve_all(compiled, domains, engine)
+            totals[engine] += elapsed
+            if keys != reference:
+                raise ValueError(f"Engine {engine} found a different solution set for template {index}")
+            line += f" {elapsed:>13.3f}s {reference_time / max(elapsed, 1e-9):>7.1f}x"
+        print(line + "  " + row["query_template"][:60])
+
+    line = f"{'all':>3} {'':>9} {totals[REFERENCE_ENGINE]:>16.3f}s"
+    for engine in engines:
+        line += f" {totals[engine]:>13.3f}s {totals[REFERENCE_ENGINE] / max(totals[engine], 1e-9):>7.1f}x"
+    print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the template expansion solver engines')
+    parser.add_argument('engines', nargs='*', default=["backtracking"], help='Engines to compare against python-constraint')
+    args = parser.parse_args()
+    main(args.engines)
@@ -0,0 +1,235 @@
+import os
+import numpy as np
+import pandas as pd
+from frictionless import formats
+
+'''
+Bounded memory profiling of the columns of a data package resource for
+process_datapackage, the table is read and profiled in chunks.
+
+Per column the distinct non-null values are counted exactly (as 64 bit hashes) up to
+a threshold, above it the count switches to a HyperLogLog sketch. The templates
+compare udi:cardinality against small bounds (<= 25, <= 100, ...), which stay exact.
+Whether a column is unique (no nulls and no repeated value) is tracked exactly, as
+long as it holds the hashes of the column are kept, so unique columns (keys) also
+get an exact cardinality. The non-null overlap of the columns is accumulated as a
+columns x columns matrix.
+
+Resources up to IN_MEMORY_BYTES are read as a single typed frame (resource.to_pandas,
+see read_frame), larger ones are read with pandas in chunks of CHUNK_ROWS rows, with integer, number, boolean and array columns parsed so the values compare as
+in the typed frame.
+'''
+
+# distinct values counted exactly up to this many per column
+EXACT_DISTINCT_THRESHOLD = 10_000
+
+# the sketch has 2 ** HLL_PRECISION registers, the standard error is 1.04 / sqrt(2 ** HLL_PRECISION)
+HLL_PRECISION = 14
+
+# resources with larger files are read in chunks instead of as a whole
+IN_MEMORY_BYTES = 64 * 1024 * 1024
+
+# rows per chunk of the resources read in chunks
+CHUNK_ROWS = 100_000
+
+
+class HyperLogLog:
+    """
+    Distinct count estimate of 64 bit hashes in 2 ** precision registers.
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def add(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        # rank = position of the first set bit of the remaining bits
+        rank = (64 - self.precision) - bit_length(remainder) + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # small range correction (linear counting)
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+def bit_length(values):
+    """
+    int.bit_length of every value of a uint64 array.
+    """
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = values >= np.uint64(1 << shift)
+        lengths[mask] += shift
+        values[mask] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+class DistinctCounter:
+    """
+    Distinct count of a column from the hashes of its non-null values, exact up to
+    threshold, estimated by a HyperLogLog sketch above it. unique stays True as long
+    as there are no nulls and no repeated values.
+    """
+
+    def __init__(self, threshold=EXACT_DISTINCT_THRESHOLD):
+        self.threshold = threshold
+        # sorted distinct hashes, None once counted by the sketch
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.sketch = None
+        self.values = 0
+        self.unique = True
+
+    def add(self, hashes, nulls=0):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        self.values += len(hashes)
+        if nulls:
+            self.unique = False
+        if self.sketch is not None:
+            self.sketch.add(hashes)
+            return
+        self.hashes = np.union1d(self.hashes, hashes)
+        if len(self.hashes) != self.values:
+            self.unique = False
+        if len(self.hashes) > self.threshold and not self.unique:
+            # only unique columns keep their hashes beyond the threshold
+            self.sketch = HyperLogLog()
+            self.sketch.add(self.hashes)
+            self.hashes = None
+
+    @property
+    def exact(self):
+        return self.sketch is None
+
+    def count(self):
+        if self.sketch is None:
+            return len(self.hashes)
+        return min(self.sketch.count(), self.values)
+
+
+class TableProfile:
+    """
+    Row count, distinct counts of the counted columns, uniqueness of the multi-column
+    keys and non-null overlap of the columns of a table, added chunk by chunk.
+    """
+
+    def __init__(self, counted=(), keys=(), threshold=EXACT_DISTINCT_THRESHOLD):
+        self.rows = 0
+        self.columns = None
+        self.counters = {column: DistinctCounter(threshold) for column in counted}
+        # uniqueness only, the keys are never counted by the sketch
+        self.keys = {key: DistinctCounter(float("inf")) for key in keys}
+        # overlap[i, j]: a row has both column i and column j
+        self.overlap = None
+
+    def add(self, chunk):
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            self.overlap = np.zeros((len(self.columns), len(self.columns)), dtype=bool)
+        self.rows += len(chunk)
+        for column, counter in self.counters.items():
+            values = chunk[column]
+            present = values.notnull()
+            counter.add(hash_values(values[present]), nulls=len(values) - int(present.sum()))
+        for key, counter in self.keys.items():
+            counter.add(hash_values(chunk[list(key)]))
+        patterns = np.unique(chunk.notnull().to_numpy(), axis=0).astype(np.int64)
+        self.overlap |= (patterns.T @ patterns) > 0
+
+    def cardinality(self, column):
+        return self.counters[column].count() if self.rows else 0
+
+    def unique(self, column):
+        return self.counters[column].unique
+
+    def unique_key(self, key):
+        # Can't really determine based on empty data so give "safer" answer.
+        return self.rows > 0 and self.keys[tuple(key)].unique
+
+    def overlapping(self, column):
+        """
+        The columns that are non-null in a row where column is, 'all' if that is every
+        column that isn't empty.
+        """
+        i = self.columns.index(column)
+        if not self.overlap[i, i]:
+            # No overlapping fields
+            return []
+        related = [c for c, overlaps in zip(self.columns, self.overlap[i]) if overlaps]
+        if len(related) == int(np.count_nonzero(np.diag(self.overlap))):
+            return 'all'
+        return related
+
+
+def hash_values(values):
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+def read_frame(resource, in_memory_bytes=IN_MEMORY_BYTES):
+    """
+    The whole table of a resource, resource.to_pandas().reset_index(), if its file is
+    small, None if it has to be read in chunks (see read_chunks).
+    """
+    if os.path.getsize(resource.normpath) > in_memory_bytes:
+        return None
+    return resource.to_pandas().reset_index()
+
+
+def read_chunks(resource, chunk_rows=CHUNK_ROWS):
+    """
+    Yields the table of a resource as data frames of chunk_rows rows with the columns
+    of resource.to_pandas().reset_index().
+    """
+    # detects the encoding (from a sample of the file) like reading the resource would
+    resource.infer()
+    schema = resource.schema
+    control = formats.CsvControl.from_dialect(resource.dialect)
+    if resource.format == "tsv":
+        control.set_not_defined("delimiter", "\t")
+    # the csv dialect frictionless reads with, e.g. doubleQuote is only turned off with an escapeChar
+    dialect = control.to_python()
+    # the primary key is the index of to_pandas, reset_index moves it to the front
+    primary_key = list(schema.primary_key)
+    columns = primary_key + [field.name for field in schema.fields if field.name not in primary_key]
+    if not primary_key:
+        columns = ["index"] + columns
+    reader = pd.read_csv(
+        resource.normpath,
+        encoding=resource.encoding,
+        sep=dialect.delimiter,
+        quotechar=dialect.quotechar or '"',
+        quoting=dialect.quoting,
+        doublequote=dialect.doublequote,
+        escapechar=dialect.escapechar,
+        skipinitialspace=dialect.skipinitialspace,
+        dtype=str,
+        keep_default_na=False,
+        na_values=list(schema.missing_values),
+        chunksize=chunk_rows,
+    )
+    start = 0
+    for chunk in reader:
+        for field in schema.fields:
+            if field.type == "integer":
+                chunk[field.name] = pd.to_numeric(chunk[field.name], errors="coerce").astype("Int64")
+            elif field.type == "number":
+                # astype rounds like float(), to_numeric can be off in the last digit
+                valid = pd.to_numeric(chunk[field.name], errors="coerce").notna()
+                chunk[field.name] = chunk[field.name].where(valid).astype("float64")
+            elif field.type in ("boolean", "array"):
+                # read by the field like resource.to_pandas, e.g. "TRUE" -> True, '["a"]' -> ["a"]
+                # object in every chunk, the hashes of a bool column differ
+                chunk[field.name] = chunk[field.name].map(field.create_value_reader(), na_action="ignore").astype(object)
+        if not primary_key:
+            chunk.insert(0, "index", range(start, start + len(chunk)))
+        start += len(chunk)
+        yield chunk[columns]
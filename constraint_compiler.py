@@ -0,0 +1,431 @@
+import ast
+import io
+import json
+import keyword
+import re
+import tokenize
+from functools import lru_cache
+from typing import List, Dict, Union
+
+'''
+Compiles the template constraint mini-language into Python callables.
+
+Template constraints are written as python expressions over the template tags:
+    F.c * 2 < E.c               cardinality of a field and row count of a sample
+    E2.F.name not in E1.fields  field names of a sample
+    E1.r.E2.c.to == 'one'       cardinality of the relationship from E1 to E2
+    L.chr == 'chr1'             chromosome of a location (locus or gene region)
+    <F:p.q>.c < 1000            a tag written as in the query, its type is left out
+    F1['name'] in F2['udi:overlapping_fields'] or F2['udi:overlapping_fields'] == 'all'
+
+They are parsed with the python parser and the tag references are lowered to
+subscripts of the solver variables (e.g. F.c -> E_F['udi:cardinality']). Every
+compiled constraint is a dict that can be persisted with the template snapshot:
+    kind       "generic", "bind" (field belongs to sample), "different" (all-different)
+               or "overlap" (field overlaps with another field, see match_overlap)
+    variables  the solver variables the constraint reads
+    attribute  the attribute that has to differ, only for "different"
+    source     the lowered python expression
+The lowered source is turned into a function of the variables once and cached,
+so it is shared by every schema and solver run of a template.
+'''
+
+SAMPLE_PATTERN = re.compile(r"[ES][0-9]*")
+FIELD_PATTERN = re.compile(r"[FL][0-9]*")
+VARIABLE_PATTERN = re.compile(r"[ES][0-9]*(?:_[FL][0-9]*)?")
+# a tag in a constraint, <F:p.q> or <E1.F1:n>, only the tag path (group 1) is kept
+TAG_REFERENCE_PATTERN = re.compile(r"<((?:[ES][0-9]*\.)?[FL][0-9]*|[ES][0-9]*)(?::[a-z.&|]+)?>")
+
+# tag attributes that can be used in constraints
+ATTRIBUTES = {
+    "c": "udi:cardinality",
+    "name": "name",
+    "fields": "fields",
+    "entity": "entity",
+    "url": "url",
+    # locations, see schema_domain.GenomeIndex
+    "chr": "chromosome",
+    "start": "start",
+    "end": "end",
+    "length": "length",
+    "kind": "kind",
+    "genes": "genes",
+    "gene_count": "gene_count",
+}
+
+
+def compile_constraints(
+    constraints: List[str],
+    tags: List[Dict[str, Union[str, List[str]]]],
+    default_sample: str,
+    symmetric: List[List[str]] = (),
+) -> List[Dict[str, Union[str, List[str]]]]:
+    """
+    Compiles the constraints of a template and adds the constraints implied by the tags:
+    field types, unique fields, unique samples and fields belonging to their sample.
+    symmetric are groups of interchangeable tags (e.g. [["F1", "F2"]]), see symmetry_constraints.
+    """
+    compiled = []
+    for constraint in constraints:
+        lowering = ConstraintLowering(default_sample)
+        try:
+            source = TAG_REFERENCE_PATTERN.sub(r"\1", constraint.strip())
+            tree = ast.parse(escape_keywords(source), mode="eval")
+        except (SyntaxError, tokenize.TokenError) as e:
+            raise ValueError(f"Invalid constraint: {constraint}. {e}")
+        lowered = lowering.visit(tree)
+        # relationship constraints are only valid if the relationship exists
+        for sample, related in lowering.relationships:
+            compiled.append(generic_constraint(f"has_foreign_key({sample}, {related})"))
+        overlap = match_overlap(lowered)
+        if overlap is not None:
+            compiled.append({"kind": "overlap", "variables": list(overlap), "source": ast.unparse(lowered)})
+        else:
+            compiled.append(generic_constraint(ast.unparse(lowered)))
+
+    # Turn field types into constraints
+    for tag in tags:
+        if tag["field"]:
+            compiled.append(generic_constraint(
+                f"{tag['sample']}_{tag['field']}['udi:data_type'] in {tag['allowed_fields']}"
+            ))
+
+    # Ensure fields are not repeated
+    unique_fields = sorted(set(
+        str(tag["sample"]) + "_" + tag["field"] for tag in tags if tag["field"]
+    ))
+    if len(unique_fields) > 1:
+        compiled.append(different_constraint(unique_fields, "name"))
+
+    # ensure that samples are not repeated
+    unique_samples = sorted(set(tag["sample"] for tag in tags))
+    if len(unique_samples) > 1:
+        compiled.append(different_constraint(unique_samples, "entity"))
+
+    # ensure that fields belong to their sample
+    for field in unique_fields:
+        sample = field.split("_")[0]
+        compiled.append({
+            "kind": "bind",
+            "variables": [field, sample],
+            "source": f"{field}['entity'] == {sample}['entity']",
+        })
+
+    for group in symmetric:
+        compiled.extend(symmetry_constraints(group, compiled, tags, default_sample))
+    return compiled
+
+
+def symmetry_constraints(group, compiled, tags, default_sample):
+    """
+    Orders a group of interchangeable tags, so only one of the solutions that differ by
+    swapping them is kept. The constraints have to be the same after any swap within
+    the group, the template spec is assumed not to depend on the order. The fields of
+    an overlap constraint are interchangeable as long as neither is empty (see
+    symmetry_key), e.g. when the template asks for their cardinality to be > 10.
+    Fields are ordered by entity and name, samples by entity.
+    """
+    lowering = ConstraintLowering(default_sample)
+    variables = []
+    for tag in group:
+        variable, rest = lowering.resolve_variable(tag.split("."))
+        if rest or variable in variables:
+            raise ValueError(f"Invalid symmetric group: {group}")
+        variables.append(variable)
+    tag_types = {
+        (tag["sample"] + "_" + tag["field"] if tag["field"] else tag["sample"]): tag["allowed_fields"]
+        for tag in tags if not tag["location"]
+    }
+    if (
+        len(variables) < 2
+        or any(variable not in tag_types for variable in variables)
+        or len({"_" in variable for variable in variables}) != 1
+        or any(tag_types[variable] != tag_types[variables[0]] for variable in variables)
+    ):
+        raise ValueError(f"Invalid symmetric group: {group}, the tags have to be samples or fields of the same type")
+
+    # swapping neighbours generates every permutation of the group
+    constraint_keys = sorted(symmetry_key(constraint, {}) for constraint in compiled)
+    for i, (first, second) in enumerate(zip(variables, variables[1:])):
+        swapped = sorted(symmetry_key(constraint, {first: second, second: first}) for constraint in compiled)
+        if swapped != constraint_keys:
+            raise ValueError(f"Invalid symmetric group: {group}, the constraints change when {group[i]} and {group[i + 1]} are swapped")
+
+    ordered = []
+    for first, second in zip(variables, variables[1:]):
+        if "_" in first:
+            source = (
+                f"{first}['entity'] < {second}['entity'] or "
+                f"({first}['entity'] == {second}['entity'] and {first}['name'] < {second}['name'])"
+            )
+        else:
+            source = f"{first}['entity'] < {second}['entity']"
+        ordered.append(generic_constraint(source))
+    return ordered
+
+
+def symmetry_key(compiled, renames):
+    """
+    A compiled constraint with renamed variables, comparable with other constraints.
+    Overlap is compared unordered: udi:overlapping_fields are the fields that are
+    non-null in the same rows (see column_profile.overlapping), so two non-empty
+    fields overlap both ways.
+    """
+    variables = [renames.get(variable, variable) for variable in compiled["variables"]]
+    if compiled["kind"] in ("different", "overlap"):
+        return json.dumps([compiled["kind"], sorted(variables), compiled.get("attribute")])
+    tree = ast.parse(compiled["source"], mode="eval")
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            node.id = renames.get(node.id, node.id)
+    return json.dumps([compiled["kind"], variables, ast.unparse(tree)])
+
+
+# attributes that only depend on the structure of a schema (resources, field names,
+# data types and foreign keys) and not on its data
+STRUCTURAL_ATTRIBUTES = {"entity", "name", "fields", "udi:data_type"}
+
+
+def is_structural(compiled):
+    """
+    True if the constraint only reads structural attributes, schemas with the same
+    structure (see SchemaDomain.structure_key) have the same solutions for it.
+    """
+    if compiled["kind"] == "bind":
+        return True
+    if compiled["kind"] == "different":
+        return compiled["attribute"] in STRUCTURAL_ATTRIBUTES
+    if compiled["kind"] == "overlap":
+        return False
+    for node in ast.walk(ast.parse(compiled["source"], mode="eval")):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+            if not (isinstance(node.slice, ast.Constant) and node.slice.value in STRUCTURAL_ATTRIBUTES):
+                return False
+        elif isinstance(node, ast.Call):
+            # has_foreign_key only depends on the foreign key graph, foreign_key_cardinality on the data
+            if not (isinstance(node.func, ast.Name) and node.func.id == "has_foreign_key"):
+                return False
+        elif isinstance(node, ast.Name) and node.id in CONSTRAINT_GLOBALS and node.id != "has_foreign_key":
+            return False
+    return True
+
+
+def constraint_attributes(compiled):
+    """
+    The option attributes a compiled constraint reads, relationships read the foreignKeys.
+    """
+    if compiled["kind"] == "bind":
+        return {"entity"}
+    if compiled["kind"] == "different":
+        return {compiled["attribute"]}
+    if compiled["kind"] == "overlap":
+        return {"entity", "name", "udi:overlapping_fields"}
+    attributes = set()
+    for node in ast.walk(ast.parse(compiled["source"], mode="eval")):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and isinstance(node.slice, ast.Constant):
+            attributes.add(node.slice.value)
+        elif isinstance(node, ast.Name) and node.id in CONSTRAINT_GLOBALS:
+            attributes.update({"entity", "foreignKeys"})
+    return attributes
+
+
+def generic_constraint(source):
+    return {"kind": "generic", "variables": list(get_variables(source)), "source": source}
+
+
+def different_constraint(variables, attribute):
+    values = ", ".join(f"{variable}['{attribute}']" for variable in variables)
+    return {
+        "kind": "different",
+        "variables": variables,
+        "attribute": attribute,
+        "source": f"len({{{values}}}) == {len(variables)}",
+    }
+
+
+def match_overlap(tree):
+    """
+    Returns (field, other) if the lowered constraint is the overlap constraint of template_generation
+        field['name'] in other['udi:overlapping_fields'] or other['udi:overlapping_fields'] == 'all'
+    the solvers check it with the bitsets of schema_domain.OverlapIndex.
+    """
+    node = tree.body if isinstance(tree, ast.Expression) else tree
+    if not (isinstance(node, ast.BoolOp) and isinstance(node.op, ast.Or) and len(node.values) == 2):
+        return None
+    membership, everything = node.values
+    if match_compare(membership, ast.In) is None:
+        membership, everything = everything, membership
+    membership = match_compare(membership, ast.In)
+    everything = match_compare(everything, ast.Eq)
+    if membership is None or everything is None:
+        return None
+    (field, field_attribute), (other, other_attribute) = membership
+    if (
+        field_attribute == "name"
+        and other_attribute == "udi:overlapping_fields"
+        and everything == [(other, other_attribute), ("constant", "all")]
+        and field not in (other, "constant")
+    ):
+        return field, other
+    return None
+
+
+def match_compare(node, op):
+    """
+    Matches variable['attribute'] <op> variable['attribute'] or a constant, returns both
+    sides as (variable, attribute) or ("constant", value).
+    """
+    if not (isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], op)):
+        return None
+    sides = [match_subscript(node.left), match_subscript(node.comparators[0])]
+    if sides[0] is None or sides[1] is None:
+        return None
+    return sides
+
+
+def match_subscript(node):
+    if isinstance(node, ast.Constant):
+        return "constant", node.value
+    if (
+        isinstance(node, ast.Subscript)
+        and isinstance(node.value, ast.Name)
+        and VARIABLE_PATTERN.fullmatch(node.value.id)
+        and isinstance(node.slice, ast.Constant)
+    ):
+        return node.value.id, node.slice.value
+    return None
+
+
+class ConstraintLowering(ast.NodeTransformer):
+    """
+    Rewrites tag references in a parsed constraint into subscripts of solver variables.
+    """
+
+    def __init__(self, default_sample):
+        self.default_sample = default_sample
+        # (sample, related sample) pairs used by E1.r.E2 references
+        self.relationships = []
+
+    def visit_Name(self, node):
+        variable = self.resolve_variable([node.id])[0]
+        return ast.copy_location(ast.Name(id=variable, ctx=ast.Load()), node)
+
+    def visit_Attribute(self, node):
+        parts = attribute_chain(node)
+        if parts is None:
+            return self.generic_visit(node)
+        variable, rest = self.resolve_variable(parts)
+        if len(rest) == 4 and rest[0] == "r" and rest[2] == "c" and rest[3] in ("to", "from_"):
+            related = rest[1]
+            if not SAMPLE_PATTERN.fullmatch(related):
+                raise ValueError(f"Invalid relationship constraint: {'.'.join(parts)}")
+            self.relationships.append((variable, related))
+            direction = rest[3].rstrip("_")
+            lowered = f"foreign_key_cardinality({variable}, {related}, '{direction}')"
+        elif len(rest) == 1 and rest[0] in ATTRIBUTES:
+            lowered = f"{variable}['{ATTRIBUTES[rest[0]]}']"
+        else:
+            raise ValueError(f"Invalid constraint reference: {'.'.join(parts)}")
+        return ast.copy_location(ast.parse(lowered, mode="eval").body, node)
+
+    def resolve_variable(self, parts):
+        """
+        Splits a tag reference into the solver variable and the remaining attributes.
+            E1.F1.c -> E1_F1, [c]
+            F.c -> E_F, [c]  (using the default sample)
+        """
+        first = parts[0]
+        if SAMPLE_PATTERN.fullmatch(first):
+            if len(parts) > 1 and FIELD_PATTERN.fullmatch(parts[1]):
+                return f"{first}_{parts[1]}", parts[2:]
+            return first, parts[1:]
+        if FIELD_PATTERN.fullmatch(first):
+            return f"{self.default_sample}_{first}", parts[1:]
+        raise ValueError(f"Unknown tag in constraint: {first}")
+
+
+def escape_keywords(constraint):
+    """
+    E1.r.E2.c.from is not valid python, attributes named like a keyword get a trailing underscore.
+    """
+    tokens = list(tokenize.generate_tokens(io.StringIO(constraint).readline))
+    escaped = []
+    for i, token in enumerate(tokens):
+        previous = tokens[i - 1] if i > 0 else None
+        if (
+            token.type == tokenize.NAME
+            and keyword.iskeyword(token.string)
+            and previous is not None
+            and previous.type == tokenize.OP
+            and previous.string == "."
+        ):
+            token = token._replace(string=token.string + "_")
+        escaped.append((token.type, token.string))
+    return tokenize.untokenize(escaped)
+
+
+def attribute_chain(node):
+    """
+    Returns the names of a chain of attributes (E1.r.E2.c.to), None for other expressions.
+    """
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return list(reversed(parts))
+
+
+def get_variables(source):
+    """
+    Solver variables read by a lowered constraint.
+    """
+    variables = []
+    for node in ast.walk(ast.parse(source, mode="eval")):
+        if isinstance(node, ast.Name) and VARIABLE_PATTERN.fullmatch(node.id) and node.id not in variables:
+            variables.append(node.id)
+    return tuple(variables)
+
+
+# compiled functions kept by compile_function, the key includes the ForeignKeyIndex of
+# a schema so the cache is bounded to not keep the indexes of every schema alive
+COMPILED_FUNCTION_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=COMPILED_FUNCTION_CACHE_SIZE)
+def compile_function(source, variables, foreign_key_index=None):
+    """
+    Compiles a lowered constraint into a function taking the variable values positionally.
+    With a schema_domain.ForeignKeyIndex the relationship helpers are lookups in the index
+    instead of scans over the foreignKeys of the sample.
+    """
+    constraint_globals = dict(CONSTRAINT_GLOBALS)
+    if foreign_key_index is not None:
+        constraint_globals.update(foreign_key_index.constraint_globals())
+    return eval(f"lambda {', '.join(variables)}: {source}", constraint_globals)
+
+
+def foreign_key_cardinality(sample, related, direction):
+    """
+    Cardinality ('one' or 'many') of the foreign key from sample to related, None without one.
+    """
+    matched = None
+    for foreign_key in sample["foreignKeys"]:
+        # like a lookup table built from the foreign keys, the last matching key wins
+        if foreign_key["reference"]["resource"] == related["entity"]:
+            matched = foreign_key
+    if matched is None:
+        return None
+    return matched["udi:cardinality"][direction]
+
+
+def has_foreign_key(sample, related):
+    return any(fk["reference"]["resource"] == related["entity"] for fk in sample["foreignKeys"])
+
+
+CONSTRAINT_GLOBALS = {
+    "foreign_key_cardinality": foreign_key_cardinality,
+    "has_foreign_key": has_foreign_key,
+}
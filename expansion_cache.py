@@ -0,0 +1,158 @@
+import copy
+import hashlib
+import json
+import os
+import pyarrow as pa
+from constraint_compiler import constraint_attributes
+from template_snapshot import hash_modules
+
+'''
+Persists the solutions of every template family x schema pair between runs, so a
+rerun only solves the pairs whose inputs changed (a new template, a re-profiled
+data package) and reuses the rest.
+
+A pair is keyed by the family signature of the template (its variables and compiled
+constraints, see template_expansion.family_signature) and a fingerprint of the
+schema that only covers the option attributes the constraints of the family read
+(see SchemaDomain.get_fingerprint), e.g. new row counts don't invalidate templates
+that don't constrain udi:cardinality. The query and spec are resolved from the
+solutions on every run, so they aren't part of the key. The solutions are stored as option positions in the
+canonical order of template_expansion.order_solutions, so the cached rows are
+spliced back in the same order as a fresh run.
+
+The cache is an Arrow IPC file like the template snapshot, and is dropped when the
+solver modules change.
+'''
+
+EXPANSION_CACHE_PATH = "./out/cache/expansion_cache.arrow"
+
+# modules that decide the solutions, a change to any of them invalidates the cache
+SOLVER_MODULES = ["template_solver", "numpy_solver", "constraint_compiler", "schema_domain", "template_expansion"]
+
+# attributes every template reads: fields are bound to their sample
+BASE_ATTRIBUTES = {"entity"}
+
+
+class ExpansionCache:
+    """
+    Solutions by (family signature, schema fingerprint), loaded from and saved to path.
+    """
+
+    def __init__(self, path=EXPANSION_CACHE_PATH, reuse=True):
+        self.path = path
+        self.solver_hash = hash_modules(SOLVER_MODULES)
+        # key -> solutions as rows of option positions, loaded lazily from self.table
+        self.table = None
+        self.rows = {}
+        if reuse:
+            self.table = read_cache(path, self.solver_hash)
+        if self.table is not None:
+            self.rows = {key: i for i, key in enumerate(self.table.column("key").to_pylist())}
+        # key -> solutions of the pairs expanded in this run, the only ones saved
+        self.used = {}
+
+    def key(self, signature, compiled, domain):
+        attributes = set(BASE_ATTRIBUTES)
+        for constraint in compiled["expanded_constraints"]:
+            attributes |= constraint_attributes(constraint)
+        content = json.dumps([signature, domain.get_fingerprint(attributes)])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key, compiled, domain):
+        """
+        The cached solutions of a pair as options of domain, None if it isn't cached.
+        """
+        if key in self.used:
+            rows = self.used[key]
+        elif key in self.rows:
+            rows = self.table.column("solutions")[self.rows[key]].as_py()
+            self.used[key] = rows
+        else:
+            return None
+        variables = get_variables(compiled)
+        option_lists = domain.get_option_lists()
+        return [
+            {
+                variable: option_lists[list_index][position]
+                for (variable, list_index), position in zip(variables, row)
+            }
+            for row in rows
+        ]
+
+    def put(self, key, compiled, domain, solutions):
+        self.used[key] = [
+            [domain.positions[id(solution[variable])][1] for variable, _ in get_variables(compiled)]
+            for solution in solutions
+        ]
+
+    def fork(self):
+        """
+        A cache for a worker, it shares the loaded table (read only) but collects its own
+        used pairs, see take_used.
+        """
+        forked = copy.copy(self)
+        forked.used = {}
+        return forked
+
+    def take_used(self):
+        """
+        Returns and forgets the pairs used so far, the parallel workers send them to
+        the cache of the main process.
+        """
+        used, self.used = self.used, {}
+        return used
+
+    def merge(self, used):
+        self.used.update(used)
+
+    def reused_count(self):
+        """
+        How many of the pairs used in this run were loaded from the previous run, counted
+        on the merged pairs so a parallel run reports the same totals as a serial one.
+        """
+        return sum(key in self.rows for key in self.used)
+
+    def save(self):
+        reused = self.reused_count()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        keys = sorted(self.used)
+        table = pa.table({
+            "key": pa.array(keys, pa.string()),
+            "solutions": pa.array([self.used[key] for key in keys], pa.list_(pa.list_(pa.int32()))),
+        })
+        table = table.replace_schema_metadata({"solver_hash": self.solver_hash})
+        # the loaded table may be memory mapped from the file that is replaced
+        self.table = None
+        self.rows = {}
+        tmp_path = self.path + ".tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self.path)
+        print(f"Reused {reused:,} of {len(keys):,} template family x schema solutions, cache saved to {self.path}")
+
+
+def get_variables(compiled):
+    """
+    (variable, option list index) in the order of the stored positions.
+    """
+    return (
+        [(variable, 0) for variable in compiled["samples"]]
+        + [(variable, 1) for variable in compiled["fields"]]
+        + [(variable, 2) for variable in compiled["locations"]]
+    )
+
+
+def read_cache(path, solver_hash):
+    if not os.path.exists(path):
+        return None
+    try:
+        with pa.memory_map(path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        print(f"Failed to read expansion cache, solving every pair: {e}")
+        return None
+    metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+    if metadata.get("solver_hash") != solver_hash:
+        return None
+    return table
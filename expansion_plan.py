@@ -0,0 +1,91 @@
+import json
+import os
+import pandas as pd
+import template_expansion
+from schema_domain import build_domains
+from solution_catalogue import SolutionCatalogue
+
+'''
+Dry run of the template expansion: counts the solutions of every template x schema
+pair without building the expanded rows, and estimates the size of the run.
+
+The export sizes are estimated from one expanded row per template x schema pair,
+the paraphrase calls assume one LLM call per expanded row (an upper bound, cached
+paraphrases are not called again).
+'''
+
+PLAN_PATH = "./out/expansion_plan.csv"
+
+
+def plan(df, dataset_schemas, engine="backtracking"):
+    """
+    Returns a DataFrame with the solution count and estimated row sizes of every
+    template x schema pair.
+    """
+    domains = build_domains(dataset_schemas)
+    catalogue = SolutionCatalogue(dataset_schemas)
+    records = []
+    for label, row in df.iterrows():
+        row, compiled = template_expansion.prepare_template(row)
+        for domain in domains:
+            solutions = template_expansion.count_template_solutions(compiled, domain, engine)
+            json_bytes, parquet_bytes = estimate_row_bytes(row, compiled, domain, catalogue) if solutions else (0, 0)
+            records.append({
+                "template": label,
+                "query_template": row["query_template"],
+                "chart_type": row["chart_type"],
+                "chart_complexity": row["chart_complexity"],
+                "dataset_schema": domain.name,
+                "solutions": solutions,
+                "json_bytes": solutions * json_bytes,
+                "parquet_bytes": solutions * parquet_bytes,
+            })
+    return pd.DataFrame(records)
+
+
+def estimate_row_bytes(row, compiled, domain, catalogue):
+    """
+    Size of one exported row of the template, as JSON with the readable solution
+    and with the solution names instead of the solution (like the parquet export).
+    """
+    solution = next(template_expansion.backtracking_solver(compiled, domain).iter_solutions(), None)
+    if solution is None:
+        return 0, 0
+    expanded = template_expansion.expand_template(row, compiled, domain, solutions=[solution])[0]
+    names = catalogue.solution_names(expanded["solution"])
+    expanded["solution"] = catalogue.materialize_solution(expanded["solution"])
+    # the columns added when paraphrasing
+    expanded.update({"query": expanded["query_base"], "expertise": -1, "formality": -1})
+    json_bytes = len(json.dumps(expanded, default=str))
+    expanded.pop("solution")
+    expanded.update(names)
+    return json_bytes, len(json.dumps(expanded, default=str))
+
+
+def print_plan(plan_df, top=10):
+    rows = plan_df["solutions"].sum()
+    print(f"Templates x schemas: {len(plan_df):,} ({(plan_df['solutions'] > 0).sum():,} with solutions)")
+    print(f"Expanded rows: {rows:,}")
+    print(f"Paraphrase calls (at most): {rows:,}")
+    print(f"JSON / SQLite export: ~{plan_df['json_bytes'].sum() / 1e6:,.1f} MB")
+    print(f"Parquet export (uncompressed): ~{plan_df['parquet_bytes'].sum() / 1e6:,.1f} MB")
+
+    print("\nRows by chart type and complexity:")
+    by_chart = plan_df.pivot_table(
+        index="chart_type", columns="chart_complexity", values="solutions", aggfunc="sum", fill_value=0
+    )
+    print(by_chart.to_string())
+
+    print(f"\nLargest {top} template x schema pairs:")
+    largest = plan_df.nlargest(top, "solutions")
+    for _, row in largest.iterrows():
+        print(f"{row['solutions']:>10,}  {row['dataset_schema']:<24} {row['query_template'][:60]}")
+
+
+def main(df, dataset_schemas, engine="backtracking", plan_path=PLAN_PATH):
+    plan_df = plan(df, dataset_schemas, engine)
+    print_plan(plan_df)
+    os.makedirs(os.path.dirname(plan_path), exist_ok=True)
+    plan_df.to_csv(plan_path, index=False)
+    print(f"\nPlan saved to {plan_path}")
+    return plan_df
@@ -0,0 +1,121 @@
+import json
+import os
+import time
+import pandas as pd
+import template_expansion
+from numpy_solver import NumpySolver
+from schema_domain import build_domains
+
+'''
+Profiles the expansion of every template x schema pair, to find the templates that
+dominate the runtime. Per pair it records
+    domain sizes       options per variable before and after the unary constraints
+    checks             candidate values tested against a constraint (backtracking only)
+    solve_seconds      wall time of the solver, including building it
+    solutions          number of solutions
+    resolve_seconds    wall time of resolving the query and spec templates
+
+Every pair is solved on its own, without the family and structure sharing of
+template_expansion.SolutionCache, so the times add up to more than a normal run.
+'''
+
+PROFILE_PATH = "./out/expansion_profile"
+
+# engines that expose their domains after the unary constraints
+PROFILED_ENGINES = ["backtracking", "numpy"]
+
+
+def profile(df, dataset_schemas, engine="backtracking"):
+    """
+    Returns a DataFrame with the profile of every template x schema pair.
+    """
+    if engine not in PROFILED_ENGINES:
+        raise ValueError(f"Profiling is not supported for the {engine} engine, expected one of {PROFILED_ENGINES}")
+    domains = build_domains(dataset_schemas)
+    records = []
+    for label, row in df.iterrows():
+        row, compiled = template_expansion.prepare_template(row)
+        for domain in domains:
+            records.append(profile_pair(label, row, compiled, domain, engine))
+    return pd.DataFrame(records)
+
+
+def profile_pair(label, row, compiled, domain, engine):
+    variables = compiled["samples"] + compiled["fields"] + compiled["locations"]
+    before = {variable: len(options) for variable, options in zip(variables, variable_options(compiled, domain))}
+
+    start = time.perf_counter()
+    if engine == "numpy":
+        solver = NumpySolver(
+            compiled["samples"],
+            compiled["fields"],
+            compiled["locations"],
+            compiled["expanded_constraints"],
+            domain.sample_options,
+            domain.field_options,
+            domain.location_options,
+            domain.get_columns(),
+            domain.overlap_index,
+            domain.foreign_key_index,
+        )
+    else:
+        solver = template_expansion.backtracking_solver(compiled, domain)
+    after = {variable: len(solver.domains[variable]) for variable in variables}
+    solutions = template_expansion.order_solutions(solver.get_solutions(), compiled, domain)
+    solve_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    template_expansion.expand_template(row, compiled, domain, solutions=solutions)
+    resolve_seconds = time.perf_counter() - start
+
+    return {
+        "template": label,
+        "query_template": row["query_template"],
+        "chart_type": row["chart_type"],
+        "dataset_schema": domain.name,
+        "options_before": sum(before.values()),
+        "options_after": sum(after.values()),
+        "domain_sizes": {variable: [before[variable], after[variable]] for variable in variables},
+        "checks": solver.checks if engine == "backtracking" else None,
+        "solutions": len(solutions),
+        "solve_seconds": solve_seconds,
+        "resolve_seconds": resolve_seconds,
+        "total_seconds": solve_seconds + resolve_seconds,
+    }
+
+
+def variable_options(compiled, domain):
+    return (
+        [domain.sample_options for _ in compiled["samples"]]
+        + [domain.field_options for _ in compiled["fields"]]
+        + [domain.location_options for _ in compiled["locations"]]
+    )
+
+
+def print_profile(profile_df, top=20):
+    print(
+        f"Profiled {len(profile_df):,} template x schema pairs: "
+        f"{profile_df['solve_seconds'].sum():.2f}s solving, "
+        f"{profile_df['resolve_seconds'].sum():.2f}s resolving, "
+        f"{profile_df['solutions'].sum():,} solutions"
+    )
+    print(f"\nSlowest {top} template x schema pairs:")
+    hot = profile_df.nlargest(top, "total_seconds")
+    print(f"{'total':>8} {'solve':>8} {'resolve':>8} {'checks':>10} {'solutions':>9} {'options':>13}  {'schema':<24} template")
+    for _, row in hot.iterrows():
+        checks = "" if pd.isna(row["checks"]) else f"{int(row['checks']):,}"
+        options = f"{row['options_before']:,}>{row['options_after']:,}"
+        print(
+            f"{row['total_seconds']:>7.3f}s {row['solve_seconds']:>7.3f}s {row['resolve_seconds']:>7.3f}s "
+            f"{checks:>10} {row['solutions']:>9,} {options:>13}  {row['dataset_schema']:<24} {row['query_template'][:50]}"
+        )
+
+
+def main(df, dataset_schemas, engine="backtracking", profile_path=PROFILE_PATH):
+    profile_df = profile(df, dataset_schemas, engine)
+    print_profile(profile_df)
+    os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+    profile_df.assign(domain_sizes=profile_df["domain_sizes"].map(json.dumps)).to_csv(profile_path + ".csv", index=False)
+    profile_df.to_json(profile_path + ".json", orient="records", indent=2)
+    print(f"\nProfile saved to {profile_path}.csv and {profile_path}.json")
+    return profile_df
@@ -4,11 +4,14 @@ import json
 from frictionless import Package
 import pandas as pd
 
-def main():
+def main(write_resources=True):
+    """
+    Without write_resources only the packages are written, the resources were already
+    written by process_datapackage.main while profiling them (insert_references).
+    """
     datasets_path = "./datasets"
     input_catalogue = os.path.join(datasets_path, "input_catalogue.json")
-    reference_df = pd.read_csv(os.path.join(datasets_path, "C2M2_reference.tsv"), delimiter='\t')
-    out_path = './out/'
+    reference_df = read_reference_values(datasets_path)
     datapackage_list = []
     with open(input_catalogue, 'r') as f:
         data_packages = json.load(f)
@@ -17,8 +20,8 @@ def main():
                 continue
             name = data_package['outName']
             print('Inserting Reference Values into Data Package:', name)
-            data_package_out_path = os.path.join(out_path, os.path.dirname(name))
-            datapackage = insert_reference_values(name, reference_df, data_package_out_path, not data_package['c2m2'])
+            data_package_out_path = get_out_path(data_package)
+            datapackage = insert_reference_values(name, reference_df, data_package_out_path, not data_package['c2m2'], write_resources)
             datapackage_list.append(datapackage)
 
 
@@ -29,7 +32,14 @@ def main():
 
     return
 
-def insert_reference_values(in_path, ref_df, out_path, pass_through):
+def read_reference_values(datasets_path="./datasets"):
+    return pd.read_csv(os.path.join(datasets_path, "C2M2_reference.tsv"), delimiter='\t')
+
+def get_out_path(data_package, out_path='./out/'):
+    # the resources and the package are written next to each other
+    return os.path.join(out_path, os.path.dirname(data_package['outName']))
+
+def insert_reference_values(in_path, ref_df, out_path, pass_through, write_resources=True):
     """
     for every resource in the datapackage, add the reference values based on the
     reference_df.
@@ -41,16 +51,8 @@ def insert_reference_values(in_path, ref_df, out_path, pass_through):
 
     for resource in package.resources:
         ephemeral_print(resource.name)
-        df = resource.to_pandas()
-        df = df.reset_index()
-        if not pass_through:
-            df = df.replace(ref_df['id'].tolist(), ref_df['name'].tolist())
-
-        # print('\n...exporting')
-        # export the updated datapackage resource to the out_path
-        file_out_path = os.path.join(out_path, resource.name + '.tsv')
-        # print('\n', file_out_path)
-        df.to_csv(file_out_path, sep='\t', index=False)
+        if write_resources:
+            write_resource(resource, resource.to_pandas().reset_index(), ref_df, out_path, pass_through)
         if pass_through:
             continue
         for field in resource.schema.fields:
@@ -65,6 +67,17 @@ def insert_reference_values(in_path, ref_df, out_path, pass_through):
     package.to_json(file_out_path)
     return json.load(open(file_out_path, 'r'))
 
+def write_resource(resource, df, ref_df, out_path, pass_through, append=False):
+    """
+    Exports the table of a resource (resource.to_pandas() with the index reset) to
+    out_path, with the reference values inserted unless pass_through.
+    With append df is a later chunk of the table, added to the file without a header.
+    """
+    if not pass_through:
+        df = df.replace(ref_df['id'].tolist(), ref_df['name'].tolist())
+    os.makedirs(out_path, exist_ok=True)
+    df.to_csv(os.path.join(out_path, resource.name + '.tsv'), sep='\t', index=False, mode='a' if append else 'w', header=not append)
+
 def ephemeral_print(message):
     sys.stdout.write("\r\033[K")  # Clear the line
     sys.stdout.write(f"\t{message}")
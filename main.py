@@ -1,7 +1,6 @@
-from udi_grammar_py import Chart, Op, rolling
 import pandas as pd
 import sys
-import template_generation
+import template_snapshot
 import process_datapackage
 import insert_reference_values
 import template_expansion
@@ -9,6 +8,12 @@ import paraphraser
 import upload_to_huggingface
 import export_sqlite
 import json
+import expansion_plan
+import expansion_profile
+from solution_catalogue import SolutionCatalogue, solution_name_columns
+from solution_sampling import SamplingPolicy
+from expansion_cache import ExpansionCache
+from template_solver import SolveBudget
 
 sys.path.append('.')
 
@@ -22,25 +27,71 @@ GENERATE_SQLITE = False # Set to True if you want to export the data to SQLite D
 GENERATE_JSON = False # Set to True if you want to export the data to JSON
 SAMPLE_SQLITE = False # Set to True if you want to subsample the data for SQLite DB
 GENERATE_PARQUET = False # Set to True if you want to export the data to parquet
+SOLVER_ENGINE = "backtracking" # constraint solver used to expand the templates, see template_expansion.constraint_solver
+JOBS = 1 # number of processes used to profile the data packages and expand the templates
+EXACT_CARDINALITY = 10_000 # distinct values per column counted exactly when profiling the data packages, larger cardinalities are estimated
+EXECUTOR = "process" # pool of the --jobs workers, "thread" shares the schemas instead of pickling them (scales on free-threaded Python 3.13)
+STREAM_PARQUET = False # expand straight to parquet in batches, skips paraphrasing and the other exports
+PLAN = False # only count the solutions per template and schema and estimate the size of the run
+TARGET_SIZE = None # number of expanded rows to sample, None expands every solution
+STRATIFY = [] # split the target size evenly over templates, schemas, chart types and/or complexities, see solution_sampling
+SAMPLING_SEED = 0 # seed of the sampling, the same seed gives the same rows
+PROFILE_EXPANSION = False # only profile the solver per template and schema, see expansion_profile
+BUDGET_SECONDS = None # time budget per template and schema solve, the solutions found so far are kept when it runs out
+BUDGET_STEPS = None # search step budget per template and schema solve, like BUDGET_SECONDS
+REBUILD_EXPANSION_CACHE = False # solve every template and schema again instead of reusing the unchanged ones from ./out/cache
 
 def main():
 
     print_header("1. Generate templates")
-    df = template_generation.generate()
+    # compiled templates are loaded from a snapshot unless the template modules changed
+    df = template_snapshot.load_templates()
     template_question_count = df.shape[0]
 
     # update data schema based on files in ./datasets folder and export updated data packages
     if UPDATE_SCHEMA:
         print('Updating data schema')
-        process_datapackage.main()
-        insert_reference_values.main()
+        # the resources are written with their reference values while they are profiled,
+        # each file is parsed once and only one table is held at a time
+        process_datapackage.main(JOBS, EXACT_CARDINALITY, insert_references=True)
+        insert_reference_values.main(write_resources=False)
 
 
     print_header("2. Contextualize templates with real entity names and fields")
     # Contextualize the template training data by putting in real entity names and fields if they satisfy the constraints.
     with open('./datasets/output_catalogue.json') as f:
         schema_list = json.load(f)
-        df = template_expansion.expand(df, schema_list)
+    sampling = SamplingPolicy(TARGET_SIZE, STRATIFY, SAMPLING_SEED) if TARGET_SIZE is not None else None
+    budget = None
+    if BUDGET_SECONDS is not None or BUDGET_STEPS is not None:
+        budget = SolveBudget(BUDGET_SECONDS, BUDGET_STEPS, SAMPLING_SEED)
+    cache = None
+    if sampling is None:
+        cache = ExpansionCache(reuse=not REBUILD_EXPANSION_CACHE)
+    elif budget is not None:
+        # sampled templates are never fully solved, there is nothing to time box or to cache
+        print('Warning: --target_size samples the solutions, the solve budget is ignored.')
+    if PROFILE_EXPANSION:
+        print_header("profiling the expansion, no rows are kept...")
+        expansion_profile.main(df, schema_list, engine=SOLVER_ENGINE)
+        return
+    if PLAN:
+        print_header("planning the expansion, no rows are generated...")
+        expansion_plan.main(df, schema_list, engine=SOLVER_ENGINE)
+        return
+    if STREAM_PARQUET:
+        print_header("exporting ./out/training_data.parquet in batches...")
+        batches = template_expansion.expand_iter(df, schema_list, engine=SOLVER_ENGINE, jobs=JOBS, sampling=sampling, cache=cache, budget=budget, executor=EXECUTOR)
+        # the solution is dropped, the <variable>_name columns are kept for filtering
+        catalogue = SolutionCatalogue(schema_list)
+        name_columns = solution_name_columns(df)
+        batches = (catalogue.add_solution_names(add_unparaphrased_query(batch), name_columns) for batch in batches)
+        rows = template_expansion.write_parquet(batches, './out/training_data.parquet')
+        save_run_metadata(budget, sampling)
+        print(f"Generated {template_question_count:,} templates and expanded to {rows:,} questions.")
+        return
+    df = template_expansion.expand(df, schema_list, engine=SOLVER_ENGINE, jobs=JOBS, sampling=sampling, cache=cache, budget=budget, executor=EXECUTOR)
+    save_run_metadata(budget, sampling)
 
     print_header("3. Paraphrase the contextualized templates")
     # The paraphraser will use LLM to paraphrase the query_base into several options
@@ -62,6 +113,12 @@ def main():
     print(f"Generated {template_question_count:,} templates and expanded to {expanded_question_count:,} questions and paraphrased to {paraphrased_question_count:,}.")
 
     print_header("5. Export data")
+    # the expanded solutions are compact references into the catalogue, exports get the readable form
+    catalogue = SolutionCatalogue(schema_list)
+    if GENERATE_PARQUET:
+        # flattened entity and field names (E_name, E_F1_name, ...) for filtering the parquet export
+        solution_names = catalogue.add_solution_columns(pd.DataFrame({"solution": list(df["solution"])}))
+    df = catalogue.materialize(df)
     if GENERATE_SQLITE:
         print_header('Exporting data to SQLite DB')
         # ## Export as SQLite DB
@@ -73,8 +130,11 @@ def main():
 
     if GENERATE_PARQUET:
         print_header("exporting ./out/training_data.parquet...")
-        # drop solution since parquet is not supported
-        df.drop(["solution"], axis=1).to_parquet('./out/training_data.parquet')
+        # drop solution since parquet is not supported, the solution names are kept instead
+        parquet_df = df.drop(["solution"], axis=1)
+        for column in solution_names.columns.drop("solution"):
+            parquet_df[column] = solution_names[column].array
+        parquet_df.to_parquet('./out/training_data.parquet')
 
 
     # ## Upload data to Huggging Face 
@@ -100,6 +160,30 @@ def main():
             push_to_hub=UPLOAD_TO_HUGGINGFACE
     )
 
+def save_run_metadata(budget, sampling=None, path='./out/expansion_run.json'):
+    # the solve budget, the template x schema pairs it truncated and the pairs reused from the
+    # expansion cache without the budget, sampled runs use neither the budget nor the cache
+    metadata = {
+        "engine": SOLVER_ENGINE,
+        "sampled": sampling is not None,
+        "expansion_cache": sampling is None,
+        "budget": dict(budget.to_dict(), applied=sampling is None) if budget is not None else None,
+    }
+    with open(path, 'w') as f:
+        json.dump(metadata, f, indent=2, default=str)
+    if budget is not None and budget.truncated:
+        print(f"{len(budget.truncated):,} template x schema solves ran out of budget, see {path}")
+    if budget is not None and budget.cached:
+        print(f"{len(budget.cached):,} template x schema solves were reused from the expansion cache without the budget, use --rebuild_cache to budget them, see {path}")
+
+def add_unparaphrased_query(batch):
+    # same columns as the dataframe when paraphrasing is skipped
+    for row in batch:
+        row['query'] = row['query_base']
+        row['expertise'] = -1
+        row['formality'] = -1
+    return batch
+
 def print_header(message):
     print("\n" + "#" * 80)
     print("| " + message + " " * (77 - len(message)) + "|")
@@ -117,7 +201,22 @@ if __name__ == "__main__":
     parser.add_argument('--sample', action='store_true', help='Sample the data for SQLite DB')
     parser.add_argument('--json', action='store_true', help='Export the data to JSON')
     parser.add_argument('--parquet', action='store_true', help='Export the data to parquet')
+    parser.add_argument('--engine', default=SOLVER_ENGINE, choices=['backtracking', 'numpy', 'python-constraint'], help='Constraint solver engine used to expand the templates')
+    parser.add_argument('--jobs', type=int, default=JOBS, help='Number of processes used to profile the data packages (--schema) and expand the templates')
+    parser.add_argument('--exact_cardinality', type=int, default=EXACT_CARDINALITY, help='Count the distinct values of a column exactly up to this many when profiling the data packages (--schema), estimate larger cardinalities')
+    parser.add_argument('--executor', default=EXECUTOR, choices=['process', 'thread'], help='Run the --jobs workers as processes or as threads (parallel on free-threaded Python 3.13)')
+    parser.add_argument('--stream', action='store_true', help='Expand straight to ./out/training_data.parquet in batches, skips paraphrasing and the other exports')
+    parser.add_argument('--plan', action='store_true', help='Report the predicted solutions per template and schema and the size of the run, without expanding')
+    parser.add_argument('--target_size', type=int, default=TARGET_SIZE, help='Expand a uniform random sample of this many rows instead of every solution')
+    parser.add_argument('--stratify', nargs='*', default=STRATIFY, choices=['template', 'schema', 'chart_type', 'chart_complexity'], help='Split the target size evenly over these strata')
+    parser.add_argument('--seed', type=int, default=SAMPLING_SEED, help='Seed of the target size sampling')
+    parser.add_argument('--profile_expansion', '--profile-expansion', action='store_true', help='Profile the solver per template and schema and report the slowest, without exporting')
+    parser.add_argument('--budget_seconds', type=float, default=BUDGET_SECONDS, help='Time budget per template and schema solve, keeps the solutions found so far when it runs out, pairs reused from the expansion cache skip it')
+    parser.add_argument('--budget_steps', type=int, default=BUDGET_STEPS, help='Search step budget per template and schema solve')
+    parser.add_argument('--rebuild_cache', action='store_true', help='Solve every template and schema again instead of reusing the cached solutions')
     args = parser.parse_args()
+    if args.profile_expansion and args.engine not in expansion_profile.PROFILED_ENGINES:
+        parser.error(f"--profile_expansion needs --engine {' or '.join(expansion_profile.PROFILED_ENGINES)}, not {args.engine}")
     UPDATE_SCHEMA = args.schema
     UPLOAD_TO_HUGGINGFACE = args.upload
     SAVE_HUGGINGFACE_LOCAL = args.hf_local
@@ -127,4 +226,17 @@ if __name__ == "__main__":
     GENERATE_JSON = args.json
     GENERATE_PARQUET = args.parquet
     ONLY_CACHED = args.only_cached
+    SOLVER_ENGINE = args.engine
+    JOBS = args.jobs
+    EXECUTOR = args.executor
+    EXACT_CARDINALITY = args.exact_cardinality
+    STREAM_PARQUET = args.stream
+    PLAN = args.plan
+    TARGET_SIZE = args.target_size
+    STRATIFY = args.stratify
+    SAMPLING_SEED = args.seed
+    PROFILE_EXPANSION = args.profile_expansion
+    BUDGET_SECONDS = args.budget_seconds
+    BUDGET_STEPS = args.budget_steps
+    REBUILD_EXPANSION_CACHE = args.rebuild_cache
     main()
\ No newline at end of file
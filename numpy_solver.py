@@ -0,0 +1,346 @@
+import ast
+import threading
+from functools import lru_cache
+import numpy as np
+from constraint_compiler import CONSTRAINT_GLOBALS, VARIABLE_PATTERN
+
+'''
+A vectorized alternative to template_solver.BacktrackingSolver.
+
+The options of each variable are stored as columnar NumPy arrays (one array per
+attribute the constraints read, e.g. udi:cardinality or udi:data_type, plus integer
+codes for entity and field names). The compiled constraints are lowered once
+more so they evaluate on whole columns:
+- unary constraints become boolean masks over a variable's options
+- pairwise constraints (F1.c >= F2.c, field belongs to sample, unique names)
+  become broadcast matrices over the options of both variables
+- constraints over three or more variables are evaluated on the joined rows
+The variables are joined one at a time by gathering rows of the pairwise
+matrices, the result are tuples of option indices.
+'''
+
+
+class OptionColumns:
+    """
+    Columnar view of a list of options. Attribute columns are built on first use, under
+    a lock as the columns of a schema are shared by the threads of a thread pool expansion.
+    """
+
+    def __init__(self, options, codes, lock):
+        self.options = options
+        self.objects = object_array(options)
+        # codes are shared between sample and field columns so entities compare
+        self.codes = codes
+        self.lock = lock
+        self.columns = {}
+        self.code_columns = {}
+
+    def column(self, attribute):
+        with self.lock:
+            if attribute not in self.columns:
+                values = [option.get(attribute) for option in self.options]
+                if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+                    column = np.array(values)
+                else:
+                    column = object_array(values)
+                self.columns[attribute] = column
+            return self.columns[attribute]
+
+    def code_column(self, attribute):
+        """
+        Integer codes of a string attribute (entity, name), for the equality based constraints.
+        """
+        with self.lock:
+            if attribute not in self.code_columns:
+                self.code_columns[attribute] = np.array(
+                    [self.codes.setdefault(option.get(attribute), len(self.codes)) for option in self.options],
+                    dtype=np.int64,
+                )
+            return self.code_columns[attribute]
+
+
+class VariableColumns:
+    """
+    The columns of a variable restricted to some option indices and reshaped for broadcasting.
+    """
+
+    def __init__(self, option_columns, indices, shape):
+        self.option_columns = option_columns
+        self.indices = indices
+        self.shape = shape
+
+    def __getitem__(self, attribute):
+        return self.option_columns.column(attribute)[self.indices].reshape(self.shape)
+
+    def codes(self, attribute):
+        return self.option_columns.code_column(attribute)[self.indices].reshape(self.shape)
+
+    @property
+    def objects(self):
+        return self.option_columns.objects[self.indices].reshape(self.shape)
+
+
+class NumpySolver:
+    """
+    Enumerates all assignments of the template variables that satisfy the constraints.
+    """
+
+    def __init__(self, samples, fields, locations, constraints, sample_options, field_options, location_options, columns=None, overlap_index=None, foreign_key_index=None, clock=None):
+        # template_solver.BudgetClock, every joined row is a step
+        self.clock = clock
+        if columns is None:
+            columns = build_columns(sample_options, field_options, location_options)
+        self.samples = list(samples)
+        self.variables = self.samples + list(fields) + list(locations)
+        self.option_columns = {}
+        for variable in samples:
+            self.option_columns[variable] = columns["samples"]
+        for variable in fields:
+            self.option_columns[variable] = columns["fields"]
+        for variable in locations:
+            self.option_columns[variable] = columns["locations"]
+        self.domains = {
+            variable: np.arange(len(self.option_columns[variable].options))
+            for variable in self.variables
+        }
+        # (first, second) -> [function(first columns, second columns)]
+        self.pairwise = {}
+        self.nary = []
+
+        variable_set = set(self.variables)
+        for constraint in constraints:
+            variables = tuple(constraint["variables"])
+            if any(variable not in variable_set for variable in variables):
+                raise ValueError(f"Constraint references an unknown variable: {constraint['source']}")
+            if constraint["kind"] == "different":
+                for i, first in enumerate(variables):
+                    for second in variables[i + 1:]:
+                        self.add_pairwise(first, second, different_function(constraint["attribute"]))
+                continue
+            if constraint["kind"] == "overlap" and overlap_index is not None:
+                self.add_pairwise(variables[0], variables[1], overlap_function(overlap_index))
+                continue
+            if constraint["kind"] == "bind":
+                self.add_pairwise(variables[0], variables[1], same_entity)
+                continue
+            func = numpy_function(constraint["source"], variables, foreign_key_index)
+            if len(variables) == 0:
+                if not func():
+                    self.domains = {variable: self.domains[variable][:0] for variable in self.variables}
+            elif len(variables) == 1:
+                self.filter_domain(variables[0], func)
+            elif len(variables) == 2:
+                self.add_pairwise(variables[0], variables[1], func)
+            else:
+                self.nary.append((variables, func))
+
+    def filter_domain(self, variable, func):
+        domain = self.domains[variable]
+        mask = np.broadcast_to(func(VariableColumns(self.option_columns[variable], domain, (-1,))), domain.shape)
+        self.domains[variable] = domain[mask.astype(bool)]
+
+    def add_pairwise(self, first, second, func):
+        self.pairwise.setdefault((first, second), []).append(func)
+
+    def pairwise_matrix(self, first, second):
+        """
+        Boolean matrix over the domains of first and second of the constraints between them.
+        """
+        first_domain, second_domain = self.domains[first], self.domains[second]
+        shape = (len(first_domain), len(second_domain))
+        matrix = np.ones(shape, dtype=bool)
+        first_columns = VariableColumns(self.option_columns[first], first_domain, (-1, 1))
+        second_columns = VariableColumns(self.option_columns[second], second_domain, (1, -1))
+        for func in self.pairwise.get((first, second), []):
+            matrix &= np.broadcast_to(func(first_columns, second_columns), shape).astype(bool)
+        for func in self.pairwise.get((second, first), []):
+            # the column shapes already orient the result as first x second
+            matrix &= np.broadcast_to(func(second_columns, first_columns), shape).astype(bool)
+        return matrix
+
+    def order_variables(self):
+        # samples first so bound fields are joined on their entity, then the smallest domains
+        return self.samples + sorted(
+            [x for x in self.variables if x not in self.samples],
+            key=lambda x: len(self.domains[x]),
+        )
+
+    def solve_indices(self):
+        """
+        Returns the solutions as an array of rows of option indices, columns ordered as self.variables.
+        """
+        order = self.order_variables()
+        # rows of positions into the domains of the joined variables
+        rows = np.zeros((1, 0), dtype=np.int64)
+        joined = []
+        for variable in order:
+            size = len(self.domains[variable])
+            mask = np.ones((len(rows), size), dtype=bool)
+            for position, other in enumerate(joined):
+                if (other, variable) in self.pairwise or (variable, other) in self.pairwise:
+                    mask &= self.pairwise_matrix(other, variable)[rows[:, position]]
+            row_index, candidates = np.nonzero(mask)
+            rows = np.column_stack([rows[row_index], candidates])
+            joined.append(variable)
+            if self.clock is not None and self.clock.tick(len(rows)):
+                # the joined rows are not solutions yet, nothing was found, see
+                # template_expansion.constraint_solver for the fallback
+                return np.zeros((0, len(self.variables)), dtype=np.int64)
+
+        # positions in the domains to option indices
+        indices = np.column_stack(
+            [self.domains[variable][rows[:, i]] for i, variable in enumerate(joined)]
+        ) if len(joined) else np.zeros((len(rows), 0), dtype=np.int64)
+        for variables, func in self.nary:
+            columns = [
+                VariableColumns(self.option_columns[v], indices[:, joined.index(v)], (-1,))
+                for v in variables
+            ]
+            keep = np.broadcast_to(func(*columns), (len(indices),)).astype(bool)
+            indices = indices[keep]
+        return indices[:, [joined.index(variable) for variable in self.variables]]
+
+    def get_solutions(self):
+        indices = self.solve_indices()
+        options = [self.option_columns[variable].options for variable in self.variables]
+        return [
+            {variable: options[i][index] for i, (variable, index) in enumerate(zip(self.variables, row))}
+            for row in indices.tolist()
+        ]
+
+
+def build_columns(sample_options, field_options, location_options):
+    codes = {}
+    # guards codes too, it is shared by the three views
+    lock = threading.Lock()
+    return {
+        "samples": OptionColumns(sample_options, codes, lock),
+        "fields": OptionColumns(field_options, codes, lock),
+        "locations": OptionColumns(location_options, codes, lock),
+    }
+
+
+def object_array(values):
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def different_function(attribute):
+    return lambda first, second: first.codes(attribute) != second.codes(attribute)
+
+
+def overlap_function(overlap_index):
+    overlaps = np.frompyfunc(overlap_index.overlaps, 2, 1)
+    return lambda field, other: overlaps(field.objects, other.objects)
+
+
+def same_entity(field, sample):
+    return field.codes("entity") == sample.codes("entity")
+
+
+class NumpyLowering(ast.NodeTransformer):
+    """
+    Rewrites a compiled constraint so it evaluates elementwise on VariableColumns.
+    """
+
+    def visit_Subscript(self, node):
+        if isinstance(node.value, ast.Name) and VARIABLE_PATTERN.fullmatch(node.value.id):
+            # column lookup, handled by VariableColumns.__getitem__
+            return node
+        return self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if VARIABLE_PATTERN.fullmatch(node.id):
+            # a whole option, e.g. the arguments of foreign_key_cardinality
+            return ast.Attribute(value=node, attr="objects", ctx=ast.Load())
+        return node
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        func = "np.logical_and" if isinstance(node.op, ast.And) else "np.logical_or"
+        result = node.values[0]
+        for value in node.values[1:]:
+            result = call(func, [result, value])
+        return result
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return call("np.logical_not", [node.operand])
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        comparisons = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                if isinstance(right, (ast.List, ast.Tuple)) and all(isinstance(x, ast.Constant) for x in right.elts):
+                    comparison = call("isin_values", [left, right])
+                else:
+                    comparison = call("contains", [left, right])
+                if isinstance(op, ast.NotIn):
+                    comparison = call("np.logical_not", [comparison])
+            else:
+                comparison = ast.Compare(left=left, ops=[op], comparators=[right])
+            comparisons.append(comparison)
+            left = right
+        result = comparisons[0]
+        for comparison in comparisons[1:]:
+            result = call("np.logical_and", [result, comparison])
+        return result
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id in CONSTRAINT_GLOBALS:
+            node.func = ast.Subscript(
+                value=ast.Name(id="vectorized", ctx=ast.Load()),
+                slice=ast.Constant(node.func.id),
+                ctx=ast.Load(),
+            )
+        return node
+
+
+def call(func, args):
+    return ast.Call(func=ast.parse(func, mode="eval").body, args=args, keywords=[])
+
+
+def isin_values(left, values):
+    result = np.zeros(np.shape(left), dtype=bool)
+    for value in values:
+        result |= np.asarray(left == value, dtype=bool)
+    return result
+
+
+contains = np.frompyfunc(lambda item, container: item in container, 2, 1)
+
+NUMPY_GLOBALS = {
+    "np": np,
+    "isin_values": isin_values,
+    "contains": contains,
+}
+
+# functions kept by numpy_function, bounded like constraint_compiler.compile_function
+NUMPY_FUNCTION_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=NUMPY_FUNCTION_CACHE_SIZE)
+def numpy_function(source, variables, foreign_key_index=None):
+    """
+    Compiles a constraint into a function of VariableColumns, cached per source (and
+    foreign key index, its lookups replace the relationship helpers).
+    """
+    tree = NumpyLowering().visit(ast.parse(source, mode="eval"))
+    lowered = ast.unparse(ast.fix_missing_locations(tree))
+    helpers = dict(CONSTRAINT_GLOBALS)
+    if foreign_key_index is not None:
+        helpers.update(foreign_key_index.constraint_globals())
+    numpy_globals = dict(NUMPY_GLOBALS)
+    numpy_globals["vectorized"] = {
+        # bound methods count self as an argument
+        name: np.frompyfunc(func, func.__code__.co_argcount - hasattr(func, "__self__"), 1)
+        for name, func in helpers.items()
+    }
+    return eval(f"lambda {', '.join(variables)}: {lowered}", numpy_globals)
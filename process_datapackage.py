@@ -4,21 +4,43 @@ import json
 from frictionless import Package
 import pandas as pd
 import json
+from concurrent.futures import ProcessPoolExecutor
+import insert_reference_values
+from column_profile import EXACT_DISTINCT_THRESHOLD, TableProfile, read_chunks, read_frame
 
-def main():
+def main(jobs=1, threshold=EXACT_DISTINCT_THRESHOLD, insert_references=False):
+    """
+    With jobs > 1 the resources are profiled (and written) on a process pool.
+    Cardinalities up to threshold are exact, larger ones are estimated.
+    With insert_references every resource is also written with its reference values
+    (see insert_reference_values) right after it is profiled, from the same table,
+    insert_reference_values.main then only has to write the packages.
+    """
     datasets_path = "./datasets"
     input_catalogue = os.path.join(datasets_path, "input_catalogue.json")
+    reference_df = insert_reference_values.read_reference_values(datasets_path) if insert_references else None
     datapackage_list = []
-    with open(input_catalogue, 'r') as f:
-        data_packages = json.load(f)
-        for data_package in data_packages:
-            if not data_package['process']:
-                continue
-            name = data_package['name']
-            print('Processing Data Package:', name)
-            out_path = data_package['outName']
-            datapackage = augment_datapackage(name, out_path)
-            datapackage_list.append(datapackage)
+    executor = None
+    if jobs > 1:
+        # the reference values are sent to each worker once
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(reference_df,))
+    try:
+        with open(input_catalogue, 'r') as f:
+            data_packages = json.load(f)
+            for data_package in data_packages:
+                if not data_package['process']:
+                    continue
+                name = data_package['name']
+                print('Processing Data Package:', name)
+                out_path = data_package['outName']
+                references = None
+                if insert_references:
+                    references = (reference_df, insert_reference_values.get_out_path(data_package), not data_package['c2m2'])
+                datapackage = augment_datapackage(name, out_path, executor, threshold, references)
+                datapackage_list.append(datapackage)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # Create the top-level schema file with the combined list
     # top_level_catalogue_path = os.path.join(datasets_path, "output_catalogue.json")
@@ -27,9 +49,14 @@ def main():
 
     return
 
-def augment_datapackage(in_path, out_path):
+def augment_datapackage(in_path, out_path, executor=None, threshold=EXACT_DISTINCT_THRESHOLD, references=None):
     """
     Augment a datapackage with additional metadata we expect.
+    The resources are profiled serially or on executor (a process pool), the profiles
+    are applied to the package in the order of its resources either way. Cardinalities
+    above threshold are estimated, see column_profile.
+    references are the arguments of insert_reference_values.write_resource after the
+    resource (reference values, out path, pass through), see profile_resource.
     """
     folder = in_path.split('/')[-2]
     package = Package(in_path)
@@ -40,54 +67,29 @@ def augment_datapackage(in_path, out_path):
     #     print("The package is not valid:")
     #     print(report.flatten(["rowPosition", "fieldPosition", "code"]))
     #     raise ValueError("Invalid datapackage. Please fix the errors and try again.")
-    
+
+    keys = get_multi_keys(package)
     print('...updating metadata')
+    if executor is None:
+        profiles = {}
+        for resource in package.resources:
+            ephemeral_print(resource.name)
+            profiles[resource.name] = profile_resource(resource, keys.get(resource.name, []), threshold, references)
+    else:
+        # largest files first, so a large resource doesn't start last
+        resources = sorted(package.resources, key=lambda r: -os.path.getsize(r.normpath))
+        # the workers have the reference values, see init_worker
+        worker_references = references[1:] if references is not None else None
+        futures = {
+            resource.name: executor.submit(profile_unit, in_path, resource.name, keys.get(resource.name, []), threshold, worker_references)
+            for resource in resources
+        }
+        profiles = {}
+        for resource in resources:
+            profiles[resource.name] = futures[resource.name].result()
+            ephemeral_print(resource.name)
     for resource in package.resources:
-        ephemeral_print(resource.name)
-        df = resource.to_pandas()
-        df = df.reset_index()
-
-        rows = df.shape[0]
-        cols = df.shape[1]
-        resource.custom['udi:row_count'] = rows
-        resource.custom['udi:column_count'] = cols
-        for field in resource.schema.fields:
-            if field.type == 'array':
-                cardinality = 0
-                # pandas.nunique does not work on arrays and 
-                # we don't use array types so we can ignore this
-            elif rows == 0:
-                cardinality = 0
-            else:
-                col = field.name
-                cardinality = df[col].nunique()
-            field.custom['udi:cardinality'] = cardinality
-            field.custom['udi:unique'] = cardinality == rows
-            field.custom['udi:data_type'] = infer_data_type(field)
-
-        print('\n...finding field overlap')
-        df = df.notnull()
-        df = df.drop_duplicates()
-        empty_cols = df.any(axis='index')
-        empty_cols = empty_cols.to_dict().items()
-        empty_cols = {k: v for k, v in empty_cols if not v}
-
-        num_empty_cols = len(empty_cols)
-        for field in resource.schema.fields:
-            if field.type == 'array':
-                cardinality = 0
-            overlapping_df = df[df[field.name]]
-            if overlapping_df.empty:
-                # No overlapping fields
-                field.custom['udi:overlapping_fields'] = []
-                continue
-
-            overlapping_df = overlapping_df.any(axis='index')
-            overlapping_items = overlapping_df.to_dict().items()
-            related_fields = [k for k,v in overlapping_items if v]
-            if (len(related_fields) == cols - num_empty_cols):
-                related_fields = 'all'
-            field.custom['udi:overlapping_fields'] = related_fields
+        apply_profile(resource, profiles[resource.name])
 
     print('\n...updating relationships')
     # handle relationships in another pass so we can assume udi fields are populated
@@ -95,10 +97,10 @@ def augment_datapackage(in_path, out_path):
         ephemeral_print(resource.name)
         foreignKeys = resource.schema.foreign_keys
         for foreignKey in foreignKeys:
-            from_unique = unique_multi_key(resource, foreignKey['fields'])
+            from_unique = unique_key(resource, foreignKey['fields'], profiles[resource.name])
             from_cardinality = 'one' if from_unique else 'many'
             to_resource = package.get_resource(foreignKey['reference']['resource'])
-            to_unique = unique_multi_key(to_resource, foreignKey['reference']['fields'])
+            to_unique = unique_key(to_resource, foreignKey['reference']['fields'], profiles[to_resource.name])
             to_cardinality = 'one' if to_unique else 'many'
 
             foreignKey['udi:cardinality'] = {
@@ -109,9 +111,96 @@ def augment_datapackage(in_path, out_path):
     package.to_json(out_path)
     return json.load(open(out_path, 'r'))
 
-def unique_multi_key(resource, key_fields):
+def get_multi_keys(package):
     """
-    Check if the combination of fields in the dataframe is unique.
+    Resource name -> the multi-field keys of its foreign keys, on either side.
+    """
+    keys = {}
+    for resource in package.resources:
+        for foreignKey in resource.schema.foreign_keys:
+            for name, fields in [
+                (resource.name, foreignKey['fields']),
+                (foreignKey['reference']['resource'], foreignKey['reference']['fields']),
+            ]:
+                if len(fields) > 1 and tuple(fields) not in keys.setdefault(name, []):
+                    keys[name].append(tuple(fields))
+    return keys
+
+def profile_resource(resource, keys, threshold=EXACT_DISTINCT_THRESHOLD, references=None):
+    """
+    Row and column count, per field cardinality, uniqueness and overlapping fields,
+    and the uniqueness of the multi-field keys of a resource. Only depends on the
+    resource, so the resources can be profiled in any order and process.
+    The table is profiled in chunks, cardinalities above threshold are estimated,
+    see column_profile.
+    With references the resource is also written with its reference values, chunk by
+    chunk from the same frames that are profiled, so the table is only read once.
+    """
+    # pandas.nunique does not work on arrays and
+    # we don't use array types so we can ignore this
+    counted = [field.name for field in resource.schema.fields if field.type != 'array']
+    table = TableProfile(counted, keys, threshold)
+    frame = read_frame(resource)
+    for i, chunk in enumerate([frame] if frame is not None else read_chunks(resource)):
+        table.add(chunk)
+        if references is not None:
+            insert_reference_values.write_resource(resource, chunk, *references, append=i > 0)
+
+    profile = {
+        # inferred while reading, the workers' resources are not the ones exported
+        "encoding": resource.encoding,
+        "udi:row_count": table.rows,
+        "udi:column_count": len(table.columns),
+        "fields": {},
+        "keys": {key: table.unique_key(key) for key in keys},
+    }
+    for field in resource.schema.fields:
+        if field.name in table.counters:
+            cardinality = table.cardinality(field.name)
+            unique = table.unique(field.name)
+        else:
+            cardinality = 0
+            unique = table.rows == 0
+        profile["fields"][field.name] = {
+            'udi:cardinality': cardinality,
+            'udi:unique': unique,
+            'udi:overlapping_fields': table.overlapping(field.name),
+        }
+    return profile
+
+# packages opened by a profiling worker, by path
+worker_packages = {}
+# reference values of a profiling worker, set by init_worker
+worker_reference_df = None
+
+def init_worker(reference_df):
+    global worker_reference_df
+    worker_reference_df = reference_df
+
+def profile_unit(in_path, resource_name, keys, threshold, references=None):
+    # the workers open the package themselves and write the resource with its reference
+    # values (references without the reference values), only the profiles are sent back
+    if in_path not in worker_packages:
+        worker_packages[in_path] = Package(in_path)
+    if references is not None:
+        references = (worker_reference_df, *references)
+    return profile_resource(worker_packages[in_path].get_resource(resource_name), keys, threshold, references)
+
+def apply_profile(resource, profile):
+    resource.encoding = profile['encoding']
+    resource.custom['udi:row_count'] = profile['udi:row_count']
+    resource.custom['udi:column_count'] = profile['udi:column_count']
+    for field in resource.schema.fields:
+        field_profile = profile["fields"][field.name]
+        field.custom['udi:cardinality'] = field_profile['udi:cardinality']
+        field.custom['udi:unique'] = field_profile['udi:unique']
+        field.custom['udi:data_type'] = infer_data_type(field)
+    for field in resource.schema.fields:
+        field.custom['udi:overlapping_fields'] = profile["fields"][field.name]['udi:overlapping_fields']
+
+def unique_key(resource, key_fields, profile):
+    """
+    Check if the combination of fields is unique in the resource, from its profile.
     """
     if len(key_fields) == 0:
         raise ValueError("No fields provided")
@@ -122,14 +211,7 @@ def unique_multi_key(resource, key_fields):
         if field is None:
             raise ValueError(f"Field '{key_field}' not found in resource schema")
         return field.custom.get('udi:unique', False)
-    else:
-        df = resource.to_pandas()
-        df = df.reset_index()
-        if df.empty:
-            # Can't really determine based on empty data so give "safer" answer.
-            return False
-        return len(df[key_fields].drop_duplicates()) == df.shape[0]
-
+    return profile["keys"][tuple(key_fields)]
 
 def ephemeral_print(message):
     sys.stdout.write("\r\033[K")  # Clear the line
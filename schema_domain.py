@@ -0,0 +1,389 @@
+import bisect
+import hashlib
+import json
+import threading
+from types import MappingProxyType
+
+'''
+The variable domains of a dataset schema used by template_expansion.
+
+Everything here only depends on the schema, so a SchemaDomain is built once per
+schema and shared by every template that is expanded against it, and by the threads
+of a thread pool expansion. The options are frozen (see freeze) when they are built,
+solutions refer to them and must see the same values in every thread, thaw returns
+plain dicts and lists for export. The views that are built on first use (columns,
+fingerprints) are built under the lock of the domain.
+'''
+
+
+class SchemaDomain:
+    """
+    Flattened options for the sample, field and location variables of a dataset schema.
+    """
+
+    def __init__(self, schema, schema_id=0):
+        self.name = schema["udi:name"]
+        # position of the schema in the catalogue, used by the compact solutions
+        self.schema_id = schema_id
+        # genomic data packages additionally describe an assembly and genes
+        self.assembly = schema.get("udi:assembly")
+        self.gene_list = tuple(
+            freeze({'name': gene["name"], 'chr': gene["chr"], 'pos': gene["pos"]})
+            for gene in schema.get("udi:genes", [])
+        )
+
+        field_options = []
+        fields_by_entity = {}
+        sample_options = []
+        # id(option) -> (schema id, resource id, field id), see solution_catalogue
+        self.references = {}
+        for resource_id, resource in enumerate(schema["resources"]):
+            entity = resource["name"]
+            url = resource["path"]
+            resource_schema = resource["schema"]
+            # shared by the sample and its fields
+            foreignKeys = freeze(resource_schema.get("foreignKeys", []))
+            entity_fields = []
+            for col in resource_schema["fields"]:
+                expanded_col = col.copy()
+                expanded_col.update(
+                    {
+                        "entity": entity,
+                        "url": url,
+                        "foreignKeys": foreignKeys,
+                    }
+                )
+                entity_fields.append(freeze(expanded_col))
+            if not entity_fields:
+                # resources without fields can't be bound to any template
+                continue
+            entity_fields = tuple(entity_fields)
+            field_options.extend(entity_fields)
+            fields_by_entity[entity] = entity_fields
+            sample_options.append(freeze(
+                {
+                    "entity": entity,
+                    "url": url,
+                    "udi:cardinality": resource.get("udi:row_count", 0),
+                    "foreignKeys": foreignKeys,
+                    "fields": [x["name"] for x in entity_fields],
+                    "assembly": self.assembly,
+                }
+            ))
+            self.references[id(sample_options[-1])] = (schema_id, resource_id, -1)
+            for field_id, field in enumerate(entity_fields):
+                self.references[id(field)] = (schema_id, resource_id, field_id)
+        self.field_options = tuple(field_options)
+        self.fields_by_entity = MappingProxyType(fields_by_entity)
+        self.sample_options = tuple(sample_options)
+
+        self.overlap_index = OverlapIndex(self.fields_by_entity)
+        self.foreign_key_index = ForeignKeyIndex(schema["resources"])
+
+        # columnar view of the options for the numpy engine, built on first use
+        self.columns = None
+
+        # <L> tags bind to single loci and gene regions, see GenomeIndex.location_options
+        self.genome_index = GenomeIndex(self.gene_list)
+        self.location_options = tuple(freeze(option) for option in self.genome_index.location_options(self.assembly))
+        for location_id, location in enumerate(self.location_options):
+            self.references[id(location)] = (schema_id, -1, location_id)
+
+        # (list, position) of every option, solutions can be moved between
+        # schemas with the same structure_key by position
+        self.positions = {}
+        for list_index, options in enumerate(self.get_option_lists()):
+            for position, option in enumerate(options):
+                self.positions[id(option)] = (list_index, position)
+        self.structure_key = get_structure_key(schema)
+        # frozenset of attributes -> fingerprint, see get_fingerprint
+        self.fingerprints = {}
+        self.lock = threading.Lock()
+
+    def get_positions(self, solution):
+        return {variable: self.positions[id(option)] for variable, option in solution.items()}
+
+    def get_options(self, positions):
+        """
+        The options of this schema at the positions of get_positions (of any schema
+        with the same structure_key).
+        """
+        option_lists = self.get_option_lists()
+        return {
+            variable: option_lists[list_index][position]
+            for variable, (list_index, position) in positions.items()
+        }
+
+    def get_option_lists(self):
+        return [self.sample_options, self.field_options, self.location_options]
+
+    def get_fingerprint(self, attributes):
+        """
+        Hash of the options (in order) restricted to the given attributes. Schemas with the
+        same fingerprint have the same solutions, at the same positions, for constraints
+        that only read those attributes.
+        """
+        attributes = frozenset(attributes)
+        with self.lock:
+            if attributes not in self.fingerprints:
+                projected = [
+                    [[option.get(attribute) for attribute in sorted(attributes)] for option in options]
+                    for options in self.get_option_lists()
+                ]
+                content = json.dumps(thaw([sorted(attributes), projected]), default=str)
+                self.fingerprints[attributes] = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            return self.fingerprints[attributes]
+
+    def get_columns(self):
+        with self.lock:
+            if self.columns is None:
+                # imported lazily, only the numpy engine needs the columns
+                from numpy_solver import build_columns
+                self.columns = build_columns(self.sample_options, self.field_options, self.location_options)
+            return self.columns
+
+
+def freeze(value):
+    """
+    Read only copy of a JSON like value, dicts become read only mappings and lists tuples.
+    Frozen values are returned as they are, so parts can be frozen once and shared.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """
+    Plain dicts and lists of a frozen value.
+    """
+    if isinstance(value, MappingProxyType):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def get_structure_key(schema):
+    """
+    Hash of the parts of a schema the structural constraints read: resources, field
+    names and data types and the foreign key graph. Cardinalities, row counts and
+    paths are left out, they differ between e.g. the C2M2 data packages.
+    """
+    structure = [
+        [
+            resource["name"],
+            [[field["name"], field.get("udi:data_type")] for field in resource["schema"]["fields"]],
+            [
+                [fk["fields"], fk["reference"]["resource"], fk["reference"]["fields"]]
+                for fk in resource["schema"].get("foreignKeys", [])
+            ],
+        ]
+        for resource in schema["resources"]
+    ]
+    structure.append([[gene["name"], gene["chr"], gene["pos"]] for gene in schema.get("udi:genes", [])])
+    return hashlib.sha256(json.dumps(structure).encode("utf-8")).hexdigest()
+
+
+class OverlapIndex:
+    """
+    udi:overlapping_fields of every field as a bitset over the field names of its resource.
+    'all' is stored as a full mask (-1 has every bit set).
+    """
+
+    def __init__(self, fields_by_entity):
+        # entity -> field name -> bit position
+        self.positions = {}
+        # (entity, field name) -> overlap mask
+        self.masks = {}
+        for entity, fields in fields_by_entity.items():
+            positions = {}
+            for field in fields:
+                positions.setdefault(field["name"], len(positions))
+            for field in fields:
+                overlapping = field.get("udi:overlapping_fields", [])
+                if overlapping != "all":
+                    for name in overlapping:
+                        positions.setdefault(name, len(positions))
+            self.positions[entity] = positions
+            for field in fields:
+                self.masks[(entity, field["name"])] = self.get_mask(field.get("udi:overlapping_fields", []), positions)
+
+    @staticmethod
+    def get_mask(overlapping, positions):
+        if overlapping == "all":
+            return -1
+        mask = 0
+        for name in overlapping:
+            mask |= 1 << positions[name]
+        return mask
+
+    def overlaps(self, field, other):
+        """
+        Same as field['name'] in other['udi:overlapping_fields'] or other['udi:overlapping_fields'] == 'all'
+        """
+        mask = self.masks[(other["entity"], other["name"])]
+        if mask == -1:
+            return True
+        bit = self.positions[other["entity"]].get(field["name"])
+        return bit is not None and (mask >> bit) & 1 == 1
+
+    def partners(self, other, candidates):
+        """
+        The candidate fields that overlap with other, a single AND with each candidate's bit.
+        """
+        mask = self.masks[(other["entity"], other["name"])]
+        if mask == -1:
+            return candidates
+        positions = self.positions[other["entity"]]
+        return [
+            x for x in candidates
+            if x["name"] in positions and mask & (1 << positions[x["name"]])
+        ]
+
+
+class ForeignKeyIndex:
+    """
+    Foreign keys of a schema by (resource, referenced resource).
+
+    A resource can reference the same resource more than once (e.g. project_in_project),
+    the relationship constraints use the last of those keys and spec joins the first,
+    like the scans over foreignKeys they replace.
+    """
+
+    def __init__(self, resources):
+        # (resource, referenced) -> {"fields", "reference_fields", "udi:cardinality"} of the first key
+        self.joins = {}
+        # (resource, referenced) -> udi:cardinality of the last key
+        self.cardinalities = {}
+        for resource in resources:
+            for foreign_key in resource["schema"].get("foreignKeys", []):
+                pair = (resource["name"], foreign_key["reference"]["resource"])
+                self.joins.setdefault(pair, {
+                    "fields": foreign_key["fields"],
+                    "reference_fields": foreign_key["reference"]["fields"],
+                    "udi:cardinality": foreign_key.get("udi:cardinality"),
+                })
+                self.cardinalities[pair] = foreign_key.get("udi:cardinality")
+
+    def join(self, resource, referenced):
+        return self.joins.get((resource, referenced))
+
+    def foreign_key_cardinality(self, sample, related, direction):
+        """
+        Same as constraint_compiler.foreign_key_cardinality.
+        """
+        pair = (sample["entity"], related["entity"])
+        if pair not in self.cardinalities:
+            return None
+        return self.cardinalities[pair][direction]
+
+    def has_foreign_key(self, sample, related):
+        return (sample["entity"], related["entity"]) in self.cardinalities
+
+    def constraint_globals(self):
+        """
+        The relationship helpers of the compiled constraints, looked up in this index.
+        """
+        return {
+            "foreign_key_cardinality": self.foreign_key_cardinality,
+            "has_foreign_key": self.has_foreign_key,
+        }
+
+
+class GenomeIndex:
+    """
+    The gene intervals of a genomic schema, sorted by start per chromosome.
+
+    A gene's chr and pos can be single values or lists, a single chr applies to every
+    pos, a gene on several chromosomes (with one chr per pos) has an interval on each. Range queries bisect the starts,
+    only genes starting at most max_length before the range can reach into it.
+    """
+
+    def __init__(self, gene_list):
+        intervals = {}
+        for gene in gene_list:
+            chromosomes, positions = as_list(gene["chr"]), as_list(gene["pos"])
+            if not chromosomes or not positions:
+                continue
+            if len(chromosomes) == 1:
+                chromosomes = chromosomes * len(positions)
+            elif len(chromosomes) != len(positions):
+                raise ValueError(
+                    f"Invalid gene {gene['name']}: {len(chromosomes)} chromosomes for {len(positions)} positions, "
+                    "expected one chromosome or one per position"
+                )
+            by_chromosome = {}
+            for chromosome, position in zip(chromosomes, positions):
+                by_chromosome.setdefault(chromosome, []).append(position)
+            for chromosome, chromosome_positions in by_chromosome.items():
+                intervals.setdefault(chromosome, []).append(
+                    (min(chromosome_positions), max(chromosome_positions), gene["name"], sorted(chromosome_positions))
+                )
+        # chromosome -> intervals (start, end, gene name, positions) sorted by start
+        self.intervals = {chromosome: sorted(genes) for chromosome, genes in intervals.items()}
+        self.starts = {chromosome: [x[0] for x in genes] for chromosome, genes in self.intervals.items()}
+        self.max_length = {
+            chromosome: max(end - start for start, end, _, _ in genes)
+            for chromosome, genes in self.intervals.items()
+        }
+
+    def overlapping(self, chromosome, start, end):
+        """
+        Names of the genes whose interval overlaps [start, end] on the chromosome.
+        """
+        if chromosome not in self.intervals:
+            return []
+        starts = self.starts[chromosome]
+        first = bisect.bisect_left(starts, start - self.max_length[chromosome])
+        last = bisect.bisect_right(starts, end)
+        return [
+            name for gene_start, gene_end, name, _ in self.intervals[chromosome][first:last]
+            if gene_end >= start
+        ]
+
+    def location_options(self, assembly=None):
+        """
+        One option per gene region and per gene position (locus), in chromosome order.
+            chromosome, start, end, length   the interval, a locus has start == end
+            genes, gene_count                the genes overlapping it
+            name                             how <L> is written in queries and specs
+        """
+        options = []
+        # genes can share a position, every locus is one option
+        loci = set()
+        for chromosome in sorted(self.intervals, key=str):
+            for start, end, gene, positions in self.intervals[chromosome]:
+                options.append(self.location_option("region", chromosome, start, end, assembly, f"{gene} ({chromosome}:{start}-{end})"))
+                for position in positions:
+                    if (chromosome, position) in loci:
+                        continue
+                    loci.add((chromosome, position))
+                    options.append(self.location_option("locus", chromosome, position, position, assembly, f"{chromosome}:{position}"))
+        return options
+
+    def location_option(self, kind, chromosome, start, end, assembly, name):
+        genes = self.overlapping(chromosome, start, end)
+        return {
+            "kind": kind,
+            "name": name,
+            "chromosome": chromosome,
+            "start": start,
+            "end": end,
+            "length": end - start + 1,
+            "genes": genes,
+            "gene_count": len(genes),
+            "assembly": assembly,
+        }
+
+
+def as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def build_domains(dataset_schemas):
+    return [SchemaDomain(schema, schema_id) for schema_id, schema in enumerate(dataset_schemas)]
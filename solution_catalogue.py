@@ -0,0 +1,119 @@
+import pandas as pd
+from schema_domain import build_domains, thaw
+
+'''
+Expanded rows store their solution in a compact form, every variable refers to an
+option of the catalogue by integer ids:
+    {"E": (schema id, resource id, -1), "E.F": (schema id, resource id, field id)}
+    locations are (schema id, -1, location id)
+The ids are positions in output_catalogue.json (the schema list, its resources and
+their fields), so the same catalogue always resolves the same references.
+
+The readable solution (the option dicts, without the foreign keys of fields) is only
+materialized for export with SolutionCatalogue.materialize_solution.
+'''
+
+
+def compact_solution(solution, domain):
+    """
+    Compact form of a solver solution (variable -> option of the domain).
+    """
+    return {
+        variable.replace("_", "."): domain.references[id(option)]
+        for variable, option in solution.items()
+    }
+
+
+class SolutionCatalogue:
+    """
+    Interned table of the options of every dataset schema by reference.
+    """
+
+    def __init__(self, dataset_schemas):
+        # (schema id, resource id, field id) -> readable option
+        self.options = {}
+        # (schema id, resource id, field id) -> entity or field name
+        self.names = {}
+        for domain in build_domains(dataset_schemas):
+            for option in domain.sample_options:
+                reference = domain.references[id(option)]
+                self.options[reference] = thaw(option)
+                self.names[reference] = option["entity"]
+            for option in domain.field_options:
+                reference = domain.references[id(option)]
+                # the foreign keys belong to the sample, they are left out of fields
+                self.options[reference] = {k: thaw(v) for k, v in option.items() if k != "foreignKeys"}
+                self.names[reference] = option["name"]
+            for option in domain.location_options:
+                reference = domain.references[id(option)]
+                self.options[reference] = thaw(option)
+                self.names[reference] = option["name"]
+
+    def materialize_solution(self, solution):
+        """
+        The readable form of a compact solution, readable solutions are returned as is.
+        """
+        if solution is None:
+            return None
+        return {
+            variable: self.options[tuple(reference)] if is_reference(reference) else reference
+            for variable, reference in solution.items()
+        }
+
+    def materialize(self, df):
+        """
+        Copy of df with readable solutions, for export.
+        """
+        df = df.copy()
+        df["solution"] = [self.materialize_solution(solution) for solution in df["solution"]]
+        return df
+
+    def add_solution_columns(self, df):
+        """
+        Adds a string column <variable>_name (e.g. E_name, E_F1_name) per solution
+        variable with the entity or field name, for filtering without materializing.
+        """
+        columns = {}
+        for position, solution in enumerate(df["solution"]):
+            for column, name in self.solution_names(solution).items():
+                columns.setdefault(column, [None] * len(df))[position] = name
+        for column, values in sorted(columns.items()):
+            df[column] = pd.array(values, dtype="string")
+        return df
+
+    def add_solution_names(self, batch, columns):
+        """
+        Same columns as add_solution_columns for the rows of a batch of expand_iter,
+        columns (see solution_name_columns) are set on every row, None if its solution
+        has no such variable.
+        """
+        for row in batch:
+            names = self.solution_names(row["solution"])
+            for column in columns:
+                row[column] = names.get(column)
+        return batch
+
+    def solution_names(self, solution):
+        """
+        <variable>_name -> entity, field or location name of the variables of a compact solution.
+        """
+        return {
+            variable.replace(".", "_") + "_name": self.names[tuple(reference)]
+            for variable, reference in solution.items()
+            if is_reference(reference) and tuple(reference) in self.names
+        }
+
+
+def solution_name_columns(df):
+    """
+    The <variable>_name columns of the solutions of the compiled templates in df.
+    """
+    variables = set()
+    for column in ("samples", "fields", "locations"):
+        for template_variables in df[column]:
+            variables.update(template_variables)
+    return sorted(variable + "_name" for variable in variables)
+
+
+def is_reference(value):
+    return isinstance(value, (tuple, list)) and len(value) == 3 and all(isinstance(x, int) for x in value)
@@ -0,0 +1,132 @@
+import random
+import template_expansion
+
+'''
+Target size sampling of the expansion, so large templates don't have to be
+enumerated when only a few hundred of their rows are kept.
+
+The target size is split evenly over the strata of the policy (template, schema,
+chart type, complexity or a combination), strata with fewer solutions than their
+share keep all of them and pass the rest on. Within a stratum the share is split
+over its template x schema pairs in proportion to their solution count (counted
+without building the solutions), so every solution of the stratum is equally likely.
+
+Each pair then draws its quota uniformly with the reservoir sampling search of
+BacktrackingSolver.sample_solutions, seeded by the policy seed and the pair.
+'''
+
+STRATA = ["template", "schema", "chart_type", "chart_complexity"]
+
+
+class SamplingPolicy:
+    """
+    Keep about size expanded rows, stratified by one or more of STRATA.
+    """
+
+    def __init__(self, size, stratify=None, seed=0):
+        if isinstance(stratify, str):
+            stratify = [stratify]
+        stratify = list(stratify or [])
+        unknown = [x for x in stratify if x not in STRATA]
+        if unknown:
+            raise ValueError(f"Unknown strata: {unknown}, expected some of {STRATA}")
+        self.size = size
+        self.stratify = stratify
+        self.seed = seed
+
+    def stratum(self, label, row, domain):
+        values = {
+            "template": label,
+            "schema": domain.name,
+            "chart_type": row["chart_type"],
+            "chart_complexity": row["chart_complexity"],
+        }
+        return tuple(values[x] for x in self.stratify)
+
+    def quotas(self, labels, templates, domains, engine="backtracking"):
+        """
+        Returns {(template index, domain index): (rows to keep, solution count)} for the
+        pairs with a quota.
+        """
+        counts = {}
+        # templates of a family have the same solution count
+        family_counts = {}
+        strata = {}
+        for template_index, (label, (row, compiled)) in enumerate(zip(labels, templates)):
+            signature = template_expansion.family_signature(compiled)
+            for domain_index, domain in enumerate(domains):
+                key = (signature, domain.name)
+                if key not in family_counts:
+                    family_counts[key] = template_expansion.count_template_solutions(compiled, domain, engine)
+                if family_counts[key]:
+                    unit = (template_index, domain_index)
+                    counts[unit] = family_counts[key]
+                    strata.setdefault(self.stratum(label, row, domain), []).append(unit)
+
+        stratum_sizes = allocate_evenly(
+            self.size, {stratum: sum(counts[unit] for unit in units) for stratum, units in strata.items()}
+        )
+        quotas = {}
+        for stratum, units in strata.items():
+            shares = allocate_proportionally(stratum_sizes[stratum], [counts[unit] for unit in units])
+            for unit, share in zip(units, shares):
+                if share:
+                    quotas[unit] = (share, counts[unit])
+        return quotas
+
+    def rng(self, template_index, domain):
+        # seeded per pair so the sample doesn't depend on the order the pairs are solved in
+        return random.Random(f"{self.seed}:{template_index}:{domain.schema_id}")
+
+    def sample(self, template_index, compiled, domain, engine, quota, count):
+        """
+        Draws quota of the count solutions of a template x schema pair.
+        """
+        if quota >= count:
+            solutions = template_expansion.solve_template(compiled, domain, engine)
+        elif engine == "backtracking":
+            solver = template_expansion.backtracking_solver(compiled, domain)
+            rng = self.rng(template_index, domain)
+            solutions = solver.sample_solutions(quota, rng)
+        else:
+            # the other engines only enumerate, sample the full solution list
+            solutions = template_expansion.solve_template(compiled, domain, engine)
+            solutions = self.rng(template_index, domain).sample(solutions, quota)
+        return template_expansion.order_solutions(solutions, compiled, domain)
+
+
+def allocate_evenly(size, capacities):
+    """
+    Splits size evenly over the keys, no key gets more than its capacity.
+    """
+    allocated = {key: 0 for key in capacities}
+    remaining = size
+    open_keys = [key for key in capacities if capacities[key] > 0]
+    while remaining > 0 and open_keys:
+        share = remaining // len(open_keys)
+        if share == 0:
+            # fewer rows than keys left, the first keys get one each
+            for key in open_keys[:remaining]:
+                allocated[key] += 1
+            break
+        for key in open_keys:
+            added = min(share, capacities[key] - allocated[key])
+            allocated[key] += added
+            remaining -= added
+        open_keys = [key for key in open_keys if allocated[key] < capacities[key]]
+    return allocated
+
+
+def allocate_proportionally(size, counts):
+    """
+    Splits size in proportion to counts (largest remainder), size is at most sum(counts).
+    """
+    total = sum(counts)
+    if total == 0:
+        return [0 for _ in counts]
+    exact = [size * count / total for count in counts]
+    shares = [int(x) for x in exact]
+    by_remainder = sorted(range(len(counts)), key=lambda i: shares[i] - exact[i])
+    for i in by_remainder[:size - sum(shares)]:
+        shares[i] += 1
+    return shares
@@ -3,209 +3,546 @@ import pandas as pd
 import re
 from constraint import *
 import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from schema_domain import build_domains
+from solution_catalogue import compact_solution
+from template_solver import BacktrackingSolver
+from numpy_solver import NumpySolver
+from template_resolver import (
+    DEFAULT_SAMPLE,
+    TAG_PATTERN,
+    compile_query_segments,
+    compile_spec_segments,
+    resolve_batch,
+    resolve_segments,
+)
+from constraint_compiler import SAMPLE_PATTERN, compile_constraints, compile_function, is_structural
 
 # from parsimonious.grammar import Grammar
 from pprint import pprint
 
-def expand(df, dataset_schemas):
+
+# columns added by compile_template, they are dropped from the expanded rows
+COMPILED_COLUMNS = [
+    "tags",
+    "samples",
+    "fields",
+    "locations",
+    "default_sample",
+    "expanded_constraints",
+    "query_segments",
+    "spec_segments",
+]
+
+# template columns only read when compiling, they are dropped from the expanded rows too
+DECLARATION_COLUMNS = ["symmetric"]
+
+# template x schema pairs handed to a worker at once by the parallel expansion
+WORK_UNIT_CHUNKSIZE = 8
+
+# work units in flight per worker, bounds the results waiting to be consumed
+WORK_UNITS_PER_JOB = 64
+
+# rows per batch yielded by expand_iter
+EXPANSION_BATCH_SIZE = 10_000
+
+# pools of the parallel expansion. Threads share the templates and schema domains
+# instead of pickling them to every process, they run in parallel on the free-threaded
+# (no GIL) build of CPython 3.13
+EXECUTORS = {"process": ProcessPoolExecutor, "thread": ThreadPoolExecutor}
+
+def expand(df, dataset_schemas, engine="backtracking", jobs=1, sampling=None, cache=None, budget=None, executor="process"):
+    """
+    Expands every template against every dataset schema. With jobs > 1 the
+    template x schema pairs are expanded on a process or thread pool (see EXECUTORS),
+    the rows are in the same order as a serial run.
+    With a solution_sampling.SamplingPolicy only a stratified sample of the rows
+    is expanded. With an expansion_cache.ExpansionCache the solutions of unchanged
+    template x schema pairs are reused from the previous run.
+    With a template_solver.SolveBudget every template x schema solve is time boxed,
+    the truncated pairs are collected in budget.truncated. Pairs reused from the
+    expansion cache skip the budget, they are collected in budget.cached.
+    The solutions are compact references, see solution_catalogue.
+    """
     expanded_rows = []
-    for _, row in df.iterrows():
-        for schema in dataset_schemas:
-            schema_name = schema["name"] #sample id instead of name? 
-            schema_id = schema["udi:sample-id"] #point to sample id path
-            sources = schema["sources"]  #call to sources [ path ], flatten sources?
-            
-            for file in sources:
-                sources_name= file["name"]
-                sources_title= file["title"]
-                sources_path = file["path"]
-            
-            schema_assembly = schema["udi:assembly"]
-            schema_cancer = schema["udi:cancer-type"]
-            schema_genes = schema["udi:genes"]
-            
-            gene_list = []
-            for elem in schema_genes:
-                gene_list.append({'name':elem["name"],'chr':elem["chr"], 'pos':elem["pos"]})
-
-            resource_def = schema["resources"]
-            #sources_flattened = [] 
-
-            # flatten schema_deft
-            resource_flattened = []
-            for file in resource_def:
-                sample = file["name"]
-                url = file["path"]
-                
-                resources_schema = file["schema"]
-                foreignKeys = resources_schema.get("foreignKeys", [])
-                #url = base_path + file_path
-                for col in resources_schema["fields"]:
-                    expanded_col = col.copy()
-                    expanded_col.update(
-                        {
-                            "sample": sample,
-                            "url": url,
-                            "foreignKeys":foreignKeys
-                        }
-                    )
-                    resource_flattened.append(expanded_col)
-                
-                #primary_key = resources_schema["primary_key"] 
-                #file_format = file["format"]
-            # unique_entities = set([x["entity"] for x in schema_flattened])
-            #row_count_lookup = {x["sample"]: x["name"] for x in resource_flattened}
-            url_lookup = {x["sample"]: x["url"] for x in resource_flattened}
-            er_lookup = {x["sample"]: x["foreignKeys"] for x in resource_flattened}
-            unique_samples = url_lookup.keys()
-
-            sample_options = [
-                {
-                    "sample": sample,
-                    "url": url_lookup[sample], 
-                    # "udi:cardinality": row_count_lookup[sample],
-                    "foreignKeys":  er_lookup[sample],
-                    "fields": [ x["name"] for x in resource_flattened if x["sample"] == sample],
-                    "assembly":schema_assembly
-                }
-                for sample in unique_samples
-            ]
-            
-            location_options = [
-                {
-                    'genes':gene_list,
-                    'positions':[pos for gene_info in gene_list for pos in gene_info['pos']],
-                    'chromosomes':[chromosome for gene_info in gene_list for chromosome in gene_info['chr']],
-                }
-            ]
-            
-            field_options=resource_flattened
-
-            new_rows = expand_template(row, sample_options, field_options, location_options)
-            for new_row in new_rows:
-                new_row["dataset_schema"] = schema_name
-            expanded_rows.extend(new_rows)
-    expanded_df = pd.DataFrame(expanded_rows)
+    # the template index is kept as row label
+    index = []
+    for label, expanded_row in iter_expanded_rows(df, dataset_schemas, engine, jobs, sampling, cache, budget, executor):
+        expanded_rows.append(expanded_row)
+        index.append(label)
+    expanded_df = pd.DataFrame(expanded_rows, index=index)
+    if budget is not None:
+        expanded_df.attrs["truncated"] = budget.truncated
     return expanded_df
 
-def expand_template(row, sample_options, field_options, location_options):
-    extract = extract_tags(row["query_template"])
-    tags = extract["tags"]
-    samples = extract["samples"]
-    locations = extract["location"]
-    fields = extract["fields"]
-    constraints = expand_constraints(row["constraints"], tags)
-    # print("⭐ expanded constraints ⭐")
-    # print(row)
-    s = constraint_solver(samples, fields, locations, constraints, sample_options, field_options, location_options)
+def expand_iter(df, dataset_schemas, engine="backtracking", jobs=1, batch_size=EXPANSION_BATCH_SIZE, sampling=None, cache=None, budget=None, executor="process"):
+    """
+    Same rows as expand() as a generator of batches (lists of dicts) of at most
+    batch_size rows, so memory stays flat regardless of the output size.
+    """
+    batch = []
+    for _, expanded_row in iter_expanded_rows(df, dataset_schemas, engine, jobs, sampling, cache, budget, executor):
+        batch.append(expanded_row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_expanded_rows(df, dataset_schemas, engine, jobs, sampling=None, store=None, budget=None, executor="process"):
+    """
+    Yields (template label, expanded row) for every template x schema pair in order.
+    store is an expansion_cache.ExpansionCache, saved once every pair is expanded.
+    Sampled runs use neither the store nor the budget.
+    """
+    if sampling is not None:
+        yield from iter_sampled_rows(df, dataset_schemas, engine, jobs, sampling, executor)
+        return
+    if jobs > 1:
+        yield from iter_expanded_rows_parallel(df, dataset_schemas, engine, jobs, store, budget, executor)
+        return
+    # the schema domains don't depend on the template, build them once
+    domains = build_domains(dataset_schemas)
+    templates = [prepare_template(row) for _, row in df.iterrows()]
+    cache = SolutionCache([compiled for _, compiled in templates], domains, store, budget)
+    print(f"Solving {len(templates):,} templates as {cache.family_count():,} constraint families")
+    for template_index, (label, (row, compiled)) in enumerate(zip(df.index, templates)):
+        for domain in domains:
+            solutions = cache.solve(template_index, compiled, domain, engine)
+            if cache.is_truncated(template_index, domain):
+                budget.record(label, row, domain.name)
+            if budget is not None and cache.is_cached(template_index, domain):
+                budget.record_cached(label, row, domain.name)
+            for expanded_row in expand_template(row, compiled, domain, solutions=solutions):
+                yield label, expanded_row
+    if store is not None:
+        store.save()
+
+def iter_sampled_rows(df, dataset_schemas, engine, jobs, sampling, executor="process"):
+    """
+    Yields the rows of the pairs with a quota in the sampling policy, in the order of
+    a full run. The quotas are computed up front, the pairs are then sampled serially
+    or on a process or thread pool.
+    """
+    labels = list(df.index)
+    domains = build_domains(dataset_schemas)
+    templates = [prepare_template(row) for _, row in df.iterrows()]
+    quotas = sampling.quotas(labels, templates, domains, engine)
+    print(f"Sampling {sum(quota for quota, _ in quotas.values()):,} rows from {len(quotas):,} template x schema pairs")
+    units = sorted(quotas)
+    if jobs > 1:
+        rows = iter_unit_results(
+            units, jobs, sample_unit, init_sampling_worker,
+            (templates, dataset_schemas, engine, sampling, quotas, shared_domains(dataset_schemas, executor, domains)),
+            executor,
+        )
+    else:
+        rows = (
+            sample_template(templates, domains, engine, sampling, quotas, unit)
+            for unit in units
+        )
+    for (template_index, _), unit_rows in zip(units, rows):
+        for expanded_row in unit_rows:
+            yield labels[template_index], expanded_row
+
+def sample_template(templates, domains, engine, sampling, quotas, unit):
+    template_index, domain_index = unit
+    row, compiled = templates[template_index]
+    domain = domains[domain_index]
+    quota, count = quotas[unit]
+    solutions = sampling.sample(template_index, compiled, domain, engine, quota, count)
+    return expand_template(row, compiled, domain, solutions=solutions)
+
+def prepare_template(row):
+    # templates loaded from the snapshot are already compiled
+    compiled = get_compiled_template(row)
+    row = row.drop(COMPILED_COLUMNS + DECLARATION_COLUMNS + ["template_key"], errors="ignore").to_dict()
+    return row, compiled
+
+def iter_expanded_rows_parallel(df, dataset_schemas, engine, jobs, store=None, budget=None, executor="process"):
+    labels = list(df.index)
+    templates = [prepare_template(row) for _, row in df.iterrows()]
+    domains = shared_domains(dataset_schemas, executor)
+    # template major like the serial loop, executor.map keeps this order
+    units = [
+        (template_index, domain_index)
+        for template_index in range(len(templates))
+        for domain_index in range(len(dataset_schemas))
+    ]
+    results = iter_unit_results(
+        units, jobs, expand_unit, init_worker,
+        (templates, dataset_schemas, engine, store, budget, domains),
+        executor,
+    )
+    for (template_index, domain_index), (rows, used, truncated, cached) in zip(units, results):
+        if store is not None:
+            store.merge(used)
+        pair = (labels[template_index], templates[template_index][0], dataset_schemas[domain_index]["udi:name"])
+        if truncated:
+            budget.record(*pair)
+        if budget is not None and cached:
+            budget.record_cached(*pair)
+        for expanded_row in rows:
+            yield labels[template_index], expanded_row
+    if store is not None:
+        store.save()
+
+def shared_domains(dataset_schemas, executor, domains=None):
+    """
+    The domains handed to the workers: thread workers share the domains of the main
+    thread, process workers build their own (None).
+    """
+    if executor != "thread":
+        return None
+    return domains if domains is not None else build_domains(dataset_schemas)
+
+def iter_unit_results(units, jobs, func, initializer, initargs, executor="process"):
+    """
+    func(unit) for every unit on a process or thread pool, in the order of units.
+    """
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor: {executor}, expected one of {list(EXECUTORS)}")
+    window = jobs * WORK_UNITS_PER_JOB
+    with EXECUTORS[executor](max_workers=jobs, initializer=initializer, initargs=initargs) as pool:
+        # submitted a window at a time so finished results don't pile up
+        for start in range(0, len(units), window):
+            yield from pool.map(func, units[start:start + window], chunksize=WORK_UNIT_CHUNKSIZE)
+
+# per worker state of the parallel expansion, set by init_worker. Thread local, so the
+# solution cache and expansion cache of a thread are only touched by that thread
+worker_state = threading.local()
+
+def init_worker(templates, dataset_schemas, engine, store=None, budget=None, domains=None):
+    # process workers get the templates and schemas once and build the domains there
+    worker_state.templates = templates
+    worker_state.domains = domains if domains is not None else build_domains(dataset_schemas)
+    worker_state.engine = engine
+    # the used pairs of each worker are merged into the store of the main thread
+    worker_state.store = store.fork() if store is not None else None
+    worker_state.cache = SolutionCache(
+        [compiled for _, compiled in templates], worker_state.domains, worker_state.store, budget
+    )
+
+def expand_unit(unit):
+    """
+    Returns the rows of the pair, the pairs the worker's expansion cache used (for the
+    cache of the main process), whether the solve of the pair was truncated and
+    whether it was reused from the expansion cache.
+    """
+    template_index, domain_index = unit
+    row, compiled = worker_state.templates[template_index]
+    domain = worker_state.domains[domain_index]
+    solutions = worker_state.cache.solve(template_index, compiled, domain, worker_state.engine)
+    store = worker_state.store
+    return (
+        expand_template(row, compiled, domain, solutions=solutions),
+        store.take_used() if store is not None else None,
+        worker_state.cache.is_truncated(template_index, domain),
+        worker_state.cache.is_cached(template_index, domain),
+    )
+
+def init_sampling_worker(templates, dataset_schemas, engine, sampling, quotas, domains=None):
+    worker_state.templates = templates
+    worker_state.domains = domains if domains is not None else build_domains(dataset_schemas)
+    worker_state.engine = engine
+    worker_state.sampling = sampling
+    worker_state.quotas = quotas
+
+def sample_unit(unit):
+    return sample_template(
+        worker_state.templates,
+        worker_state.domains,
+        worker_state.engine,
+        worker_state.sampling,
+        worker_state.quotas,
+        unit,
+    )
+
+def write_parquet(batches, path, drop_columns=("solution",)):
+    """
+    Writes the batches of expand_iter to a parquet file one row group at a time.
+    The solution is dropped by default, like the parquet export of main.py.
+    Returns the number of rows written.
+    """
+    writer = None
+    rows = 0
+    try:
+        for batch in batches:
+            records = [{k: v for k, v in row.items() if k not in drop_columns} for row in batch]
+            if writer is None:
+                table = pa.Table.from_pylist(records)
+                # columns that are empty in the first batch (e.g. the solution names of
+                # variables its templates don't have) are written as strings
+                schema = pa.schema([
+                    pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                    for field in table.schema
+                ])
+                table = table.cast(schema)
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                # later batches follow the schema of the first one
+                table = pa.Table.from_pylist(records, schema=writer.schema)
+            writer.write_table(table)
+            rows += len(records)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+def expand_template(row, compiled, domain, engine="backtracking", solutions=None):
+    """
+    Expands a template against a schema, solutions that were already solved
+    (e.g. for a template of the same family) can be passed in.
+    """
+    if solutions is None:
+        solutions = solve_template(compiled, domain, engine)
+    rows = expand_solutions(row, compiled, solutions, domain)
+    for new_row in rows:
+        new_row["dataset_schema"] = domain.name
+    return rows
+
+
+def solve_template(compiled, domain, engine="backtracking", clock=None):
+    return constraint_solver(
+        compiled["samples"],
+        compiled["fields"],
+        compiled["locations"],
+        compiled["expanded_constraints"],
+        domain.sample_options,
+        domain.field_options,
+        domain.location_options,
+        engine=engine,
+        domain=domain,
+        clock=clock,
+    )
+
+
+def count_template_solutions(compiled, domain, engine="backtracking"):
+    """
+    Number of solutions of a template for a schema, the backtracking engine counts
+    them without building them.
+    """
+    if engine != "backtracking":
+        return len(solve_template(compiled, domain, engine))
+    return backtracking_solver(compiled, domain).count_solutions()
+
+
+def backtracking_solver(compiled, domain):
+    return BacktrackingSolver(
+        compiled["samples"],
+        compiled["fields"],
+        compiled["locations"],
+        compiled["expanded_constraints"],
+        domain.sample_options,
+        domain.field_options,
+        domain.location_options,
+        domain.overlap_index,
+        domain.foreign_key_index,
+    )
+
+
+def family_signature(compiled):
+    """
+    Templates with the same variables and compiled constraints (e.g. a question and its
+    utterance, or two axis orientations) form a family, they have the same solutions.
+    """
+    return json.dumps([
+        compiled["samples"],
+        compiled["fields"],
+        compiled["locations"],
+        sorted(json.dumps(c, sort_keys=True) for c in compiled["expanded_constraints"]),
+    ])
+
+
+class SolutionCache:
+    """
+    Solves every template family once per schema. The solutions are kept until the
+    last template of the family is expanded.
+
+    Schemas with the same structure (e.g. the C2M2 data packages, see
+    SchemaDomain.structure_key) share a solve of the structural constraints, only the
+    remaining constraints (cardinalities, overlap, relationship cardinality) are
+    checked per schema.
+
+    With a store (expansion_cache.ExpansionCache) families are only solved if their
+    solutions for the schema aren't stored from a previous run.
+
+    With a budget (template_solver.SolveBudget) every solve gets its own clock, the
+    families whose solve ran out are kept in truncated and are not stored. The
+    families reused from the store are complete solves that skipped the budget,
+    they are kept in cached.
+    """
+
+    def __init__(self, compiled_templates, domains, store=None, budget=None):
+        self.store = store
+        self.budget = budget
+        # (signature, schema name) of the truncated solves
+        self.truncated = set()
+        # (signature, structure key) of the truncated structural solves
+        self.truncated_structures = set()
+        # (signature, schema name) of the solves reused from the store
+        self.cached = set()
+        self.signatures = [family_signature(compiled) for compiled in compiled_templates]
+        self.last_template = {signature: i for i, signature in enumerate(self.signatures)}
+        # structure key -> name of the last schema with that structure
+        self.last_domain = {}
+        for domain in domains:
+            self.last_domain[domain.structure_key] = domain.name
+        self.shared_structures = {
+            key for key in self.last_domain
+            if sum(domain.structure_key == key for domain in domains) > 1
+        }
+        # (signature, schema name) -> solutions
+        self.solutions = {}
+        # (signature, structure key) -> solutions of the structural constraints as option positions
+        self.structural_solutions = {}
+
+    def family_count(self):
+        return len(self.last_template)
+
+    def solve(self, template_index, compiled, domain, engine):
+        signature = self.signatures[template_index]
+        key = (signature, domain.name)
+        if key not in self.solutions:
+            store_key = self.store.key(signature, compiled, domain) if self.store is not None else None
+            solutions = self.store.get(store_key, compiled, domain) if store_key is not None else None
+            if solutions is None:
+                solutions = self.solve_family(signature, template_index, compiled, domain, engine)
+                if store_key is not None and key not in self.truncated:
+                    self.store.put(store_key, compiled, domain, solutions)
+            else:
+                self.cached.add(key)
+            self.solutions[key] = solutions
+        if self.last_template[signature] == template_index:
+            return self.solutions.pop(key)
+        return self.solutions[key]
+
+    def is_truncated(self, template_index, domain):
+        return (self.signatures[template_index], domain.name) in self.truncated
+
+    def is_cached(self, template_index, domain):
+        return (self.signatures[template_index], domain.name) in self.cached
+
+    def clock(self, signature, scope):
+        """
+        The budget clock of a solve, scope is the schema name, or the structure key for a
+        structural solve shared by the schemas of that structure (so it doesn't depend
+        on which of them is solved first, e.g. by a parallel worker).
+        """
+        if self.budget is None:
+            return None
+        return self.budget.clock(f"{signature}:{scope}")
+
+    def solve_family(self, signature, template_index, compiled, domain, engine):
+        if domain.structure_key in self.shared_structures:
+            return self.solve_shared(signature, template_index, compiled, domain, engine)
+        clock = self.clock(signature, domain.name)
+        solutions = solve_template(compiled, domain, engine, clock)
+        if clock is not None and clock.exhausted:
+            self.truncated.add((signature, domain.name))
+        return order_solutions(solutions, compiled, domain)
+
+    def solve_shared(self, signature, template_index, compiled, domain, engine):
+        structural, specific = [], []
+        for constraint in compiled["expanded_constraints"]:
+            (structural if is_structural(constraint) else specific).append(constraint)
+        key = (signature, domain.structure_key)
+        if key not in self.structural_solutions:
+            clock = self.clock(signature, domain.structure_key)
+            solutions = solve_template(dict(compiled, expanded_constraints=structural), domain, engine, clock)
+            if clock is not None and clock.exhausted:
+                self.truncated_structures.add(key)
+            self.structural_solutions[key] = [domain.get_positions(solution) for solution in solutions]
+        if key in self.truncated_structures:
+            # every schema sharing the structure gets part of the solutions
+            self.truncated.add((signature, domain.name))
+        positions = self.structural_solutions[key]
+        if self.last_template[signature] == template_index and self.last_domain[domain.structure_key] == domain.name:
+            del self.structural_solutions[key]
+
+        checks = [
+            (tuple(constraint["variables"]), schema_check(constraint, domain))
+            for constraint in specific
+        ]
+        solutions = []
+        for solution_positions in positions:
+            solution = domain.get_options(solution_positions)
+            if all(check(*[solution[v] for v in variables]) for variables, check in checks):
+                solutions.append(solution)
+        return order_solutions(solutions, compiled, domain)
 
-    return expand_solutions(row, tags, s)
+
+def schema_check(constraint, domain):
+    """
+    The function checking a constraint on the options of a schema.
+    """
+    if constraint["kind"] == "overlap":
+        return domain.overlap_index.overlaps
+    return compile_function(constraint["source"], tuple(constraint["variables"]), domain.foreign_key_index)
+
+
+def order_solutions(solutions, compiled, domain):
+    """
+    Orders the solutions (and their variables) by the option positions of their variables,
+    so the order doesn't depend on the engine or on whether the structure was shared.
+    """
+    variables = compiled["samples"] + compiled["fields"] + compiled["locations"]
+    solutions = sorted(
+        solutions,
+        key=lambda solution: [domain.positions[id(solution[v])] for v in variables],
+    )
+    return [{v: solution[v] for v in variables} for solution in solutions]
 
 
-def expand_solutions(row, tags, solutions):
+def compile_template(row):
+    """
+    Parse the tags, expand the constraints and split the query and spec templates into segments.
+    None of this depends on the dataset schema, so it only has to happen once per
+    template and can be persisted with template_snapshot.
+    """
+    extract = extract_tags(row["query_template"])
+    return {
+        "tags": extract["tags"],
+        "samples": extract["samples"],
+        "fields": extract["fields"],
+        "locations": extract["locations"],
+        "default_sample": extract["default_sample"],
+        "expanded_constraints": compile_constraints(
+            list(row["constraints"]), extract["tags"], extract["default_sample"], row.get("symmetric") or []
+        ),
+        "query_segments": compile_query_segments(row["query_template"], extract["tags"]),
+        "spec_segments": compile_spec_segments(row["spec_template"], extract["tags"]),
+    }
+
+
+def get_compiled_template(row):
+    if all(column in row.index for column in COMPILED_COLUMNS):
+        return {column: row[column] for column in COMPILED_COLUMNS}
+    return compile_template(row)
+
+
+def expand_solutions(row, compiled, solutions, domain):
+    query_bases = resolve_batch(compiled["query_segments"], solutions)
+    specs = resolve_batch(compiled["spec_segments"], solutions, domain.foreign_key_index)
     result = []
-    for s in solutions:
-        expanded_row = row.copy()
-        expanded_row["query_base"] = resolve_query_template(
-            row["query_template"], tags, s
-        )
-        expanded_row["spec"] = resolve_spec_template(row["spec_template"], tags, s)
-        expanded_row["solution"] = cleanup_solution(s)
+    for s, query_base, spec in zip(solutions, query_bases, specs):
+        expanded_row = dict(row)
+        expanded_row["query_base"] = query_base
+        expanded_row["spec"] = spec
+        # materialized on export by solution_catalogue.SolutionCatalogue
+        expanded_row["solution"] = compact_solution(s, domain)
         result.append(expanded_row)
     # pprint(result)
     return result
 
-def cleanup_solution(solution):
-    cleaned = {}
-    for k in solution:
-        newK = k.replace('_', '.')
-        cleaned[newK] = solution[k]
-        if 'F' in newK and 'foreignKeys' in cleaned[newK]:
-            cleaned[newK].pop('foreignKeys')
-    return cleaned
-
 def resolve_query_template(query_template, tags, solution):
-    query_base = query_template
-    for tag in tags:
-        if tag["field"]:
-            k = tag["sample"] + "_" + tag["field"] 
-            resolved = solution[k]["name"]
-        else:
-            resolved = solution[tag["sample"]]["sample"] #redefine entity as sample
-        query_base = query_base.replace(f"<{tag['original']}>", resolved, 1)
-    return query_base
-
-def resolve_spec_template(spec_template, tags, solution):
-    spec = spec_template
-    pattern = r"<([^>]+)>"
-    while True:
-        match = re.search(pattern, spec)
-        if match == None:
-            break
-        match = match.group(0)
-        content = match.strip("<>")
-        parts = content.split(".")
-        if len(parts) == 1:
-            content = parts[0]
-            if content.startswith("S"):
-                sample = content
-                resolved = solution[sample]["sample"]
-            else:
-                resolved = solution["S_" + parts[0]]["name"]
-        elif len(parts) == 2:
-            left, right = parts
-            if right == "url":
-                resolved = solution[left]["url"]
-            else:
-                resolved = solution[left + "_" + right]["name"]
-        elif len(parts) == 5:
-            S1, r, S2, id, source = parts
-            if S1[0] != "S" or S2[0] != "S" or r != "r" or id != "id" or source not in ["from", "to"]:
-                raise ValueError(
-                    f"Invalid match: {match}. Unexpected formatting of spec template tag."
-                )
-            S2_name = solution[S2]["source"]
-            # resolved = solution[E1]["foreignKeys"][E2_name]["id"][source]
-            # What needs to happen here, is it should loop over foreign keys to find if reference.resource matches E2_name
-            # and then if source is 'from' return fields else return reference.fields
-            foreignKeys = solution[S1]["foreignKeys"]
-            matchedKey = next(
-                (fk for fk in foreignKeys if fk["reference"]["resource"] == S2_name),
-                None,
-            )
-            if matchedKey is None:
-                raise ValueError(
-                    f"Invalid match: {match}. Could not find foreign key for {S1} to {S2}"
-                )
-            if source == "from":
-                resolved = matchedKey["fields"]
-            else:
-                resolved = matchedKey["reference"]["fields"]
-            if len(resolved) == 1:
-                resolved = resolved[0]
-            else:
-                resolved = f"[\"{'","'.join(resolved)}\"]"
-                match = f"\"{match}\"" # add quotes because the replace needs to replace the string with a list of strings.
-        else:
-            raise ValueError(
-                f"Invalid match: {match}. Unexpected formatting length of spec template tag."
-            )
-        spec = spec.replace(match, resolved, 1)
-    
-    # Special care needs to take place to handle comparisons
-    # e.g. {lte} should be replaced with <=
-    # this must happen after the other replacements that are 
-    # looking for < and > characters.
-    comparisons = [
-        {"content": "{lte}", "resolved": "<="},
-        {"content": "{gte}", "resolved": ">="},
-        {"content": "{lt}", "resolved": "<"},
-        {"content": "{gt}", "resolved": ">"}
-    ]
-    for comparison in comparisons:
-        spec = spec.replace(comparison["content"], comparison["resolved"])
-    
-    return spec
+    return resolve_segments(compile_query_segments(query_template, tags), solution)
+
+def resolve_spec_template(spec_template, tags, solution, foreign_key_index=None):
+    return resolve_segments(compile_spec_segments(spec_template, tags), solution, foreign_key_index)
 
 
 def extract_tags(text: str) -> List[Dict[str, Union[str, List[str]]]]:
@@ -223,19 +560,21 @@ def extract_tags(text: str) -> List[Dict[str, Union[str, List[str]]]]:
         ]
         
     """
-    pattern = r"<([^>]+)>"
+    pattern = TAG_PATTERN
     matches = re.findall(pattern, text)
 
     tags = []
     # match: each time the pattern appears in the text
-    # <F.p.q> or <F.p>
-    # <F.g>
+    # <F:p.q> or <F:p>
+    # <F:g>
     for match in matches:
-        parts = match.split(".")
-        sample, field, location, field_type = None, None, None, None
+        # the field type can contain '.' as well (<F:p.q>, a quantitative point)
+        path, _, field_type = match.partition(":")
+        parts = path.split(".")
+        sample, field, location = None, None, None
         if len(parts) == 1:
             first = parts[0]
-            if first.startswith("S"):
+            if SAMPLE_PATTERN.fullmatch(first):
                 sample = first
             elif first.startswith("L"):
                 location = first
@@ -254,46 +593,41 @@ def extract_tags(text: str) -> List[Dict[str, Union[str, List[str]]]]:
             )
 
         if field:
-            field_parts = field.split(":")
-
-            if len(field_parts) == 2:
-                field, field_type = field_parts                
-                
-                if len(field_type)==1:
-                    field_type = [
-                        {"n": "nominal", 
-                        "o": "ordinal", 
-                        "q": "quantitative", 
-                        "g": "genomic",
-                        "g&q": "quantitative genomic",
-                        "g&c": "categorical genomic",
-                        "p": "point",
-                        "p&n": "nominal point",
-                        "p&o":"ordinal point",
-                        "p&q": "quantiative point",
-                        "s": "segment",
-                        "s&n": "nominal segment",
-                        "s&o":"ordinal segment",
-                        "s&q": "quantiative segment",
-                        "c": "connective"}[t]
-                        for t in field_type.split("|")
-                    ]
-                
-                else:
-                    raise ValueError(
-                        f"Invalid match: {match}. Field type must be specified"
-                    )
+            if field_type:
+                field_type = [
+                    {"n": "nominal", 
+                    "o": "ordinal", 
+                    "q": "quantitative", 
+                    "g": "genomic",
+                    "g&q": "quantitative genomic",
+                    "g&c": "categorical genomic",
+                    "p": "point",
+                    "p&n": "nominal point",
+                    "p&o":"ordinal point",
+                    "p&q": "quantiative point",
+                    "s": "segment",
+                    "s&n": "nominal segment",
+                    "s&o":"ordinal segment",
+                    "s&q": "quantiative segment",
+                    "c": "connective"}[t.replace(".", "&")]
+                    for t in field_type.split("|")
+                ]
+            else:
+                raise ValueError(
+                    f"Invalid match: {match}. Field type must be specified"
+                )
 
         tags.append(
             {
                 "sample": sample,
                 "field": field,
                 "location": location,
-                "allowed_fields": field_type,
+                "allowed_fields": field_type if field else None,
                 "original": match,
             }
         )
     infer_entity(tags)
+    default_sample = next((tag["sample"] for tag in tags), DEFAULT_SAMPLE)
     samples = set([tag["sample"] for tag in tags])
     # fields = set([tag["field"] for tag in tags if tag["field"]])
     fields = set(
@@ -302,14 +636,21 @@ def extract_tags(text: str) -> List[Dict[str, Union[str, List[str]]]]:
     locations = set(
         [str(tag["sample"]) + "_" + tag["location"] for tag in tags if tag["location"]]
     )
-    return {"tags": tags, "samples": list(samples), "locations": list(locations), "fields": list(fields)}
+    return {
+        "tags": tags,
+        "samples": sorted(samples),
+        "locations": sorted(locations),
+        "fields": sorted(fields),
+        "default_sample": default_sample,
+    }
 
 
 def infer_entity(
     tags: List[Dict[str, Union[str, List[str]]]],
 ) -> List[Dict[str, Union[str, List[str]]]]:
     """
-    Infer the based on the other entities. If none is provided, default to E.
+    Infer the based on the other entities. If a single entity is defined use it,
+    if none is provided, default to E.
     If there is an empty entity and multiple other entities defined, thwrow an error.
     """
     defined_entities = [tag["sample"] for tag in tags if tag["sample"]]
@@ -317,164 +658,75 @@ def infer_entity(
 
     if len(unique_entities) > 1 and any(not tag["sample"] for tag in tags):
         raise ValueError("Multiple entities defined, cannot infer empty sample.")
+    default_sample = defined_entities[0] if defined_entities else DEFAULT_SAMPLE
     for tag in [x for x in tags if not x["sample"]]:
-        tag["sample"] = "S"
+        tag["sample"] = default_sample
     return tags
 
 
-def expand_constraints(
-    constraints: List[str], tags: List[Dict[str, Union[str, List[str]]]]
-) -> List[str]:  # type: ignore
-    """
-    the current constraints will be expanded a bit
-        e.g. F.c > 4 → F["udi:cardinality"] > 4
-    the tags will add constraints for each field type
-    and will add a constraint to ensure unique fields
-    """
-    expanded_constraints = []
-    for constraint in constraints:
-        # E1.r.E2.c.to → E1.r.E2['cardinality'].to
-        resolved = constraint.replace(".c", "['udi:cardinality']")
-        
-        # E1.r.E2['cardinality'].to → E1.r[E2['entity']]['cardinality'].to
-        resolved, isErConstraint = resolve_related_entity(resolved)
-        if isErConstraint:
-            relationship_existance = create_relationship_existence_constraint(constraint)
-            expanded_constraints.append(relationship_existance)
-        # E1.r[E2["name"]]['cardinality'].to →
-        # E1['relationships][E2["name"]]['cardinality'].to
-        resolved = resolved.replace(".r", "['foreignKeys']")
-        # E1['relationships][E2["name"]]['cardinality'].to →
-        # E1['relationships][E2["name"]]['cardinality']['to']
-        resolved = resolved.replace(".to", "['to']")
-        resolved = resolved.replace(".from", "['from']")
-        resolved = resolved.replace(".fields", "['fields']")
-        resolved = resolved.replace(".name", "['name']")
-        #  E1.F1 → E1_F1
-        resolved = resolved.replace(".", "_")
-        #  F → E_F1
-        resolved = add_default_entity(resolved)
-        expanded_constraints.append(resolved)
-
-    # Turn field types into constraints
-    expanded_constraints.extend(
-        [
-            f"{tag['entity']}_{tag['field']}['udi:data_type'] in {tag['allowed_fields']}"
-            for tag in tags
-            if tag["field"]
-        ]
-    )
-
-    # Ensure fields are not repeated
-    unique_fields = set(
-        [str(tag["entity"]) + "_" + tag["field"] for tag in tags if tag["field"]]
-    )
-    # if len(unique_fields) > 1:
-    #     for field in unique_fields:
-    #         other_fields = unique_fields - {field}
-    #         expanded_constraints.append(f"{field} not in {other_fields}")
-
-    if len(unique_fields) > 1:
-        for field in unique_fields:
-            other_fields = unique_fields - {field}
-            name_str = "['name']"
-            other_fields_string = (
-                "[" + ",".join([str(x) + name_str for x in other_fields]) + "]"
-            )
-            expanded_constraints.append(
-                f"{field + name_str} not in {other_fields_string}"
-            )
-
-    # ensure that entities are not repeated
-    unique_entities = set([tag["entity"] for tag in tags])
-    if len(unique_entities) > 1:
-        for entity in unique_entities:
-            other_entities = unique_entities - {entity}
-            e_str = "['entity']"
-            other_entities_string = (
-                "[" + ",".join([str(x) + e_str for x in other_entities]) + "]"
-            )
-            expanded_constraints.append(
-                f"{entity + e_str} not in {other_entities_string}"
-            )
-
-    # ensure that fields belong to their entity
-    for field in unique_fields:
-        entity = field.split("_")[0]
-        expanded_constraints.append(f"{field}['entity'] == {entity}['entity']")
-
-    return expanded_constraints
-
-
-def create_relationship_existence_constraint(constraint: str) -> str:
-    '''
-    given an input E1.r.E2.c.to == 'one'
-    want to generate a relationship existence constraint:
-        E2['entity'] in [fk['reference']['resource'] for fk in E1['foreignKeys']]
-    '''
-    parts = constraint.split('.')
-    if len(parts) < 3:
-        raise ValueError("Unexpected relationship constraint length:", constraint)
-    S1, r, S2 = parts[:3]
-    if (S1[0] != 'S') or (S2[0] != 'S') or (r != 'r'):
-        raise ValueError("Unexpected relationship constraint:", constraint)
-    existence_constraint =  f"{S2}['entity'] in [fk['reference']['resource'] for fk in {S1}['foreignKeys']]"
-    return existence_constraint
-
-def resolve_related_entity(text): 
-    # use regex to replace E1.r.E2.c.to with:
-    # {fk['reference']['resource']:fk for fk in E1['foreignKeys']}.r[E2['entity']].c.to
-    # other things (.c, .to) well be resolved elsewhere
-    # assumes that the only time .E exists is when finding a relationship
-    foundConstraint = False
-    pattern = r'\.S[0-9]*'
-    while re.search(pattern, text):
-        foundConstraint = True
-        match = re.search(pattern, text).group(0)
-        resolved = f"[{match.lstrip('.')}['sample']]"
-        text = text.replace(match, resolved)
-    if foundConstraint:
-        pattern = r'E[0-9]*\.r'
-        while re.search(pattern, text):
-            match = re.search(pattern, text).group(0)
-            S_number = match.split(".")[0].lstrip("S")
-            resolved = "{fk['reference']['resource']:fk for fk in S" + str(S_number) + "['foreignKeys']}"
-            text = text.replace(match, resolved)
-    return text, foundConstraint
-
-def add_default_entity(text):
-    # Use regex to match "F" that is not preceded by "_" and replace it with "S_F"
-    modified_text = re.sub(r'(?<!_)F', r'S_F', text)
-    # replace L that does not have _ to replace with S_L
-    modified_text = re.sub(r'(?<!_)L', r'S_L', modified_text)
-    return modified_text
-
 def constraint_solver(
     samples: List[str],
     fields: List[str],
     locations: List[str],
-    constraints: List[str],
+    constraints: List[Dict[str, Union[str, List[str]]]],
     sample_options: List[Dict[str, Union[str, int]]],
     field_options: List[Dict[str, Union[str, int]]],
-    location_options:  List[Dict[str, Union[str, int]]]
+    location_options:  List[Dict[str, Union[str, int]]],
+    engine: str = "backtracking",
+    domain=None,
+    clock=None,
 ) -> List[Dict[str, str]]:
+    """
+    Returns every assignment of the variables that satisfies the constraints.
+    engine selects the search implementation:
+        backtracking - the specialised solver in template_solver
+        numpy - vectorized evaluation on columnar options in numpy_solver
+        python-constraint - the generic python-constraint search, kept as a reference
+    domain is the schema_domain.SchemaDomain the options belong to, its overlap and
+    foreign key indexes (and numpy columns) are used when given. The python-constraint
+    engine always evaluates the constraints as written.
+    clock is a template_solver.BudgetClock, when it runs out the solutions found so far
+    are returned and clock.exhausted is set. The numpy engine has no partial solutions
+    when it runs out, the pair is then solved again by the backtracking engine with a
+    restarted clock, so it gets the same truncated solutions as with that engine.
+    """
+    overlap_index = domain.overlap_index if domain is not None else None
+    foreign_key_index = domain.foreign_key_index if domain is not None else None
+    if engine == "numpy":
+        solver = NumpySolver(
+            samples, fields, locations, constraints, sample_options, field_options, location_options,
+            domain.get_columns() if domain is not None else None, overlap_index, foreign_key_index, clock,
+        )
+        solutions = solver.get_solutions()
+        if clock is None or not clock.exhausted:
+            return solutions
+        clock.restart()
+        engine = "backtracking"
+    if engine == "backtracking":
+        solver = BacktrackingSolver(
+            samples, fields, locations, constraints, sample_options, field_options, location_options,
+            overlap_index, foreign_key_index, clock,
+        )
+        return solver.get_solutions()
+    if engine != "python-constraint":
+        raise ValueError(f"Unknown constraint solver engine: {engine}")
     problem = Problem()
-    # print("⭐ constraints ⭐")
-    # pprint(constraints)
-    # print("⭐ entities ⭐")
-    # pprint(entities)
-    # pprint(entity_options)
-    # print("⭐ fields ⭐")
-    # pprint(fields)
-    # pprint(field_options)
     problem.addVariables(fields, field_options)
     problem.addVariables(samples, sample_options)
 
     problem.addVariables(locations, location_options)
     for constraint in constraints:
-        problem.addConstraint(constraint)
-    s = problem.getSolutions()
-    # pn s
+        variables = tuple(constraint["variables"])
+        func = compile_function(constraint["source"], variables)
+        problem.addConstraint(FunctionConstraint(func), variables)
+    if clock is None:
+        return problem.getSolutions()
+    s = []
+    for solution in problem.getSolutionIter():
+        if clock.tick():
+            break
+        s.append(solution)
+    return s
 
 def test_constraint_solver():
     problem = Problem()
@@ -1,6 +1,6 @@
-import pandas as pd
 from udi_grammar_py import Chart, Op, rolling
 from enum import Enum
+from template_registry import TemplateRegistry
 
 class QueryType(Enum):
     QUESTION = "question"
@@ -25,56 +25,14 @@ class ChartType(Enum):
     GROUPED_DOT = "grouped_dot"
 
 
-def add_row(df, query_template, spec, constraints, query_type: QueryType, chart_type: ChartType):
-    spec_key_count = get_total_key_count(spec.to_dict())
-    if spec_key_count <= 12:
-        complexity = "simple"
-    elif spec_key_count <= 24:
-        complexity = "medium"
-    elif spec_key_count <= 36:
-        complexity = "complex"
-    else:
-        complexity = "extra complex"
-    df.loc[len(df)] = {
-        "query_template": query_template,
-        "constraints": constraints,
-        "spec_template": spec.to_json(),
-        "query_type": query_type.value,
-        "creation_method": "template",
-        "chart_type": chart_type.value,
-        "chart_complexity": complexity,
-        "spec_key_count": spec_key_count
-    }
-    return df
-
-def get_total_key_count(nested_dict):
-    if isinstance(nested_dict, dict):
-        return sum(get_total_key_count(value) for value in nested_dict.values())
-    elif isinstance(nested_dict, list):
-        return sum(get_total_key_count(item) for item in nested_dict)
-    else:
-        return 1
-
 def generate():
-    df = pd.DataFrame(
-        columns=[
-            "query_template",
-            "constraints",
-            "spec_template",
-            "query_type",
-            "creation_method",
-            "chart_type",
-            "chart_complexity",
-            "spec_key_count",
-        ]
-    )
+    registry = TemplateRegistry()
 
     # Define recurring constraints
     overlap = "F1['name'] in F2['udi:overlapping_fields'] or F2['udi:overlapping_fields'] == 'all'"
 
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="How many <E> are there, grouped by <F:n>?",
         spec=(
             Chart()
@@ -94,8 +52,7 @@ def generate():
         chart_type=ChartType.BARCHART,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="How many <E> are there, grouped by <F:n>?",
         spec=(
             Chart()
@@ -116,8 +73,7 @@ def generate():
     )
 
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a bar chart of <E> <F:n>.",
         spec=(
             Chart()
@@ -137,8 +93,7 @@ def generate():
         chart_type=ChartType.BARCHART,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a bar chart of <E> <F:n>.",
         spec=(
             Chart()
@@ -158,8 +113,7 @@ def generate():
         chart_type=ChartType.BARCHART,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="How many <E1> are there, grouped by <E2.F:n>?",
         spec=(
             Chart()
@@ -187,8 +141,7 @@ def generate():
         chart_type=ChartType.BARCHART,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="How many <E1> are there, grouped by <E2.F:n>?",
         spec=(
             Chart()
@@ -216,8 +169,7 @@ def generate():
         chart_type=ChartType.BARCHART,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"How many <E1> are there, grouped by <E1.F1:n> and <E2.F2:n>?",
         spec=(
             Chart()
@@ -251,8 +203,7 @@ def generate():
         chart_type=ChartType.STACKED_BAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"How many <E1> are there, grouped by <E1.F1:n> and <E2.F2:n>?",
         spec=(
             Chart()
@@ -287,8 +238,7 @@ def generate():
         chart_type=ChartType.STACKED_BAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"How many <E> are there, grouped by <F1:n> and <F2:n>?",
         spec=(
             Chart()
@@ -314,8 +264,7 @@ def generate():
         chart_type=ChartType.STACKED_BAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"How many <E> are there, grouped by <F1:n> and <F2:n>?",
         spec=(
             Chart()
@@ -342,8 +291,7 @@ def generate():
         chart_type=ChartType.STACKED_BAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"What is the count of <F1:n> for each <F2:n>?",
         spec=(
             Chart()
@@ -369,8 +317,7 @@ def generate():
         chart_type=ChartType.GROUPED_BAR
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"What is the count of <F1:n> for each <F2:n>?",
         spec=(
             Chart()
@@ -398,8 +345,7 @@ def generate():
         chart_type=ChartType.GROUPED_BAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"What is the count of <F1:n> for each <F2:n>?",
         spec=(
             Chart()
@@ -427,8 +373,7 @@ def generate():
     )
 
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"What is the frequency of <F1:n> for each <F2:n>?",
         spec=(
             Chart()
@@ -461,8 +406,7 @@ def generate():
         chart_type=ChartType.NORMALIZED_BAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"What is the frequency of <F1:n> for each <F2:n>?",
         spec=(
             Chart()
@@ -498,8 +442,7 @@ def generate():
 
     for name, op in [('minimum', Op.min), ('maximum', Op.max), ('average', Op.mean), ('median', Op.median), ('total', Op.sum)]:
         named_aggregate = f"{name} <F1>"
-        df = add_row(
-            df,
+        registry.add_row(
             query_template=f"What is the {name} <F1:q> for each <F2:n>?",
             spec=(
                 Chart()
@@ -521,8 +464,7 @@ def generate():
             chart_type=ChartType.BARCHART,
         )
 
-        df = add_row(
-            df,
+        registry.add_row(
             query_template=f"What is the {name} <F1:q> for each <F2:n>?",
             spec=(
                 Chart()
@@ -550,8 +492,7 @@ def generate():
         "E.c < 100000",
         overlap,
     ]
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Is there a correlation between <F1:q> and <F2:q>?",
         spec=(
             Chart()
@@ -561,12 +502,12 @@ def generate():
             .y(field="<F2>", type="quantitative")
         ),
         constraints=scatterplot_constraints,
+        symmetric=[["F1", "F2"]],
         query_type=QueryType.QUESTION,
         chart_type=ChartType.SCATTERPLOT,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a scatterplot of <F1:q> and <F2:q>?",
         spec=(
             Chart()
@@ -576,12 +517,12 @@ def generate():
             .y(field="<F2>", type="quantitative")
         ),
         constraints=scatterplot_constraints,
+        symmetric=[["F1", "F2"]],
         query_type=QueryType.UTTERANCE,
         chart_type=ChartType.SCATTERPLOT
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a stacked bar chart of <F1:n> and <F2:n>?",
         spec=(
             Chart()
@@ -606,8 +547,7 @@ def generate():
         chart_type=ChartType.STACKED_BAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a stacked bar chart of <F1:n> and <F2:n>?",
         spec=(
             Chart()
@@ -632,8 +572,7 @@ def generate():
         chart_type=ChartType.STACKED_BAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a pie chart of <F:n>?",
         spec=(
             Chart()
@@ -653,8 +592,7 @@ def generate():
         chart_type=ChartType.CIRCULAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a donut chart of <F:n>?",
         spec=(
             Chart()
@@ -676,8 +614,7 @@ def generate():
         chart_type=ChartType.CIRCULAR,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="How many <E> records are there?",
         spec=(
             Chart()
@@ -692,8 +629,7 @@ def generate():
     )
 
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What does the <E> data look like?",
         spec=(
             Chart()
@@ -706,8 +642,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a table of <E>?",
         spec=(
             Chart()
@@ -720,8 +655,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What does the combined data of <E1> and <E2> look like?",
         spec=(
             Chart()
@@ -742,8 +676,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a table that combines <E1> and <E2>.",
         spec=(
             Chart()
@@ -764,8 +697,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What <E2> has the most <E1>?",
         spec=(
             Chart()
@@ -797,8 +729,7 @@ def generate():
     )
 
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What Record in <E> has the largest <F:q>?",
         spec=(
             Chart()
@@ -818,8 +749,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What Record in <E2> has the largest <E1> <E1.F:q>?",
         spec=(
             Chart()
@@ -851,8 +781,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What Record in <E> has the smallest <F:q>?",
         spec=(
             Chart()
@@ -871,8 +800,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What Record in <E2> has the smallest <E1> <E1.F:q>?",
         spec=(
             Chart()
@@ -903,8 +831,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Order the <E> by <F:q>?",
         spec=(
             Chart()
@@ -923,8 +850,7 @@ def generate():
     )
 
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the range of <E> <F:q> values?",
         spec=(
             Chart()
@@ -945,8 +871,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the range of <E> <F:n> values?",
         spec=(
             Chart()
@@ -966,8 +891,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the range of <E> <F1:q> values for every <F2:n>?",
         spec=(
             Chart()
@@ -997,8 +921,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the most frequent <F:n>?",
         spec=(
             Chart()
@@ -1023,8 +946,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the cumulative distribution of <F:q>?",
         spec=(
             Chart()
@@ -1044,8 +966,7 @@ def generate():
         chart_type=ChartType.LINE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a CDF plot of <F:q>.",
         spec=(
             Chart()
@@ -1065,8 +986,7 @@ def generate():
         chart_type=ChartType.LINE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the cumulative distribution of <F1:q> for each <F2:n>?",
         spec=(
             Chart()
@@ -1091,8 +1011,7 @@ def generate():
         chart_type=ChartType.GROUPED_LINE
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a CDF plot of <F1:q> with a line for each <F2:n>.",
         spec=(
             Chart()
@@ -1117,8 +1036,7 @@ def generate():
         chart_type=ChartType.GROUPED_LINE
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"Are there any clusters with respect to <E> counts of <F1:n> and <F2:n>?",
         spec=(
             Chart()
@@ -1151,8 +1069,7 @@ def generate():
         chart_type=ChartType.HEATMAP,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template=f"Make a heatmap of <E> <F1:n> and <F2:n>.",
         spec=(
             Chart()
@@ -1189,8 +1106,7 @@ def generate():
     # Heatmap of aggregates over two nominal fields.
     for name, op in [('average', Op.mean)]:
             named_aggregate = f"{name} <F1>"
-            df = add_row(
-                df,
+            registry.add_row(
                 query_template=f"What is the {name} <F1:q> for each <F2:n> and <F3:n>?",
                 
                 spec=(
@@ -1222,8 +1138,7 @@ def generate():
 
 
     # scatterplot with color
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Are there clusters of <E> <F1:q> and <F2:q> values across different <F3:n> groups?",
         spec=(
             Chart()
@@ -1242,13 +1157,13 @@ def generate():
             "F1['name'] in F3['udi:overlapping_fields'] or F3['udi:overlapping_fields'] == 'all'",
             "F2['name'] in F3['udi:overlapping_fields'] or F3['udi:overlapping_fields'] == 'all'"
         ],
+        symmetric=[["F1", "F2"]],
         query_type=QueryType.QUESTION,
         chart_type=ChartType.GROUPED_SCATTER,
     )
 
     # Histogram
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the distribution of <F:q>?",
         spec=(
             Chart()
@@ -1272,8 +1187,7 @@ def generate():
         chart_type=ChartType.HISTOGRAM,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Make a histogram of <F:q>?",
         spec=(
             Chart()
@@ -1298,8 +1212,7 @@ def generate():
     )
 
     # KDE
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the distribution of <F:q>?",
         spec=(
             Chart()
@@ -1323,8 +1236,7 @@ def generate():
     )
 
     # Dot plot
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What is the distribution of <F:q>?",
         spec=(
             Chart()
@@ -1341,8 +1253,7 @@ def generate():
     )
 
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Is the distribution of <F1:q> similar for each <F2:n>?",
         spec=(
             Chart()
@@ -1374,8 +1285,7 @@ def generate():
         chart_type=ChartType.GROUPED_AREA,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Is the distribution of <F1:q> similar for each <F2:n>?",
         spec=(
             Chart()
@@ -1395,8 +1305,7 @@ def generate():
         chart_type=ChartType.GROUPED_DOT,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="How many <E> records have a non-null <F:q|o|n>?",
         spec=(
             Chart()
@@ -1422,8 +1331,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What percentage of <E> records have a non-null <F:q|o|n>?",
         spec=(
             Chart()
@@ -1449,8 +1357,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="How many <E> records have a null <F:q|o|n>?",
         spec=(
             Chart()
@@ -1479,8 +1386,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="What percentage of <E> records have a null <F:q|o|n>?",
         spec=(
             Chart()
@@ -1509,7 +1415,7 @@ def generate():
         chart_type=ChartType.TABLE,
     )
 
-    return df
+    return registry.to_dataframe()
 
 
 if __name__ == "__main__":
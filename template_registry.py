@@ -0,0 +1,77 @@
+import json
+import pandas as pd
+
+TEMPLATE_COLUMNS = [
+    "query_template",
+    "constraints",
+    "spec_template",
+    "query_type",
+    "creation_method",
+    "chart_type",
+    "chart_complexity",
+    "spec_key_count",
+    "symmetric",
+]
+
+
+class TemplateRegistry:
+    """
+    Collects template records and builds the template DataFrame once at the end.
+
+    Appending to a DataFrame row by row reallocates it for every template, so the
+    records are kept as plain tuples until to_dataframe() is called.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def add_row(self, query_template, spec, constraints, query_type, chart_type, symmetric=None):
+        """
+        symmetric lists groups of interchangeable tags, e.g. [["F1", "F2"]] when the
+        constraints are the same with F1 and F2 swapped and the spec doesn't depend on
+        their order. Only one order of each solution is expanded.
+        """
+        # Chart specs are serialized once, the key count is taken from the parsed json.
+        if hasattr(spec, "to_json"):
+            spec_template = spec.to_json()
+            spec_key_count = get_total_key_count(json.loads(spec_template))
+        else:
+            spec_template = json.dumps(spec)
+            spec_key_count = get_total_key_count(spec)
+        self.records.append((
+            query_template,
+            constraints,
+            spec_template,
+            query_type.value,
+            "template",
+            chart_type.value,
+            get_complexity(spec_key_count),
+            spec_key_count,
+            [list(group) for group in symmetric or []],
+        ))
+        return self
+
+    def __len__(self):
+        return len(self.records)
+
+    def to_dataframe(self):
+        return pd.DataFrame.from_records(self.records, columns=TEMPLATE_COLUMNS)
+
+
+def get_complexity(spec_key_count):
+    if spec_key_count <= 12:
+        return "simple"
+    elif spec_key_count <= 24:
+        return "medium"
+    elif spec_key_count <= 36:
+        return "complex"
+    return "extra complex"
+
+
+def get_total_key_count(nested_dict):
+    if isinstance(nested_dict, dict):
+        return sum(get_total_key_count(value) for value in nested_dict.values())
+    elif isinstance(nested_dict, list):
+        return sum(get_total_key_count(item) for item in nested_dict)
+    else:
+        return 1
@@ -0,0 +1,157 @@
+import re
+from constraint_compiler import SAMPLE_PATTERN
+
+'''
+Resolves query and spec templates against solutions.
+
+Each template is compiled once into a list of segments, literal strings and slots:
+    ["entity", variable]                 entity (resource name) of a sample
+    ["url", variable]                    url of a sample
+    ["name", variable]                   name of a field or location
+    ["join", sample, related, direction, quoted]
+                                         key fields of the foreign key from sample to related,
+                                         direction is "from" (sample fields) or "to" (related fields)
+    ["invalid", message]                 raises when resolved, like the tag it replaces
+Resolving a solution is then a single join over the segments.
+
+Spec templates write comparisons as {lte}, {gte}, {lt} and {gt} since < and > mark
+tags, they are rewritten in the literal segments when compiling.
+'''
+
+TAG_PATTERN = r"<([^>]+)>"
+# samples (entities) may be written as <E> or <S> in templates
+DEFAULT_SAMPLE = "E"
+
+# order matters, {lte} has to be rewritten before {lt}
+COMPARISONS = [
+    ("{lte}", "<="),
+    ("{gte}", ">="),
+    ("{lt}", "<"),
+    ("{gt}", ">"),
+]
+
+
+def compile_query_segments(query_template, tags):
+    """
+    Every tag replaces its first remaining occurrence in the query template, in tag order.
+    """
+    marked = query_template
+    for i, tag in enumerate(tags):
+        # \0 does not appear in templates
+        marked = marked.replace(f"<{tag['original']}>", f"\0{i}\0", 1)
+    segments = []
+    for i, part in enumerate(marked.split("\0")):
+        if i % 2 == 0:
+            if part:
+                segments.append(part)
+            continue
+        tag = tags[int(part)]
+        if tag["field"] or tag["location"]:
+            segments.append(["name", tag["sample"] + "_" + (tag["field"] or tag["location"])])
+        else:
+            segments.append(["entity", tag["sample"]])
+    return segments
+
+
+def compile_spec_segments(spec_template, tags):
+    default_sample = next((tag["sample"] for tag in tags if tag["sample"]), DEFAULT_SAMPLE)
+    segments = []
+    position = 0
+    for match in re.finditer(TAG_PATTERN, spec_template):
+        literal = spec_template[position:match.start()]
+        position = match.end()
+        slot = compile_spec_slot(match.group(0), default_sample)
+        if slot[0] == "join":
+            # a join over several fields is written as a list in place of the quoted tag
+            quoted = literal.endswith('"') and spec_template[position:position + 1] == '"'
+            if quoted:
+                literal = literal[:-1]
+                position += 1
+            slot.append(quoted)
+        append_literal(segments, literal)
+        segments.append(slot)
+    append_literal(segments, spec_template[position:])
+    return segments
+
+
+def compile_spec_slot(match, default_sample):
+    parts = match.strip("<>").split(".")
+    if len(parts) == 1:
+        if SAMPLE_PATTERN.fullmatch(parts[0]):
+            return ["entity", parts[0]]
+        return ["name", default_sample + "_" + parts[0]]
+    if len(parts) == 2:
+        left, right = parts
+        if right == "url":
+            # <F.url> is the url of the resource of the field
+            return ["url", left if SAMPLE_PATTERN.fullmatch(left) else default_sample + "_" + left]
+        return ["name", left + "_" + right]
+    if len(parts) == 5:
+        S1, r, S2, id, source = parts
+        if not SAMPLE_PATTERN.fullmatch(S1) or not SAMPLE_PATTERN.fullmatch(S2) or r != "r" or id != "id" or source not in ["from", "to"]:
+            return ["invalid", f"Invalid match: {match}. Unexpected formatting of spec template tag."]
+        return ["join", S1, S2, source]
+    return ["invalid", f"Invalid match: {match}. Unexpected formatting length of spec template tag."]
+
+
+def append_literal(segments, literal):
+    for content, resolved in COMPARISONS:
+        literal = literal.replace(content, resolved)
+    if literal:
+        segments.append(literal)
+
+
+def resolve_segments(segments, solution, foreign_key_index=None):
+    return "".join(
+        segment if isinstance(segment, str) else resolve_slot(segment, solution, foreign_key_index)
+        for segment in segments
+    )
+
+
+def resolve_batch(segments, solutions, foreign_key_index=None):
+    """
+    Resolves the segments of a template for many solutions.
+    """
+    if all(isinstance(segment, str) for segment in segments):
+        text = "".join(segments)
+        return [text] * len(solutions)
+    return [resolve_segments(segments, solution, foreign_key_index) for solution in solutions]
+
+
+def resolve_slot(slot, solution, foreign_key_index):
+    kind = slot[0]
+    if kind == "entity":
+        return solution[slot[1]]["entity"]
+    if kind == "name":
+        return solution[slot[1]]["name"]
+    if kind == "url":
+        return solution[slot[1]]["url"]
+    if kind == "join":
+        return resolve_join(slot, solution, foreign_key_index)
+    raise ValueError(slot[1])
+
+
+def resolve_join(slot, solution, foreign_key_index):
+    _, S1, S2, source, quoted = slot
+    S2_name = solution[S2]["entity"]
+    # the first foreign key of S1 that references S2, from returns its fields else the referenced fields
+    if foreign_key_index is not None:
+        matchedKey = foreign_key_index.join(solution[S1]["entity"], S2_name)
+    else:
+        matchedKey = next(
+            (
+                {"fields": fk["fields"], "reference_fields": fk["reference"]["fields"]}
+                for fk in solution[S1]["foreignKeys"]
+                if fk["reference"]["resource"] == S2_name
+            ),
+            None,
+        )
+    tag = f"<{S1}.r.{S2}.id.{source}>"
+    if matchedKey is None:
+        raise ValueError(f"Invalid match: {tag}. Could not find foreign key for {S1} to {S2}")
+    resolved = matchedKey["fields"] if source == "from" else matchedKey["reference_fields"]
+    if len(resolved) == 1:
+        return f'"{resolved[0]}"' if quoted else resolved[0]
+    if not quoted:
+        raise ValueError(f"Invalid match: {tag}. A foreign key over several fields has to be quoted.")
+    return f"[\"{'","'.join(resolved)}\"]"
@@ -0,0 +1,148 @@
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import template_expansion
+from template_registry import TEMPLATE_COLUMNS
+
+'''
+Persists the generated and compiled templates so that main.py does not have to
+import udi_grammar_py and rebuild every Chart on each run.
+
+The snapshot is an uncompressed Arrow IPC file that is memory mapped on load. It is
+keyed by a content hash of the template modules and the installed version of
+udi_grammar_py (it builds the specs), if they have not changed the templates are
+read straight from the snapshot. Otherwise the templates are
+regenerated and only the templates whose content (or the compiler) changed are
+compiled again.
+'''
+
+SNAPSHOT_PATH = "./out/cache/compiled_templates.arrow"
+
+# modules that define the templates, a change to any of them requires template_generation.generate()
+TEMPLATE_MODULES = ["template_generation", "template_registry"]
+
+# installed packages that build the template specs, a new version requires template_generation.generate()
+TEMPLATE_PACKAGES = ["udi_grammar_py"]
+
+# modules that compile the templates, a change invalidates the compiled columns
+COMPILER_MODULES = ["template_expansion", "constraint_compiler", "template_resolver"]
+
+# compiled columns that hold nested structures, stored as json strings
+JSON_COLUMNS = ["constraints", "symmetric", "tags", "samples", "fields", "locations", "expanded_constraints", "query_segments", "spec_segments"]
+
+
+def load_templates(snapshot_path=SNAPSHOT_PATH):
+    """
+    Returns the compiled template DataFrame, rebuilding the snapshot when the
+    template modules changed.
+    """
+    template_hash = get_template_hash()
+    compiler_hash = hash_modules(COMPILER_MODULES)
+    snapshot, metadata = read_snapshot(snapshot_path)
+    if (
+        snapshot is not None
+        and metadata.get("template_hash") == template_hash
+        and metadata.get("compiler_hash") == compiler_hash
+    ):
+        print(f"Loaded {len(snapshot):,} compiled templates from {snapshot_path}")
+        return snapshot
+
+    # imported lazily, this pulls in udi_grammar_py and builds every chart
+    import template_generation
+    df = template_generation.generate()
+    df["template_key"] = [get_template_key(row, compiler_hash) for _, row in df.iterrows()]
+
+    previous = {}
+    if snapshot is not None:
+        previous = {row["template_key"]: row for _, row in snapshot.iterrows()}
+
+    compiled_rows = []
+    recompiled = 0
+    for _, row in df.iterrows():
+        if row["template_key"] in previous:
+            compiled = {c: previous[row["template_key"]][c] for c in template_expansion.COMPILED_COLUMNS}
+        else:
+            compiled = template_expansion.compile_template(row)
+            recompiled += 1
+        compiled_rows.append(compiled)
+    compiled_df = pd.DataFrame(compiled_rows, columns=template_expansion.COMPILED_COLUMNS)
+    df = pd.concat([df.reset_index(drop=True), compiled_df], axis=1)
+
+    write_snapshot(df, snapshot_path, {"template_hash": template_hash, "compiler_hash": compiler_hash})
+    print(f"Compiled {recompiled:,} of {len(df):,} templates, snapshot saved to {snapshot_path}")
+    return df
+
+
+def hash_modules(module_names):
+    """
+    Content hash of the source of the given modules, they are located without importing them.
+    """
+    digest = hashlib.sha256()
+    for module_name in module_names:
+        spec = importlib.util.find_spec(module_name)
+        with open(spec.origin, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def get_template_hash():
+    """
+    Hash of the template modules and of the versions of the template packages.
+    """
+    versions = [[package, package_version(package)] for package in TEMPLATE_PACKAGES]
+    content = json.dumps([hash_modules(TEMPLATE_MODULES), versions])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def package_version(package):
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def get_template_key(row, compiler_hash):
+    content = json.dumps(
+        [compiler_hash, row["query_template"], list(row["constraints"]), row["spec_template"], row["symmetric"]]
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def read_snapshot(snapshot_path):
+    if not os.path.exists(snapshot_path):
+        return None, {}
+    try:
+        with pa.memory_map(snapshot_path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+    except (pa.ArrowInvalid, OSError) as e:
+        print(f"Failed to read template snapshot, rebuilding: {e}")
+        return None, {}
+    metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+    if any(column not in table.column_names for column in JSON_COLUMNS):
+        # written by an older version with other compiled columns
+        return None, {}
+    df = table.to_pandas()
+    for column in JSON_COLUMNS:
+        df[column] = df[column].map(json.loads)
+    return df, metadata
+
+
+def write_snapshot(df, snapshot_path, metadata):
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    df = df[TEMPLATE_COLUMNS + ["template_key"] + template_expansion.COMPILED_COLUMNS].copy()
+    for column in JSON_COLUMNS:
+        df[column] = df[column].map(json.dumps)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(metadata)
+    with pa.OSFile(snapshot_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+if __name__ == "__main__":
+    df = load_templates()
+    print(df[["query_template", "expanded_constraints"]].head())
@@ -0,0 +1,413 @@
+import math
+import random
+import time
+from collections import namedtuple
+from constraint_compiler import compile_function
+
+'''
+A backtracking solver specialised for the constraints compiled by constraint_compiler.
+Compared to the generic python-constraint search it
+
+- applies unary constraints (data type, cardinality bounds) to the domains before search
+- binds field variables to their sample, sample variables are assigned first and
+  each bound field only considers the fields of the chosen entity
+- uses forward checking with most-constrained-variable ordering
+- treats the unique field / sample constraints as a native all-different
+- checks field overlap constraints with the bitsets of schema_domain.OverlapIndex
+- looks relationships up in schema_domain.ForeignKeyIndex
+
+The solution set is the same as python-constraint's getSolutions().
+sample_solutions draws a random sample of the solutions without enumerating all of them.
+With a BudgetClock the search stops when the template x schema budget runs out and
+returns the solutions found so far, searched in random value order so they spread
+over the search space instead of all sharing the first sample.
+'''
+
+# A constraint over `variables` evaluated as func(*values)
+Constraint = namedtuple("Constraint", ["variables", "func", "source"])
+
+
+class BacktrackingSolver:
+    """
+    Enumerates all assignments of the template variables that satisfy the constraints.
+    The solver holds the search state of a single template x schema pair.
+    """
+
+    def __init__(self, samples, fields, locations, constraints, sample_options, field_options, location_options, overlap_index=None, foreign_key_index=None, clock=None):
+        # candidate values tested against a constraint, reported by expansion_profile
+        self.checks = 0
+        self.clock = clock
+        self.overlap_index = overlap_index
+        self.foreign_key_index = foreign_key_index
+        self.samples = list(samples)
+        self.variables = self.samples + list(fields) + list(locations)
+        variable_set = set(self.variables)
+        self.domains = {}
+        for variable in samples:
+            self.domains[variable] = list(sample_options)
+        for variable in fields:
+            self.domains[variable] = list(field_options)
+        for variable in locations:
+            self.domains[variable] = list(location_options)
+
+        # field -> sample it is bound to
+        self.bindings = {}
+        # variable -> [(attribute, other variable)] that must differ in that attribute
+        self.different = {variable: [] for variable in self.variables}
+        # variable -> generic constraints that reference it
+        self.constraints = {variable: [] for variable in self.variables}
+        # variable -> [(field, other)] overlap constraints that reference it
+        self.overlaps = {variable: [] for variable in self.variables}
+
+        for constraint in constraints:
+            self.add_constraint(constraint, variable_set)
+
+        # random.Random that shuffles the values of each variable, see sample_solutions
+        self.rng = clock.rng if clock is not None else None
+
+    def add_constraint(self, compiled, variable_set):
+        kind = compiled["kind"]
+        variables = tuple(compiled["variables"])
+        if any(variable not in variable_set for variable in variables):
+            raise ValueError(f"Constraint references an unknown variable: {compiled['source']}")
+
+        if kind == "bind" and variables[1] in self.samples:
+            self.bindings[variables[0]] = variables[1]
+            return
+
+        if kind == "overlap" and self.overlap_index is not None:
+            field, other = variables
+            self.overlaps[field].append((field, other))
+            self.overlaps[other].append((field, other))
+            return
+
+        if kind == "different":
+            for i, first in enumerate(variables):
+                for second in variables[i + 1:]:
+                    self.add_different(compiled["attribute"], first, second)
+            return
+
+        constraint = Constraint(variables, compile_function(compiled["source"], variables, self.foreign_key_index), compiled["source"])
+        if len(variables) == 0:
+            # constant constraints either remove everything or nothing
+            if not constraint.func():
+                for variable in self.variables:
+                    self.domains[variable] = []
+        elif len(variables) == 1:
+            # unary constraints filter the domain before search
+            variable = variables[0]
+            self.checks += len(self.domains[variable])
+            self.domains[variable] = [x for x in self.domains[variable] if constraint.func(x)]
+        else:
+            for variable in variables:
+                self.constraints[variable].append(constraint)
+
+    def add_different(self, attribute, first, second):
+        if (attribute, second) not in self.different[first]:
+            self.different[first].append((attribute, second))
+            self.different[second].append((attribute, first))
+
+    def get_solutions(self):
+        return list(self.iter_solutions())
+
+    def iter_solutions(self):
+        if any(len(domain) == 0 for domain in self.domains.values()):
+            return
+        self.prepare_search()
+        yield from self.search({}, dict(self.domains))
+
+    def sample_solutions(self, size, rng):
+        """
+        Uniform sample of size solutions by reservoir sampling in random value order.
+        Subtrees without a solution the reservoir takes are counted and skipped, so
+        only the sampled solutions (and about size * log(solutions / size) replaced
+        ones) are built.
+        """
+        if size <= 0 or any(len(domain) == 0 for domain in self.domains.values()):
+            return []
+        self.prepare_search()
+        self.rng = rng
+        reservoir = Reservoir(size, rng)
+        try:
+            self.sample_search({}, dict(self.domains), reservoir)
+        finally:
+            self.rng = self.clock.rng if self.clock is not None else None
+        return reservoir.items
+
+    def count_solutions(self):
+        """
+        Number of solutions, without building them.
+        """
+        if any(len(domain) == 0 for domain in self.domains.values()):
+            return 0
+        self.prepare_search()
+        return self.count({}, dict(self.domains))
+
+    def prepare_search(self):
+        # group the bound field domains by entity once so binding is a lookup
+        self.domains_by_entity = {}
+        for field, sample in self.bindings.items():
+            by_entity = {}
+            for option in self.domains[field]:
+                by_entity.setdefault(option["entity"], []).append(option)
+            self.domains_by_entity[field] = by_entity
+
+    def select_variable(self, assignment, domains):
+        # samples are bound first, then the most constrained variable
+        unassigned = [x for x in self.variables if x not in assignment]
+        unassigned_samples = [x for x in unassigned if x in self.samples]
+        candidates = unassigned_samples or unassigned
+        return min(candidates, key=lambda x: len(domains[x]))
+
+    def search(self, assignment, domains):
+        if self.clock is not None and self.clock.tick():
+            return
+        if len(assignment) == len(self.variables):
+            yield dict(assignment)
+            return
+        variable = self.select_variable(assignment, domains)
+        values = domains[variable]
+        if self.rng is not None:
+            values = self.rng.sample(values, len(values))
+        for value in values:
+            assignment[variable] = value
+            pruned = self.forward_check(variable, value, assignment, domains)
+            if pruned is not None:
+                yield from self.search(assignment, pruned)
+            del assignment[variable]
+
+    def count(self, assignment, domains):
+        if len(assignment) == len(self.variables):
+            return 1
+        variable = self.select_variable(assignment, domains)
+        if len(assignment) == len(self.variables) - 1:
+            # forward checking left only the values consistent with every assigned variable
+            return len(domains[variable])
+        total = 0
+        for value in domains[variable]:
+            assignment[variable] = value
+            pruned = self.forward_check(variable, value, assignment, domains)
+            if pruned is not None:
+                total += self.count(assignment, pruned)
+            del assignment[variable]
+        return total
+
+    def sample_search(self, assignment, domains, reservoir):
+        if len(assignment) == len(self.variables):
+            if reservoir.wants(1):
+                reservoir.offer(dict(assignment))
+            else:
+                reservoir.skip(1)
+            return
+        variable = self.select_variable(assignment, domains)
+        values = self.rng.sample(domains[variable], len(domains[variable]))
+        if len(assignment) == len(self.variables) - 1:
+            # every remaining value is a solution (see count), only the taken ones are built
+            start = reservoir.seen
+            while reservoir.wants(start + len(values) - reservoir.seen):
+                reservoir.skip(reservoir.next - reservoir.seen)
+                assignment[variable] = values[reservoir.seen - start]
+                reservoir.offer(dict(assignment))
+            reservoir.skip(start + len(values) - reservoir.seen)
+            del assignment[variable]
+            return
+        for value in values:
+            assignment[variable] = value
+            pruned = self.forward_check(variable, value, assignment, domains)
+            if pruned is not None:
+                solutions = self.count(assignment, pruned)
+                if reservoir.wants(solutions):
+                    self.sample_search(assignment, pruned, reservoir)
+                else:
+                    reservoir.skip(solutions)
+            del assignment[variable]
+
+    def forward_check(self, variable, value, assignment, domains):
+        """
+        Returns the domains of the unassigned variables that remain consistent with the
+        new assignment, or None if one of them becomes empty.
+        """
+        pruned = dict(domains)
+
+        if variable in self.samples:
+            entity = value["entity"]
+            for field, sample in self.bindings.items():
+                if sample != variable or field in assignment:
+                    continue
+                if pruned[field] is self.domains[field]:
+                    pruned[field] = self.domains_by_entity[field].get(entity, [])
+                else:
+                    pruned[field] = [x for x in pruned[field] if x["entity"] == entity]
+                if not pruned[field]:
+                    return None
+
+        for attribute, other in self.different[variable]:
+            if other in assignment:
+                continue
+            self.checks += len(pruned[other])
+            pruned[other] = [x for x in pruned[other] if x[attribute] != value[attribute]]
+            if not pruned[other]:
+                return None
+
+        for field, other in self.overlaps[variable]:
+            if field in assignment and other in assignment:
+                # checked when the first of the two was assigned
+                continue
+            if variable == other:
+                # the fields overlapping with other in one AND per candidate
+                self.checks += len(pruned[field])
+                pruned[field] = self.overlap_index.partners(value, pruned[field])
+                if not pruned[field]:
+                    return None
+            else:
+                self.checks += len(pruned[other])
+                pruned[other] = [x for x in pruned[other] if self.overlap_index.overlaps(value, x)]
+                if not pruned[other]:
+                    return None
+
+        for constraint in self.constraints[variable]:
+            unassigned = [x for x in constraint.variables if x not in assignment]
+            if len(unassigned) != 1:
+                continue
+            other = unassigned[0]
+            position = constraint.variables.index(other)
+            args = [assignment.get(x) for x in constraint.variables]
+            self.checks += len(pruned[other])
+            remaining = []
+            for option in pruned[other]:
+                args[position] = option
+                if constraint.func(*args):
+                    remaining.append(option)
+            if not remaining:
+                return None
+            pruned[other] = remaining
+        return pruned
+
+
+
+class Reservoir:
+    """
+    Reservoir sample of a stream of solutions (Algorithm L), the positions of the
+    solutions it takes are drawn ahead so the ones in between can be skipped.
+    """
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.items = []
+        # solutions passed so far, and the position of the next one to take
+        self.seen = 0
+        self.next = 0
+        self.weight = 1.0
+
+    def wants(self, count):
+        """
+        True if the next count solutions contain one to take.
+        """
+        return self.next < self.seen + count
+
+    def skip(self, count):
+        self.seen += count
+
+    def offer(self, solution):
+        if len(self.items) < self.size:
+            self.items.append(solution)
+        else:
+            self.items[self.rng.randrange(self.size)] = solution
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.next = self.seen
+            return
+        self.weight *= math.exp(math.log(self.random()) / self.size)
+        self.next += int(math.log(self.random()) / math.log(1 - self.weight)) + 1
+
+    def random(self):
+        # random() can return 0.0, log needs (0, 1)
+        return 1.0 - self.rng.random()
+
+
+class SolveBudget:
+    """
+    Limit on solving a template x schema pair, in seconds of wall time and/or search
+    steps (nodes of the backtracking search, joined rows of the numpy engine).
+    The pairs that ran out are collected in truncated. Pairs reused from the
+    expansion cache are complete solves that skipped the budget, they are collected
+    in cached.
+    """
+
+    def __init__(self, seconds=None, steps=None, seed=0):
+        self.seconds = seconds
+        self.steps = steps
+        self.seed = seed
+        self.truncated = []
+        self.cached = []
+
+    def clock(self, key):
+        # the random value order is seeded per pair
+        return BudgetClock(self.seconds, self.steps, random.Random(f"{self.seed}:{key}"))
+
+    def record(self, label, row, domain_name):
+        self.truncated.append(budget_pair(label, row, domain_name))
+
+    def record_cached(self, label, row, domain_name):
+        self.cached.append(budget_pair(label, row, domain_name))
+
+    def to_dict(self):
+        return {
+            "seconds": self.seconds,
+            "steps": self.steps,
+            "seed": self.seed,
+            "truncated": self.truncated,
+            "cached": self.cached,
+        }
+
+
+def budget_pair(label, row, domain_name):
+    return {
+        "template": label,
+        "query_template": row["query_template"],
+        "dataset_schema": domain_name,
+    }
+
+
+class BudgetClock:
+    """
+    The budget of a single solve, exhausted is set once it ran out.
+    """
+
+    # steps between two reads of the clock
+    TIME_CHECK_INTERVAL = 64
+
+    def __init__(self, seconds, steps, rng):
+        self.seconds = seconds
+        self.max_steps = steps
+        self.rng = rng
+        # kept so a restart draws the same random value order again
+        self.rng_state = rng.getstate()
+        self.restart()
+
+    def restart(self):
+        """
+        Starts the budget over, e.g. for another engine solving the same pair.
+        """
+        self.deadline = time.monotonic() + self.seconds if self.seconds is not None else None
+        self.rng.setstate(self.rng_state)
+        self.steps = 0
+        self.exhausted = False
+
+    def tick(self, steps=1):
+        """
+        Counts steps, returns True if the budget ran out.
+        """
+        if self.exhausted:
+            return True
+        previous, self.steps = self.steps, self.steps + steps
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.exhausted = True
+        elif (
+            self.deadline is not None
+            and self.steps // self.TIME_CHECK_INTERVAL != previous // self.TIME_CHECK_INTERVAL
+            and time.monotonic() > self.deadline
+        ):
+            self.exhausted = True
+        return self.exhausted
@@ -0,0 +1,71 @@
+import copy
+import json
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules of the repository are flat, they are imported from its root
+sys.path.insert(0, ROOT)
+
+import template_snapshot
+
+'''
+Shared fixtures: the generated templates and a small catalogue, a few resources and
+fields of the hubmap package and of three C2M2 packages. The C2M2 packages are
+trimmed the same way, so they share a structure (see SchemaDomain.structure_key).
+'''
+
+CATALOGUE_PATH = os.path.join(ROOT, "datasets", "output_catalogue.json")
+
+C2M2_RESOURCES = {"biosample", "subject", "biosample_from_subject", "project", "dcc"}
+
+
+def trim_schema(schema, resources, max_fields):
+    """
+    Copy of a dataset schema with only the given resources and their first max_fields
+    fields (plus the key fields), foreign keys to dropped resources are removed.
+    """
+    schema = copy.deepcopy(schema)
+    schema["resources"] = [r for r in schema["resources"] if r["name"] in resources]
+    for resource in schema["resources"]:
+        resource_schema = resource["schema"]
+        foreign_keys = [
+            fk for fk in resource_schema.get("foreignKeys", [])
+            if fk["reference"]["resource"] in resources
+        ]
+        keep = set(resource_schema.get("primaryKey") or [])
+        for fk in foreign_keys:
+            keep |= set(fk["fields"] if isinstance(fk["fields"], list) else [fk["fields"]])
+        resource_schema["fields"] = [
+            field for i, field in enumerate(resource_schema["fields"])
+            if i < max_fields or field["name"] in keep
+        ]
+        resource_schema["foreignKeys"] = foreign_keys
+    return schema
+
+
+@pytest.fixture(scope="session")
+def catalogue():
+    with open(CATALOGUE_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="session")
+def small_catalogue(catalogue):
+    by_name = {schema["udi:name"]: schema for schema in catalogue}
+    return [
+        trim_schema(by_name["hubmap_2025-05-05"], {"datasets", "donors", "samples"}, 10),
+        trim_schema(by_name["SenNet"], C2M2_RESOURCES, 8),
+        trim_schema(by_name["MetabolomicsWorkbench"], C2M2_RESOURCES, 8),
+        trim_schema(by_name["MoTrPAC"], C2M2_RESOURCES, 8),
+    ]
+
+
+@pytest.fixture(scope="session")
+def templates(tmp_path_factory):
+    """
+    The compiled templates, the snapshot is written to a temporary directory.
+    """
+    snapshot_path = tmp_path_factory.mktemp("snapshot") / "templates.arrow"
+    return template_snapshot.load_templates(str(snapshot_path))
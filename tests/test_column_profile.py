@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from column_profile import DistinctCounter, HyperLogLog, TableProfile, hash_values
+
+
+def test_distinct_count_is_exact_below_the_threshold():
+    rng = np.random.default_rng(0)
+    values = pd.Series(rng.integers(0, 5_000, 20_000))
+    counter = DistinctCounter(threshold=10_000)
+    for start in range(0, len(values), 3_000):
+        counter.add(hash_values(values[start:start + 3_000]))
+    assert counter.exact
+    assert counter.count() == values.nunique()
+    assert not counter.unique
+
+
+def test_distinct_count_is_estimated_above_the_threshold():
+    values = pd.Series(np.arange(50_000) % 40_000)
+    counter = DistinctCounter(threshold=1_000)
+    counter.add(hash_values(values))
+    assert not counter.exact
+    assert abs(counter.count() - 40_000) < 0.05 * 40_000
+
+
+def test_unique_columns_stay_exact_above_the_threshold():
+    counter = DistinctCounter(threshold=100)
+    for start in range(0, 1_000, 250):
+        counter.add(hash_values(pd.Series(range(start, start + 250))))
+    assert counter.exact and counter.unique
+    assert counter.count() == 1_000
+
+
+def test_nulls_are_not_unique():
+    counter = DistinctCounter()
+    counter.add(hash_values(pd.Series(["a", "b"])), nulls=1)
+    assert counter.count() == 2
+    assert not counter.unique
+
+
+def test_hyperloglog_small_range():
+    sketch = HyperLogLog()
+    sketch.add(hash_values(pd.Series(range(100))))
+    assert abs(sketch.count() - 100) <= 2
+
+
+def test_table_profile_in_chunks():
+    df = pd.DataFrame({
+        "id": range(6),
+        "name": ["a", "b", "a", None, "c", "b"],
+        "size": [1.0, None, None, None, 2.0, None],
+        "note": [None, None, None, "x", None, None],
+        "empty": [None] * 6,
+        "group": [1, 1, 2, 2, 3, 3],
+    })
+    profile = TableProfile(counted=["id", "name", "size"], keys=[("id",), ("name", "group"), ("group",)])
+    for start in range(0, len(df), 4):
+        profile.add(df[start:start + 4])
+    assert profile.rows == 6
+    assert profile.cardinality("name") == 3
+    assert profile.unique("id") and not profile.unique("name")
+    assert profile.unique_key(["id"]) and not profile.unique_key(["group"])
+    assert profile.overlapping("id") == "all"
+    assert profile.overlapping("size") == ["id", "name", "size", "group"]
+    assert profile.overlapping("note") == ["id", "note", "group"]
+    assert profile.overlapping("empty") == []
@@ -0,0 +1,67 @@
+import pytest
+import template_expansion
+from template_solver import SolveBudget
+
+# small enough to truncate some of the solves of the small catalogue
+STEP_BUDGET = 20
+
+
+def expanded_rows(df):
+    return list(zip(df.index, df.to_dict("records")))
+
+
+@pytest.fixture(scope="module")
+def serial_rows(templates, small_catalogue):
+    return expanded_rows(template_expansion.expand(templates, small_catalogue))
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_parallel_expansion_matches_serial(templates, small_catalogue, serial_rows, executor):
+    expanded = template_expansion.expand(templates, small_catalogue, jobs=2, executor=executor)
+    assert expanded_rows(expanded) == serial_rows
+
+
+def test_expand_iter_matches_expand(templates, small_catalogue, serial_rows):
+    batches = list(template_expansion.expand_iter(templates, small_catalogue, batch_size=100))
+    assert all(len(batch) <= 100 for batch in batches)
+    assert [row for batch in batches for row in batch] == [row for _, row in serial_rows]
+
+
+def test_unknown_executor(templates, small_catalogue):
+    with pytest.raises(ValueError):
+        template_expansion.expand(templates, small_catalogue, jobs=2, executor="gpu")
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_parallel_expansion_matches_serial_under_a_step_budget(templates, small_catalogue, executor):
+    serial_budget = SolveBudget(steps=STEP_BUDGET)
+    serial = template_expansion.expand(templates, small_catalogue, budget=serial_budget)
+    # the shared structure of the C2M2 schemas is solved under the budget too
+    assert {pair["dataset_schema"] for pair in serial_budget.truncated} >= {"SenNet", "MoTrPAC"}
+    budget = SolveBudget(steps=STEP_BUDGET)
+    expanded = template_expansion.expand(templates, small_catalogue, jobs=3, budget=budget, executor=executor)
+    assert expanded_rows(expanded) == expanded_rows(serial)
+    assert budget.truncated == serial_budget.truncated
+
+
+def test_budget_keeps_the_solutions_found_so_far(templates, small_catalogue, serial_rows):
+    budget = SolveBudget(steps=STEP_BUDGET)
+    truncated_rows = expanded_rows(template_expansion.expand(templates, small_catalogue, budget=budget))
+    truncated = {(pair["template"], pair["dataset_schema"]) for pair in budget.truncated}
+    assert truncated
+
+    def by_pair(rows):
+        pairs = {}
+        for label, row in rows:
+            pairs.setdefault((label, row["dataset_schema"]), []).append(row)
+        return pairs
+
+    full = by_pair(serial_rows)
+    kept = by_pair(truncated_rows)
+    for pair, rows in kept.items():
+        if pair in truncated:
+            # a solve can run out after finding all the solutions
+            assert all(row in full[pair] for row in rows)
+        else:
+            assert rows == full[pair]
+    assert sum(len(rows) for rows in kept.values()) < len(serial_rows)
@@ -0,0 +1,72 @@
+import pytest
+import expansion_cache
+import template_expansion
+from expansion_cache import ExpansionCache
+from template_solver import SolveBudget
+
+# small enough to truncate some of the solves of the small catalogue
+STEP_BUDGET = 20
+
+
+def test_cached_rows_match_a_fresh_run(templates, small_catalogue, tmp_path):
+    path = str(tmp_path / "expansion_cache.arrow")
+    fresh = template_expansion.expand(templates, small_catalogue, cache=ExpansionCache(path))
+    cache = ExpansionCache(path)
+    assert cache.table is not None
+    cached = template_expansion.expand(templates, small_catalogue, cache=cache)
+    assert cached.to_dict("records") == fresh.to_dict("records")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_reuse_is_counted_in_the_main_process(templates, small_catalogue, tmp_path, capsys, jobs):
+    path = str(tmp_path / "expansion_cache.arrow")
+    template_expansion.expand(templates, small_catalogue, cache=ExpansionCache(path))
+    pairs = len(ExpansionCache(path).rows)
+    assert pairs > 0
+    capsys.readouterr()
+    template_expansion.expand(templates, small_catalogue, jobs=jobs, cache=ExpansionCache(path))
+    assert f"Reused {pairs:,} of {pairs:,} template family x schema solutions" in capsys.readouterr().out
+
+
+def test_solver_modules_cover_the_expansion():
+    assert "template_expansion" in expansion_cache.SOLVER_MODULES
+
+
+def test_cache_is_dropped_when_a_solver_module_changes(templates, small_catalogue, tmp_path, monkeypatch):
+    module_dir = tmp_path / "modules"
+    module_dir.mkdir()
+    module_path = module_dir / "changed_solver.py"
+    module_path.write_text("STEPS = 1\n")
+    monkeypatch.syspath_prepend(str(module_dir))
+    monkeypatch.setattr(expansion_cache, "SOLVER_MODULES", expansion_cache.SOLVER_MODULES + ["changed_solver"])
+    path = str(tmp_path / "expansion_cache.arrow")
+    template_expansion.expand(templates, small_catalogue, cache=ExpansionCache(path))
+    assert ExpansionCache(path).table is not None
+
+    module_path.write_text("STEPS = 2\n")
+    assert ExpansionCache(path).table is None
+
+
+def test_cache_is_not_read_without_reuse(templates, small_catalogue, tmp_path):
+    path = str(tmp_path / "expansion_cache.arrow")
+    template_expansion.expand(templates, small_catalogue, cache=ExpansionCache(path))
+    assert ExpansionCache(path, reuse=False).table is None
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_budgeted_run_records_the_pairs_reused_from_the_cache(templates, small_catalogue, tmp_path, jobs):
+    path = str(tmp_path / "expansion_cache.arrow")
+    cold_budget = SolveBudget(steps=STEP_BUDGET)
+    template_expansion.expand(templates, small_catalogue, jobs=jobs, cache=ExpansionCache(path), budget=cold_budget)
+    assert cold_budget.truncated
+    assert cold_budget.cached == []
+
+    # a full run fills the cache, the budgeted run then reuses the full solves
+    full = template_expansion.expand(templates, small_catalogue, cache=ExpansionCache(path, reuse=False))
+    warm_budget = SolveBudget(steps=STEP_BUDGET)
+    warm = template_expansion.expand(templates, small_catalogue, jobs=jobs, cache=ExpansionCache(path), budget=warm_budget)
+    assert warm.to_dict("records") == full.to_dict("records")
+    assert warm_budget.truncated == []
+    pairs = {(pair["template"], pair["dataset_schema"]) for pair in warm_budget.cached}
+    assert pairs == {(label, schema["udi:name"]) for label in templates.index for schema in small_catalogue}
+    assert warm_budget.to_dict()["cached"] == warm_budget.cached
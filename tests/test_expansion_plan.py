@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+import expansion_plan
+import template_expansion
+
+
+@pytest.fixture(scope="module")
+def expanded(templates, small_catalogue):
+    return template_expansion.expand(templates, small_catalogue)
+
+
+@pytest.mark.parametrize("engine", ["backtracking", "numpy"])
+def test_planned_solutions_match_the_expanded_rows(templates, small_catalogue, expanded, engine):
+    plan_df = expansion_plan.plan(templates, small_catalogue, engine)
+    assert len(plan_df) == len(templates) * len(small_catalogue)
+    rows = expanded.groupby([expanded.index, "dataset_schema"]).size()
+    planned = plan_df.set_index(["template", "dataset_schema"])["solutions"]
+    assert planned[planned > 0].sort_index().to_dict() == rows.sort_index().to_dict()
+    assert (plan_df["json_bytes"] > 0).sum() == (plan_df["solutions"] > 0).sum()
+
+
+def test_plan_report(templates, small_catalogue, expanded, tmp_path, capsys):
+    path = tmp_path / "expansion_plan.csv"
+    expansion_plan.main(templates, small_catalogue, plan_path=str(path))
+    out = capsys.readouterr().out
+    assert f"Expanded rows: {len(expanded):,}" in out
+    assert "Rows by chart type and complexity:" in out
+    saved = pd.read_csv(path)
+    assert saved["solutions"].sum() == len(expanded)
+    assert list(saved.columns) == [
+        "template", "query_template", "chart_type", "chart_complexity", "dataset_schema",
+        "solutions", "json_bytes", "parquet_bytes",
+    ]
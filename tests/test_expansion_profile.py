@@ -0,0 +1,41 @@
+import json
+import pandas as pd
+import pytest
+import expansion_profile
+import template_expansion
+
+
+@pytest.mark.parametrize("engine", ["backtracking", "numpy"])
+def test_profile_is_saved_and_reported(templates, small_catalogue, tmp_path, capsys, engine):
+    df = templates.head(8)
+    profile_path = str(tmp_path / "profile" / "expansion_profile")
+    profile_df = expansion_profile.main(df, small_catalogue, engine=engine, profile_path=profile_path)
+    assert len(profile_df) == len(df) * len(small_catalogue)
+
+    expanded = template_expansion.expand(df, small_catalogue, engine=engine)
+    counts = expanded.groupby([expanded.index, "dataset_schema"]).size()
+    for _, row in profile_df.iterrows():
+        assert row["solutions"] == counts.get((row["template"], row["dataset_schema"]), 0)
+        assert row["options_after"] <= row["options_before"]
+    assert profile_df["checks"].notna().all() == (engine == "backtracking")
+
+    saved = pd.read_csv(profile_path + ".csv")
+    assert list(saved.columns) == list(profile_df.columns)
+    assert saved["domain_sizes"].map(json.loads).tolist() == profile_df["domain_sizes"].tolist()
+    with open(profile_path + ".json") as f:
+        assert [row["solutions"] for row in json.load(f)] == profile_df["solutions"].tolist()
+
+    out = capsys.readouterr().out
+    assert f"Profiled {len(profile_df):,} template x schema pairs" in out
+    table = out.split("Slowest 20 template x schema pairs:\n")[1].split("\n\n")[0].splitlines()
+    # a header and a line per pair, slowest first
+    assert len(table) == 1 + min(20, len(profile_df))
+    totals = [float(line.split()[0].rstrip("s")) for line in table[1:]]
+    assert totals == sorted(totals, reverse=True)
+    assert "Profile saved to" in out
+
+
+def test_unsupported_engine(templates, small_catalogue):
+    assert "python-constraint" not in expansion_profile.PROFILED_ENGINES
+    with pytest.raises(ValueError):
+        expansion_profile.profile(templates.head(1), small_catalogue, engine="python-constraint")
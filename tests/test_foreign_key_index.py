@@ -0,0 +1,51 @@
+import itertools
+import pytest
+import constraint_compiler
+from schema_domain import build_domains
+from template_resolver import resolve_join
+
+
+@pytest.fixture(scope="module")
+def domains(catalogue):
+    return build_domains(catalogue)
+
+
+def test_relationship_lookups_match_the_foreign_key_scans(domains):
+    checked = 0
+    for domain in domains:
+        index = domain.foreign_key_index
+        for sample, related in itertools.product(domain.sample_options, repeat=2):
+            assert index.has_foreign_key(sample, related) == constraint_compiler.has_foreign_key(sample, related)
+            for direction in ("from", "to"):
+                assert (
+                    index.foreign_key_cardinality(sample, related, direction)
+                    == constraint_compiler.foreign_key_cardinality(sample, related, direction)
+                )
+            checked += index.has_foreign_key(sample, related)
+    assert checked > 0
+
+
+def test_spec_joins_match_the_foreign_key_scans(domains):
+    for domain in domains:
+        index = domain.foreign_key_index
+        for sample, related in itertools.product(domain.sample_options, repeat=2):
+            if not index.has_foreign_key(sample, related):
+                continue
+            solution = {"E1": sample, "E2": related}
+            for source in ("from", "to"):
+                slot = ["join", "E1", "E2", source, True]
+                assert resolve_join(slot, solution, index) == resolve_join(slot, solution, None)
+
+
+def test_compiled_relationship_constraints_use_the_index(domains):
+    domain = next(d for d in domains if d.name == "SenNet")
+    function = constraint_compiler.compile_function(
+        "foreign_key_cardinality(E1, E2, 'to') == 'one'", ("E1", "E2"), domain.foreign_key_index
+    )
+    scan = constraint_compiler.compile_function("foreign_key_cardinality(E1, E2, 'to') == 'one'", ("E1", "E2"))
+    pairs = [
+        (sample, related) for sample, related in itertools.product(domain.sample_options, repeat=2)
+        if constraint_compiler.has_foreign_key(sample, related)
+    ]
+    assert pairs
+    assert [function(*pair) for pair in pairs] == [scan(*pair) for pair in pairs]
@@ -0,0 +1,64 @@
+import pytest
+import template_expansion
+import updating_template_generation
+from schema_domain import GenomeIndex
+
+GENOMIC_SCHEMA = {
+    "udi:name": "peaks",
+    "udi:assembly": "hg38",
+    "udi:genes": [
+        {"name": "TP53", "chr": "chr17", "pos": [7668402, 7687550]},
+        {"name": "BRCA1", "chr": "chr17", "pos": [43044295, 43125483]},
+    ],
+    "resources": [{
+        "name": "peaks",
+        "path": "peaks.tsv",
+        "udi:row_count": 500,
+        "schema": {"fields": [
+            {"name": "signal", "udi:data_type": "quantiative point", "udi:cardinality": 300},
+            {"name": "coverage", "udi:data_type": "quantiative segment", "udi:cardinality": 10},
+            {"name": "gene", "udi:data_type": "nominal", "udi:cardinality": 2},
+        ]},
+    }],
+}
+
+
+@pytest.fixture(scope="module")
+def genomic_templates():
+    return updating_template_generation.generate()
+
+
+def test_genomic_field_types_compile(genomic_templates):
+    compiled = [template_expansion.compile_template(row) for _, row in genomic_templates.iterrows()]
+    assert compiled[0]["tags"][0]["allowed_fields"] == ["quantiative point"]
+    assert compiled[1]["tags"][0]["allowed_fields"] == ["quantiative point", "quantiative segment"]
+    assert compiled[1]["locations"] == ["E_L"]
+    # <F:p.q>.c in a constraint refers to the field of the tag
+    assert {"kind": "generic", "variables": ["S_F"], "source": "S_F['udi:cardinality'] < 1000"} in compiled[0]["expanded_constraints"]
+
+
+@pytest.mark.parametrize("engine", ["backtracking", "numpy", "python-constraint"])
+def test_genomic_templates_expand(genomic_templates, engine):
+    expanded = template_expansion.expand(genomic_templates, [GENOMIC_SCHEMA], engine=engine)
+    queries = expanded["query_base"].tolist()
+    assert queries[0] == "Where are signal in peaks?"
+    # a region and both loci of each gene, only signal has more than 20 distinct values
+    assert queries[1:] == [
+        f"Is the signal at {location} a peak or a valley?"
+        for location in [
+            "TP53 (chr17:7668402-7687550)", "chr17:7668402", "chr17:7687550",
+            "BRCA1 (chr17:43044295-43125483)", "chr17:43044295", "chr17:43125483",
+        ]
+    ]
+    assert set(expanded["spec"].str.contains('"data_source": "peaks.tsv"')) == {True}
+
+
+def test_gene_on_several_chromosomes():
+    index = GenomeIndex([{"name": "PAR", "chr": ["chrX", "chrY"], "pos": [100, 200]}])
+    assert index.overlapping("chrX", 50, 150) == ["PAR"]
+    assert index.overlapping("chrY", 50, 150) == []
+
+
+def test_chromosomes_must_match_positions():
+    with pytest.raises(ValueError):
+        GenomeIndex([{"name": "PAR", "chr": ["chrX", "chrY"], "pos": [100, 200, 300]}])
@@ -0,0 +1,134 @@
+import collections
+import functools
+import json
+import pandas as pd
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from frictionless.resources import TableResource
+import column_profile
+import process_datapackage
+
+SAMPLES = """id\tdonor\tweight\tflag\ttags\tdescription
+s1\td1\t15.552999999999999\ttrue\t["a","b"]\tplain
+s2\td1\t1.5\tfalse\t["a"]\t"the ""quoted"" part"
+s3\td2\t\t\t\tUBERON:1
+s4\td3\t2.25\ttrue\t["c"]\tUBERON:2
+s5\td2\t3\tfalse\t[]\tplain
+"""
+
+DONORS = """id,age,site
+d1,40,UBERON:1
+d2,,UBERON:2
+d3,62,
+"""
+
+REFERENCES = pd.DataFrame({"id": ["UBERON:1", "UBERON:2"], "name": ["heart", "lung"]})
+
+
+@pytest.fixture
+def package_path(tmp_path):
+    folder = tmp_path / "package"
+    folder.mkdir()
+    (folder / "samples.tsv").write_text(SAMPLES)
+    (folder / "donors.csv").write_text(DONORS)
+    descriptor = {
+        "name": "package",
+        "resources": [
+            {
+                "name": "samples",
+                "path": "samples.tsv",
+                "format": "tsv",
+                # frictionless only turns doubleQuote off with an escapeChar
+                "dialect": {"csv": {"delimiter": "\t", "doubleQuote": False}},
+                "schema": {
+                    "fields": [
+                        {"name": "id", "type": "string"},
+                        {"name": "donor", "type": "string"},
+                        {"name": "weight", "type": "number"},
+                        {"name": "flag", "type": "boolean"},
+                        {"name": "tags", "type": "array"},
+                        {"name": "description", "type": "string"},
+                    ],
+                    "primaryKey": ["id"],
+                    "foreignKeys": [{"fields": ["donor"], "reference": {"resource": "donors", "fields": ["id"]}}],
+                },
+            },
+            {
+                "name": "donors",
+                "path": "donors.csv",
+                "schema": {
+                    "fields": [
+                        {"name": "id", "type": "string"},
+                        {"name": "age", "type": "integer"},
+                        {"name": "site", "type": "string"},
+                    ],
+                },
+            },
+        ],
+    }
+    path = folder / "datapackage.json"
+    path.write_text(json.dumps(descriptor))
+    return str(path)
+
+
+def augment(package_path, out_dir, executor=None):
+    """
+    The augmented package and the written resources.
+    """
+    references = (REFERENCES, str(out_dir), False)
+    package = process_datapackage.augment_datapackage(
+        package_path, str(out_dir / "datapackage.json"), executor, references=references
+    )
+    tables = {name: (out_dir / f"{name}.tsv").read_text() for name in ["samples", "donors"]}
+    return package, tables
+
+
+def read_in_chunks(monkeypatch, chunk_rows=2):
+    # every resource is larger than IN_MEMORY_BYTES
+    monkeypatch.setattr(process_datapackage, "read_frame", functools.partial(column_profile.read_frame, in_memory_bytes=0))
+    monkeypatch.setattr(process_datapackage, "read_chunks", functools.partial(column_profile.read_chunks, chunk_rows=chunk_rows))
+
+
+def test_chunked_resources_are_written_like_in_memory_ones(package_path, tmp_path, monkeypatch):
+    in_memory, in_memory_tables = augment(package_path, tmp_path / "in_memory")
+    read_in_chunks(monkeypatch)
+    chunked, chunked_tables = augment(package_path, tmp_path / "chunked")
+    assert chunked == in_memory
+    assert chunked_tables == in_memory_tables
+    samples = pd.read_csv(tmp_path / "chunked" / "samples.tsv", sep="\t", dtype=str, keep_default_na=False)
+    assert samples["description"].tolist() == ["plain", 'the "quoted" part', "heart", "lung", "plain"]
+    assert samples["weight"][0] == "15.552999999999999"
+    assert samples["flag"].tolist() == ["True", "False", "", "True", "False"]
+    assert samples["tags"][0] == "['a', 'b']"
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_every_resource_is_read_once(package_path, tmp_path, monkeypatch, chunked):
+    if chunked:
+        read_in_chunks(monkeypatch)
+    reads = collections.Counter()
+    to_pandas = TableResource.to_pandas
+    read_chunks = process_datapackage.read_chunks
+
+    def count_to_pandas(resource, *args, **kwargs):
+        reads[resource.name, "to_pandas"] += 1
+        return to_pandas(resource, *args, **kwargs)
+
+    def count_read_chunks(resource, *args, **kwargs):
+        reads[resource.name, "read_chunks"] += 1
+        return read_chunks(resource, *args, **kwargs)
+
+    monkeypatch.setattr(TableResource, "to_pandas", count_to_pandas)
+    monkeypatch.setattr(process_datapackage, "read_chunks", count_read_chunks)
+    # profiled and written with the reference values
+    augment(package_path, tmp_path / "out")
+    reader = "read_chunks" if chunked else "to_pandas"
+    assert reads == {("samples", reader): 1, ("donors", reader): 1}
+
+
+def test_parallel_profiling_matches_serial(package_path, tmp_path):
+    serial = augment(package_path, tmp_path / "serial")
+    executor = ProcessPoolExecutor(max_workers=2, initializer=process_datapackage.init_worker, initargs=(REFERENCES,))
+    with executor:
+        parallel = augment(package_path, tmp_path / "parallel", executor)
+    assert parallel == serial
@@ -0,0 +1,26 @@
+import pytest
+from schema_domain import build_domains, thaw
+
+
+def test_options_are_read_only(small_catalogue):
+    domain = build_domains(small_catalogue)[0]
+    sample, field = domain.sample_options[0], domain.field_options[0]
+    with pytest.raises(TypeError):
+        sample["udi:cardinality"] = 0
+    with pytest.raises(TypeError):
+        field["foreignKeys"][0]["fields"] = "id"
+    with pytest.raises(AttributeError):
+        domain.field_options.append(field)
+    # fields share the foreign keys of their sample
+    assert field["foreignKeys"] is sample["foreignKeys"]
+
+
+def test_thawed_options_match_the_schema(small_catalogue):
+    schema = small_catalogue[0]
+    domain = build_domains(small_catalogue)[0]
+    resource = next(r for r in schema["resources"] if r["name"] == domain.sample_options[0]["entity"])
+    sample = thaw(domain.sample_options[0])
+    assert sample["foreignKeys"] == resource["schema"].get("foreignKeys", [])
+    assert sample["fields"] == [field["name"] for field in resource["schema"]["fields"]]
+    field = thaw(domain.field_options[0])
+    assert {k: v for k, v in field.items() if k not in ("entity", "url", "foreignKeys")} == resource["schema"]["fields"][0]
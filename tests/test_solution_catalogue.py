@@ -0,0 +1,64 @@
+import pyarrow.parquet as pq
+import pytest
+import template_expansion
+from schema_domain import build_domains, thaw
+from solution_catalogue import SolutionCatalogue, solution_name_columns
+
+
+def readable(variable, option):
+    # fields leave out the foreign keys, they belong to the sample
+    option = thaw(option)
+    if "_F" in variable:
+        option.pop("foreignKeys")
+    return option
+
+
+@pytest.fixture(scope="module")
+def expanded(templates, small_catalogue):
+    return template_expansion.expand(templates, small_catalogue)
+
+
+def test_materialized_solutions_match_the_solver_solutions(templates, small_catalogue, expanded):
+    expected = []
+    for _, template in templates.iterrows():
+        _, compiled = template_expansion.prepare_template(template)
+        for domain in build_domains(small_catalogue):
+            solutions = template_expansion.solve_template(compiled, domain)
+            for solution in template_expansion.order_solutions(solutions, compiled, domain):
+                expected.append({
+                    variable.replace("_", "."): readable(variable, option) for variable, option in solution.items()
+                })
+    materialized = SolutionCatalogue(small_catalogue).materialize(expanded)
+    assert list(materialized["solution"]) == expected
+    # the expanded rows keep the compact references
+    assert all(isinstance(reference, tuple) for reference in expanded["solution"].iloc[0].values())
+
+
+def test_solution_name_columns(small_catalogue, expanded):
+    catalogue = SolutionCatalogue(small_catalogue)
+    df = catalogue.add_solution_columns(expanded.copy())
+    materialized = catalogue.materialize(expanded)
+    for position in range(0, len(df), 97):
+        solution = materialized["solution"].iloc[position]
+        for variable, option in solution.items():
+            # samples are named by their entity, fields and locations by their name
+            attribute = "name" if "." in variable else "entity"
+            assert df[variable.replace(".", "_") + "_name"].iloc[position] == option[attribute]
+
+
+def test_streamed_parquet_keeps_the_solution_names(templates, small_catalogue, expanded, tmp_path):
+    catalogue = SolutionCatalogue(small_catalogue)
+    columns = solution_name_columns(templates)
+    batches = template_expansion.expand_iter(templates, small_catalogue, batch_size=50)
+    path = str(tmp_path / "training_data.parquet")
+    rows = template_expansion.write_parquet((catalogue.add_solution_names(batch, columns) for batch in batches), path)
+    table = pq.read_table(path)
+    assert rows == table.num_rows == len(expanded)
+    assert "solution" not in table.column_names
+    expected = catalogue.add_solution_columns(expanded.copy())
+    for column in columns:
+        values = table.column(column).to_pylist()
+        if column in expected:
+            assert values == expected[column].astype(object).where(expected[column].notna(), None).tolist()
+        else:
+            assert set(values) == {None}
@@ -0,0 +1,60 @@
+import collections
+import pytest
+import template_expansion
+from solution_sampling import SamplingPolicy, allocate_evenly, allocate_proportionally
+
+SAMPLE_SIZE = 200
+
+
+def sampled_rows(templates, catalogue, policy, **kwargs):
+    return template_expansion.expand(templates, catalogue, sampling=policy, **kwargs).to_dict("records")
+
+
+def row_key(row):
+    return (row["query_base"], row["spec"], row["dataset_schema"])
+
+
+@pytest.fixture(scope="module")
+def full_rows(templates, small_catalogue):
+    return template_expansion.expand(templates, small_catalogue).to_dict("records")
+
+
+def test_sample_is_reproducible_under_a_seed(templates, small_catalogue, full_rows):
+    sample = sampled_rows(templates, small_catalogue, SamplingPolicy(SAMPLE_SIZE, seed=1))
+    assert len(sample) == SAMPLE_SIZE < len(full_rows)
+    assert {row_key(row) for row in sample} <= {row_key(row) for row in full_rows}
+    assert sampled_rows(templates, small_catalogue, SamplingPolicy(SAMPLE_SIZE, seed=1)) == sample
+    assert sampled_rows(templates, small_catalogue, SamplingPolicy(SAMPLE_SIZE, seed=2)) != sample
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_parallel_sample_matches_serial(templates, small_catalogue, executor):
+    policy = SamplingPolicy(SAMPLE_SIZE, stratify="chart_type", seed=3)
+    serial = sampled_rows(templates, small_catalogue, policy)
+    assert sampled_rows(templates, small_catalogue, policy, jobs=2, executor=executor) == serial
+
+
+def test_schema_strata_get_even_quotas(templates, small_catalogue, full_rows):
+    available = collections.Counter(row["dataset_schema"] for row in full_rows)
+    # every schema has more solutions than its share
+    size = len(available) * (min(available.values()) // 2)
+    sample = sampled_rows(templates, small_catalogue, SamplingPolicy(size, stratify="schema", seed=4))
+    counts = collections.Counter(row["dataset_schema"] for row in sample)
+    assert counts == {schema: size // len(available) for schema in available}
+
+
+def test_unknown_strata():
+    with pytest.raises(ValueError):
+        SamplingPolicy(10, stratify=["schema", "colour"])
+
+
+def test_allocate_evenly_passes_on_the_share_of_small_keys():
+    assert allocate_evenly(10, {"a": 1, "b": 20, "c": 20}) == {"a": 1, "b": 5, "c": 4}
+    assert allocate_evenly(50, {"a": 1, "b": 2}) == {"a": 1, "b": 2}
+
+
+def test_allocate_proportionally_keeps_the_size():
+    shares = allocate_proportionally(10, [1, 2, 7])
+    assert sum(shares) == 10
+    assert shares == [1, 2, 7]
+    assert allocate_proportionally(3, [0, 0]) == [0, 0]
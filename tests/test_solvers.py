@@ -0,0 +1,29 @@
+import pytest
+import template_expansion
+from schema_domain import build_domains
+
+ENGINES = ["backtracking", "numpy", "python-constraint"]
+
+
+def solve_all(templates, dataset_schemas, engine):
+    solutions = []
+    for domain in build_domains(dataset_schemas):
+        for _, row in templates.iterrows():
+            _, compiled = template_expansion.prepare_template(row)
+            solved = template_expansion.solve_template(compiled, domain, engine)
+            solutions.append(template_expansion.order_solutions(solved, compiled, domain))
+    return solutions
+
+
+@pytest.mark.parametrize("engine", ["numpy", "python-constraint"])
+def test_engines_find_the_same_solutions(templates, small_catalogue, engine):
+    expected = solve_all(templates, small_catalogue, "backtracking")
+    assert sum(len(solutions) for solutions in expected) > 0
+    assert solve_all(templates, small_catalogue, engine) == expected
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_expand_rows_match_between_engines(templates, small_catalogue, engine):
+    expected = template_expansion.expand(templates, small_catalogue)
+    expanded = template_expansion.expand(templates, small_catalogue, engine=engine)
+    assert expanded.to_dict("records") == expected.to_dict("records")
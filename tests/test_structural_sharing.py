@@ -0,0 +1,26 @@
+import pytest
+import template_expansion
+from schema_domain import build_domains
+from template_expansion import SolutionCache, order_solutions, prepare_template, solve_template
+
+
+@pytest.mark.parametrize("engine", ["backtracking", "numpy"])
+def test_shared_structural_solves_match_solving_each_schema(templates, small_catalogue, engine):
+    domains = build_domains(small_catalogue)
+    compiled_templates = [prepare_template(row)[1] for _, row in templates.iterrows()]
+    cache = SolutionCache(compiled_templates, domains)
+    # the three C2M2 schemas share a structure, hubmap doesn't
+    assert len(cache.shared_structures) == 1
+    for template_index, compiled in enumerate(compiled_templates):
+        for domain in domains:
+            expected = order_solutions(solve_template(compiled, domain, engine), compiled, domain)
+            assert cache.solve(template_index, compiled, domain, engine) == expected
+
+
+def test_structural_constraints(templates):
+    compiled = [prepare_template(row)[1] for _, row in templates.iterrows()]
+    constraints = [c for template in compiled for c in template["expanded_constraints"]]
+    structural = [c for c in constraints if template_expansion.is_structural(c)]
+    assert 0 < len(structural) < len(constraints)
+    assert all(c["kind"] != "overlap" for c in structural)
+    assert not any("udi:cardinality" in c["source"] for c in structural)
@@ -0,0 +1,58 @@
+import pytest
+from constraint_compiler import compile_constraints
+from schema_domain import build_domains
+from template_expansion import compile_template, extract_tags, solve_template
+
+
+def field_key(option):
+    # samples only have an entity
+    return (option["entity"], option.get("name"))
+
+
+def solution_key(solution, renames=None):
+    renames = renames or {}
+    return tuple(sorted((renames.get(variable, variable), field_key(option)) for variable, option in solution.items()))
+
+
+@pytest.fixture(scope="module")
+def symmetric_templates(templates):
+    return [row for _, row in templates.iterrows() if row["symmetric"]]
+
+
+@pytest.mark.parametrize("engine", ["backtracking", "numpy"])
+def test_symmetric_solutions_match_the_unordered_solutions(symmetric_templates, catalogue, engine):
+    assert symmetric_templates
+    domains = build_domains(catalogue)
+    removed = 0
+    for row in symmetric_templates:
+        ordered = compile_template(row)
+        unordered = compile_template(dict(row, symmetric=[]))
+        for domain in domains:
+            kept = {solution_key(solution) for solution in solve_template(ordered, domain, engine)}
+            solutions = solve_template(unordered, domain, engine)
+            assert kept <= {solution_key(solution) for solution in solutions}
+            for group in row["symmetric"]:
+                # the groups of the templates are fields of the default sample
+                first, second = [f"{ordered['default_sample']}_{tag}" for tag in group]
+                swap = {first: second, second: first}
+                # every solution is kept in exactly one of its two orders
+                for solution in solutions:
+                    key, swapped = solution_key(solution), solution_key(solution, swap)
+                    assert (key in kept) != (swapped in kept)
+            removed += len(solutions) - len(kept)
+    assert removed > 0
+
+
+def test_constraints_that_change_with_the_swap_are_rejected():
+    query = "What does the combined data of <E1> and <E2> look like?"
+    extract = extract_tags(query)
+    constraints = ["E1.c > 0", "E2.c > 0", "E1.r.E2.c.to == 'one'"]
+    with pytest.raises(ValueError, match="swapped"):
+        compile_constraints(constraints, extract["tags"], extract["default_sample"], [["E1", "E2"]])
+    with pytest.raises(ValueError, match="same type"):
+        compile_constraints(
+            ["F1.c > 1", "F2.c > 1"],
+            extract_tags("What is the average <F1:q> for each <F2:n>?")["tags"],
+            "E",
+            [["F1", "F2"]],
+        )
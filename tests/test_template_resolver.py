@@ -0,0 +1,96 @@
+import re
+import pytest
+from constraint_compiler import SAMPLE_PATTERN
+from schema_domain import build_domains
+from template_expansion import prepare_template, solve_template
+from template_resolver import COMPARISONS, TAG_PATTERN, compile_spec_segments, resolve_batch, resolve_segments
+
+
+def replace_query_tags(query_template, tags, solution):
+    """
+    The query resolution the segments replace, one str.replace per tag.
+    """
+    query = query_template
+    for tag in tags:
+        variable = tag["field"] or tag["location"]
+        resolved = solution[tag["sample"] + "_" + variable]["name"] if variable else solution[tag["sample"]]["entity"]
+        query = query.replace(f"<{tag['original']}>", resolved, 1)
+    return query
+
+
+def replace_spec_tags(spec_template, default_sample, solution):
+    """
+    The spec resolution the segments replace, a search and str.replace per tag.
+    """
+    spec = spec_template
+    while (match := re.search(TAG_PATTERN, spec)) is not None:
+        match = match.group(0)
+        parts = match.strip("<>").split(".")
+        if len(parts) == 1:
+            if SAMPLE_PATTERN.fullmatch(parts[0]):
+                resolved = solution[parts[0]]["entity"]
+            else:
+                resolved = solution[default_sample + "_" + parts[0]]["name"]
+        elif parts[1] == "url":
+            resolved = solution[parts[0]]["url"]
+        elif len(parts) == 2:
+            resolved = solution[parts[0] + "_" + parts[1]]["name"]
+        else:
+            S1, _, S2, _, source = parts
+            key = next(fk for fk in solution[S1]["foreignKeys"] if fk["reference"]["resource"] == solution[S2]["entity"])
+            resolved = key["fields"] if source == "from" else key["reference"]["fields"]
+            if len(resolved) == 1:
+                resolved = resolved[0]
+            else:
+                resolved = f"[\"{'","'.join(resolved)}\"]"
+                match = f'"{match}"'
+        spec = spec.replace(match, resolved, 1)
+    for content, comparison in COMPARISONS:
+        spec = spec.replace(content, comparison)
+    return spec
+
+
+@pytest.fixture(scope="module")
+def solved(templates, small_catalogue):
+    """
+    (compiled template, row, domain, solutions) of every template x schema with solutions.
+    """
+    pairs = []
+    for domain in build_domains(small_catalogue):
+        for _, template in templates.iterrows():
+            row, compiled = prepare_template(template)
+            solutions = solve_template(compiled, domain)
+            if solutions:
+                pairs.append((compiled, row, domain, solutions))
+    return pairs
+
+
+def test_segments_resolve_like_replacing_the_tags(solved):
+    joins = 0
+    for compiled, row, domain, solutions in solved:
+        default_sample = next((tag["sample"] for tag in compiled["tags"] if tag["sample"]), "E")
+        joins += any(segment[0] == "join" for segment in compiled["spec_segments"] if not isinstance(segment, str))
+        for solution in solutions[:20]:
+            assert resolve_segments(compiled["query_segments"], solution) == replace_query_tags(
+                row["query_template"], compiled["tags"], solution
+            )
+            assert resolve_segments(compiled["spec_segments"], solution, domain.foreign_key_index) == replace_spec_tags(
+                row["spec_template"], default_sample, solution
+            )
+    assert joins > 0
+
+
+def test_batch_resolution(solved):
+    for compiled, _, domain, solutions in solved:
+        assert resolve_batch(compiled["spec_segments"], solutions, domain.foreign_key_index) == [
+            resolve_segments(compiled["spec_segments"], solution, domain.foreign_key_index) for solution in solutions
+        ]
+
+
+def test_comparisons_are_rewritten_once():
+    spec_template = '{"filter": "d[\'<F>\'] {lte} 5 && d[\'<F>\'] {gt} 1 && <E.url> {lt} {gte}"}'
+    tags = [{"sample": "E", "field": "F", "location": None, "allowed_fields": ["nominal"], "original": "F:n"}]
+    segments = compile_spec_segments(spec_template, tags)
+    solution = {"E": {"entity": "donors", "url": "donors.tsv"}, "E_F": {"name": "age"}}
+    assert resolve_segments(segments, solution) == replace_spec_tags(spec_template, "E", solution)
+    assert resolve_segments(segments, solution) == '{"filter": "d[\'age\'] <= 5 && d[\'age\'] > 1 && donors.tsv < >="}'
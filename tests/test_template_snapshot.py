@@ -0,0 +1,23 @@
+import template_snapshot
+
+
+def test_snapshot_is_rebuilt_for_a_new_udi_grammar_py(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "templates.arrow")
+    template_snapshot.load_templates(path)
+    assert "Compiled" in capsys.readouterr().out
+    template_snapshot.load_templates(path)
+    assert "Loaded" in capsys.readouterr().out
+
+    installed = template_snapshot.package_version
+    monkeypatch.setattr(
+        template_snapshot, "package_version",
+        lambda package: "999.0" if package == "udi_grammar_py" else installed(package),
+    )
+    rebuilt = template_snapshot.load_templates(path)
+    assert "Compiled 0 of" in capsys.readouterr().out
+    assert len(rebuilt) > 0
+
+
+def test_template_hash_covers_udi_grammar_py():
+    assert "udi_grammar_py" in template_snapshot.TEMPLATE_PACKAGES
+    assert template_snapshot.package_version("udi_grammar_py") is not None
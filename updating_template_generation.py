@@ -1,7 +1,6 @@
-import pandas as pd
 #from udi_grammar_py import Chart, Op, rolling
 from enum import Enum
-import json
+from template_registry import TemplateRegistry
 #import gosling as gos
 
 class QueryType(Enum):
@@ -29,49 +28,8 @@ class ChartType(Enum):
     #GROUPED_DOT = "grouped_dot"
 
 
-def add_row(df, query_template, spec, constraints, query_type: QueryType, chart_type: ChartType):
-    spec_key_count = get_total_key_count(spec)
-    if spec_key_count <= 12:
-        complexity = "simple"
-    elif spec_key_count <= 24:
-        complexity = "medium"
-    elif spec_key_count <= 36:
-        complexity = "complex"
-    else:
-        complexity = "extra complex"
-    df.loc[len(df)] = {
-        "query_template": query_template,
-        "constraints": constraints,
-        "spec_template": json.dumps(spec),
-        "query_type": query_type.value,
-        "creation_method": "template",
-        "chart_type": chart_type.value,
-        "chart_complexity": complexity,
-        "spec_key_count": spec_key_count
-    }
-    return df
-
-def get_total_key_count(nested_dict):
-    if isinstance(nested_dict, dict):
-        return sum(get_total_key_count(value) for value in nested_dict.values())
-    elif isinstance(nested_dict, list):
-        return sum(get_total_key_count(item) for item in nested_dict)
-    else:
-        return 1
-
 def generate():
-    df = pd.DataFrame(
-        columns=[
-            "query_template",
-            "constraints",
-            "spec_template",
-            "query_type",
-            "creation_method",
-            "chart_type",
-            "chart_complexity",
-            "spec_key_count",
-        ]
-    )
+    registry = TemplateRegistry()
 
     # Define recurring constraints
     overlap = "F1['name'] in F2['udi:overlapping_fields'] or F2['udi:overlapping_fields'] == 'all'"
@@ -83,8 +41,7 @@ def generate():
     Constraints:
         S is some genomic data --> ie., sample
     '''
-    df = add_row(
-        df,
+    registry.add_row(
         query_template="Where are <F:p.q> in <S>?",
         spec=(
             {
@@ -102,8 +59,7 @@ def generate():
         chart_type=ChartType.POINT,
     )
 
-    df = add_row(
-        df,
+    registry.add_row(
         # can represent with pipe character1
         query_template="Is the <F:p.q|s.q> at <L> a peak or a valley?",
         spec=(
@@ -123,10 +79,10 @@ def generate():
         chart_type=ChartType.LINE,
     )
 
-    return df
+    return registry.to_dataframe()
 
 
 if __name__ == "__main__":
     df = generate()
-    pd.DataFrame.to_csv(df, 'dataframe_for_presentation.csv')
+    df.to_csv('dataframe_for_presentation.csv')
     print(df.head())